@@ -0,0 +1,143 @@
+"""Helpers for the read-only json api.
+
+List endpoints are paginated with ?page= and ?page_size=. Element endpoints
+  take ?fields= to pick which fields each element gets, and subject area
+  trees take ?depth= to cut the tree off below some level.
+
+Every response has an ETag. A subject area's tree only changes when its
+  summary_version does, so the tree's ETag is worked out from the version,
+  and a client that already has the tree gets a 304 without the tree being
+  loaded at all.
+"""
+import hashlib
+import json
+
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.http import JsonResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+# Change this when the shape of api responses changes, so old ETags don't match.
+API_VERSION = 1
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+ORGANIZATION_FIELDS = ('id', 'name', 'org_type', 'public', 'alias_sa', 'alias_sda',
+                       'alias_ca', 'alias_eu', 'alias_lt')
+ELEMENT_FIELDS = ('id', 'type', 'text', 'public', 'description', 'student_friendly')
+
+
+class ApiError(Exception):
+    """A bad request, reported to the client as a json error with status 400."""
+    pass
+
+
+def parse_fields(value, allowed):
+    """Return the fields named in a comma-separated ?fields= value, or all of
+    allowed if there's no value."""
+    if not value:
+        return allowed
+    fields = tuple(field.strip() for field in value.split(',') if field.strip())
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ApiError("unknown fields: %s; choose from %s"
+                       % (', '.join(unknown), ', '.join(allowed)))
+    return fields
+
+def parse_depth(value):
+    """Return the ?depth= value as a non-negative int, or None for the whole tree."""
+    if value in (None, ''):
+        return None
+    try:
+        depth = int(value)
+    except ValueError:
+        depth = -1
+    if depth < 0:
+        raise ApiError('depth must be a whole number')
+    return depth
+
+def get_page(request, items):
+    """Return (page of items, pagination data) for the request's ?page= and ?page_size=."""
+    try:
+        page_size = min(int(request.GET.get('page_size', API_PAGE_SIZE)), API_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ApiError('page_size must be a number')
+    if page_size < 1:
+        raise ApiError('page_size must be at least 1')
+    paginator = Paginator(items, page_size)
+    try:
+        page = paginator.page(request.GET.get('page', 1))
+    except (EmptyPage, PageNotAnInteger):
+        raise ApiError('no page %s; there are %d pages'
+                       % (request.GET.get('page'), paginator.num_pages))
+    return page, {'count': paginator.count,
+                  'page': page.number,
+                  'num_pages': paginator.num_pages,
+                  }
+
+def serialize_organization(organization, fields=ORGANIZATION_FIELDS):
+    return {field: getattr(organization, field) for field in fields}
+
+def serialize_element(element, fields):
+    data = {}
+    for field in fields:
+        if field == 'type':
+            data[field] = element.path_key
+        elif field == 'text':
+            data[field] = getattr(element, element.text_field)
+        else:
+            data[field] = getattr(element, field)
+    return data
+
+def serialize_tree(tree, fields, depth=None):
+    """Nest a SubjectAreaTree's elements under their parents, down to depth levels
+    below the subject area. The subject area's children are its general cas,
+    then its sdas, as on the summary page."""
+    def node(element, children, level):
+        data = serialize_element(element, fields)
+        if depth is None or level < depth:
+            data['children'] = [child_node(child, level + 1) for child in children]
+        return data
+
+    def child_node(element, level):
+        if element.path_key == 'sda':
+            return node(element, element.cas, level)
+        if element.path_key == 'ca':
+            return node(element, element.eus, level)
+        if element.path_key == 'eu':
+            return node(element, element.lts, level)
+        return serialize_element(element, fields)
+
+    return node(tree.subject_area, tree.general_cas + tree.sdas, 0)
+
+def get_tree_etag(sa, editor, fields, depth):
+    """Work out a subject area tree's ETag without loading the tree."""
+    variant = 'editor' if editor else 'public'
+    key = json.dumps([API_VERSION, sa.id, sa.summary_version, variant, fields, depth])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def is_not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+def not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = quote_etag(etag)
+    return response
+
+def json_response(request, data, etag=None):
+    """Return data as json, tagged with etag, or with a hash of the json if etag
+    isn't given. Clients that send a matching If-None-Match get a 304."""
+    response = JsonResponse(data)
+    if etag is None:
+        etag = hashlib.sha1(response.content).hexdigest()
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response['ETag'] = quote_etag(etag)
+    return response
+
+def error_response(message, status=400):
+    return JsonResponse({'error': message}, status=status)
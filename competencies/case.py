@@ -0,0 +1,255 @@
+"""Read and write IMS CASE packages, a streaming element at a time.
+
+A package is one JSON object, with a CFDocument and lists of CFItems and
+  CFAssociations. The organization is the CFDocument, and every element is a
+  CFItem. Each element is tied to its parent by an isChildOf association,
+  whose sequenceNumber is the element's position among its siblings,
+  counting from 1. Positions are worked out a level at a time, since the
+  _order values they come from have gaps.
+
+Elements have no identifiers of their own, so CASE identifiers are uuids
+  derived from each element's type and id; exporting twice gives the same
+  identifiers. student_friendly text is written as an item's alternativeLabel,
+  and description as its notes.
+
+Packages can be very large, so neither direction holds the JSON in memory.
+  Export writes the package a chunk of elements at a time. Import parses the
+  file with ijson, once for the tree and then once per level for its items.
+"""
+import json
+import uuid
+
+import ijson
+from ijson.common import ObjectBuilder
+
+from django.utils import timezone
+
+from competencies.models import MODELS_BY_KEY
+from competencies.export import iterate_elements
+from competencies.importer import parse_row
+
+# Identifiers are uuid5s in this namespace.
+CASE_NAMESPACE = uuid.UUID('7f3c1c9e-63d5-5a7b-9d64-0c2f4ba1d0e1')
+
+# The CFItemType of each type of element.
+CASE_ITEM_TYPES = {'sa': 'Subject Area',
+                   'sda': 'Subdiscipline Area',
+                   'ca': 'Competency Area',
+                   'eu': 'Essential Understanding',
+                   'lt': 'Learning Target',
+                   }
+ITEM_TYPE_KEYS = {item_type.lower(): key for key, item_type in CASE_ITEM_TYPES.items()}
+
+# The type given to an item whose CFItemType isn't one of ours, by the type
+#   of its parent.
+DEFAULT_CHILD_KEYS = {'o': 'sa', 'sa': 'ca', 'sda': 'ca', 'ca': 'eu', 'eu': 'lt'}
+
+
+def get_identifier(key, element_id):
+    return str(uuid.uuid5(CASE_NAMESPACE, '%s%d' % (key, element_id)))
+
+def get_link(key, element_id, title):
+    """Return a CASE LinkURI object pointing at an element."""
+    identifier = get_identifier(key, element_id)
+    return {'title': title, 'identifier': identifier, 'uri': 'urn:uuid:' + identifier}
+
+def iterate_objects(items, separator=',\n'):
+    """Yield each object as json, separated so they form the body of a list."""
+    first = True
+    for item in items:
+        yield ('' if first else separator) + json.dumps(item)
+        first = False
+
+def iterate_case(organization, kwargs):
+    """Yield the text of a CASE package of organization's elements that match
+    the visibility filter kwargs, a piece at a time."""
+    changed = timezone.now().isoformat()
+    document_link = get_link('o', organization.id, organization.name)
+
+    yield '{"CFDocument": %s,\n' % json.dumps({
+        'identifier': document_link['identifier'],
+        'uri': document_link['uri'],
+        'creator': organization.name,
+        'title': organization.name,
+        'lastChangeDateTime': changed,
+        'CFPackageURI': document_link,
+        })
+
+    # Items and associations are written in two passes over the elements,
+    #   so only one level's sibling ranks are held at a time.
+    yield '"CFItems": [\n'
+    items = ({'identifier': get_identifier(row['type'], row['id']),
+              'uri': 'urn:uuid:' + get_identifier(row['type'], row['id']),
+              'fullStatement': row['text'],
+              'alternativeLabel': row['student_friendly'],
+              'notes': row['description'],
+              'CFItemType': CASE_ITEM_TYPES[row['type']],
+              'lastChangeDateTime': changed,
+              'CFDocumentURI': document_link,
+              } for row in iterate_elements(organization, kwargs))
+    for piece in iterate_objects(items):
+        yield piece
+
+    yield '],\n"CFAssociations": [\n'
+    for piece in iterate_objects(iterate_associations(organization, kwargs, document_link,
+                                                      changed)):
+        yield piece
+    yield ']}\n'
+
+def get_sibling_ranks(organization, model, kwargs):
+    """Map the id of each element of model that matches kwargs to its position
+    among its siblings that also match, counting from 1."""
+    ranks, last_tree_path, rank = {}, None, 0
+    rows = model.objects.filter(organization=organization, **kwargs).order_by(
+        'tree_path', '_order', 'id').values_list('id', 'tree_path')
+    for id, tree_path in rows.iterator():
+        rank = rank + 1 if tree_path == last_tree_path else 1
+        last_tree_path = tree_path
+        ranks[id] = rank
+    return ranks
+
+def iterate_associations(organization, kwargs, document_link, changed):
+    """Yield an isChildOf association for each element. Only one level's
+    sibling ranks are held at a time."""
+    ranks, ranks_key = {}, None
+    for row in iterate_elements(organization, kwargs):
+        if row['type'] != ranks_key:
+            ranks_key = row['type']
+            ranks = get_sibling_ranks(organization, MODELS_BY_KEY[ranks_key], kwargs)
+        yield {'identifier': get_identifier('is_child_of_' + row['type'], row['id']),
+               'uri': 'urn:uuid:' + get_identifier('is_child_of_' + row['type'], row['id']),
+               'associationType': 'isChildOf',
+               'sequenceNumber': ranks.get(row['id']),
+               'originNodeURI': get_link(row['type'], row['id'], row['text']),
+               'destinationNodeURI': get_link(row['parent_type'], row['parent_id'], ''),
+               'lastChangeDateTime': changed,
+               'CFDocumentURI': document_link,
+               }
+
+def iterate_package(case_file):
+    """Parse a CASE package incrementally, and yield (section, object) for the
+    CFDocument, and for each CFItem and CFAssociation, as each one is read."""
+    sections = {'CFDocument': 'CFDocument',
+                'CFItems.item': 'CFItems',
+                'CFAssociations.item': 'CFAssociations',
+                }
+    builder, section_prefix = None, None
+    for prefix, event, value in ijson.parse(case_file):
+        if builder is None:
+            if event != 'start_map' or prefix not in sections:
+                continue
+            builder, section_prefix = ObjectBuilder(), prefix
+        builder.event(event, value)
+        if event == 'end_map' and prefix == section_prefix:
+            yield sections[section_prefix], builder.value
+            builder = None
+
+def iterate_items(case_file):
+    """Read a CASE package from the start, and yield (position, item) for each
+    CFItem, counting from 1."""
+    case_file.seek(0)
+    position = 0
+    for section, value in iterate_package(case_file):
+        if section == 'CFItems':
+            position += 1
+            yield position, value
+
+def parse_case(case_file):
+    """Read and validate a CASE package, opened in binary mode.
+    Returns (rows, errors), like importer.parse_import(). Errors point at an
+      item by its position in CFItems.
+
+    Items are added top-down from the CFDocument, following isChildOf
+      associations. An item's type comes from its CFItemType when that names
+      one of our types, and otherwise from its parent's type. An item that is
+      the child of more than one parent is placed under the first one.
+
+    The first pass over the file only keeps each item's place in the tree.
+      Then the file is read again for each level, and only that level's items
+      are turned into rows, so no item's text is held before it's needed.
+    """
+    document_id = None
+    # For each item, its position in CFItems and its CFItemType, keyed by identifier.
+    items = {}
+    # For each item, its parent and sequenceNumber, keyed by identifier.
+    parents = {}
+    errors = []
+    try:
+        position = 0
+        for section, value in iterate_package(case_file):
+            if section == 'CFDocument':
+                document_id = value.get('identifier')
+            elif section == 'CFItems':
+                position += 1
+                items[value.get('identifier')] = (position, value.get('CFItemType') or '')
+            elif value.get('associationType') == 'isChildOf':
+                origin = (value.get('originNodeURI') or {}).get('identifier')
+                destination = (value.get('destinationNodeURI') or {}).get('identifier')
+                if origin not in parents:
+                    parents[origin] = (destination, value.get('sequenceNumber'))
+    except (ijson.JSONError, UnicodeDecodeError) as e:
+        return [], ['could not read file: %s' % e]
+    if document_id is None:
+        return [], ['no CFDocument found']
+
+    # Visit items from the top down, so each parent is validated before its children.
+    children = {}
+    for identifier, (parent_id, sequence_number) in parents.items():
+        if identifier in items:
+            children.setdefault(parent_id, []).append(identifier)
+    rows, seen, keys = [], set(), {document_id: 'o'}
+    # Positions of items that already have an error.
+    failed = set()
+    level = [document_id]
+    while level:
+        # The type of each item on this level, keyed by identifier.
+        level_keys = {}
+        for parent_id in level:
+            for identifier in children.get(parent_id, []):
+                if identifier in keys or identifier in level_keys:
+                    continue
+                position, item_type = items[identifier]
+                parent_key = keys[parent_id]
+                key = ITEM_TYPE_KEYS.get(item_type.lower(), DEFAULT_CHILD_KEYS.get(parent_key))
+                if key is None:
+                    failed.add(position)
+                    errors.append('item %d: a %s can\'t have children'
+                                  % (position, CASE_ITEM_TYPES[parent_key].lower()))
+                    continue
+                level_keys[identifier] = key
+
+        level = []
+        for position, item in iterate_items(case_file):
+            identifier = item.get('identifier')
+            if identifier not in level_keys or items[identifier][0] != position:
+                continue
+            parent_id, sequence_number = parents[identifier]
+            row = {'type': level_keys[identifier], 'id': identifier,
+                   'parent_type': keys[parent_id], 'parent_id': parent_id,
+                   'order': sequence_number, 'public': False,
+                   'text': item.get('fullStatement') or '',
+                   'description': item.get('notes') or '',
+                   'student_friendly': item.get('alternativeLabel') or '',
+                   }
+            import_row, row_errors = parse_row(position, row, seen, location='item')
+            errors += row_errors
+            if row_errors:
+                failed.add(position)
+            if import_row:
+                rows.append(import_row)
+                level.append(identifier)
+        for identifier in level:
+            keys[identifier] = level_keys[identifier]
+
+    for identifier, (position, item_type) in items.items():
+        if identifier in keys or position in failed:
+            continue
+        parent_id = parents.get(identifier, (None, None))[0]
+        if parent_id in items:
+            errors.append('item %d: its parent, item %d, was not imported'
+                          % (position, items[parent_id][0]))
+        else:
+            errors.append('item %d: not a child of the CFDocument or of another item'
+                          % position)
+    errors.sort(key=lambda error: int(error.split()[1].rstrip(':')))
+    return rows, errors
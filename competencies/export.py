@@ -0,0 +1,84 @@
+"""Export an organization's elements as JSON Lines, CSV or CASE, a row at a time.
+
+Rows come level by level, from subject areas down to learning targets, so a
+  parent always comes before its children. order sorts an element among its
+  siblings; there can be gaps between the values. Elements are read in chunks
+  by id, so memory use doesn't grow with the size of the organization. CASE
+  packages are written by case.py, from the same rows.
+"""
+import csv
+import json
+
+from competencies.models import TREE_MODELS, parse_tree_path
+
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_FORMATS = ('jsonl', 'csv', 'case')
+
+# (content type, file extension) for each format.
+EXPORT_FILE_TYPES = {'jsonl': ('application/x-ndjson', 'jsonl'),
+                     'csv': ('text/csv', 'csv'),
+                     'case': ('application/json', 'json'),
+                     }
+
+EXPORT_FIELDS = ('type', 'id', 'parent_type', 'parent_id', 'order', 'public', 'text',
+                 'description', 'student_friendly')
+
+
+def iterate_in_chunks(queryset, chunk_size):
+    """Yield the rows of a values() queryset, fetching chunk_size rows at a time.
+    Pages by id, so each chunk is one indexed query."""
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by('id')[:chunk_size])
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]['id']
+
+def iterate_elements(organization, kwargs):
+    """Yield a dict for each element of organization that matches the
+    visibility filter kwargs, with the keys in EXPORT_FIELDS."""
+    for model in TREE_MODELS:
+        elements = model.objects.filter(organization=organization, **kwargs).values(
+            'id', 'tree_path', '_order', 'public', model.text_field, 'description',
+            'student_friendly')
+        for element in iterate_in_chunks(elements, EXPORT_CHUNK_SIZE):
+            parent_type, parent_id = parse_tree_path(element['tree_path'])[-1]
+            yield {'type': model.path_key,
+                   'id': element['id'],
+                   'parent_type': parent_type,
+                   'parent_id': parent_id,
+                   'order': element['_order'],
+                   'public': element['public'],
+                   'text': element[model.text_field],
+                   'description': element['description'],
+                   'student_friendly': element['student_friendly'],
+                   }
+
+class LineBuffer():
+    """File-like object that hands back whatever is written to it,
+    so csv.writer can produce one line at a time."""
+    def write(self, value):
+        return value
+
+def iterate_jsonl(elements):
+    for element in elements:
+        yield json.dumps(element) + '\n'
+
+def iterate_csv(elements):
+    writer = csv.DictWriter(LineBuffer(), fieldnames=EXPORT_FIELDS)
+    yield writer.writerow(dict(zip(EXPORT_FIELDS, EXPORT_FIELDS)))
+    for element in elements:
+        yield writer.writerow(element)
+
+def iterate_export(organization, export_format, kwargs):
+    """Yield the lines of an export of organization, in export_format."""
+    if export_format == 'case':
+        from competencies.case import iterate_case
+        return iterate_case(organization, kwargs)
+    elements = iterate_elements(organization, kwargs)
+    if export_format == 'csv':
+        return iterate_csv(elements)
+    return iterate_jsonl(elements)
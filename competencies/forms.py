@@ -9,3 +9,11 @@ class ForkForm(forms.Form):
     #  Requires passing forking_org to __init__().
     available_organizations = Organization.objects.filter(public=True)
     organization = forms.ModelChoiceField(queryset=available_organizations, empty_label=None)
+
+class ImportForm(forms.Form):
+    """Upload a JSON Lines, CSV or CASE file of elements to add to an org."""
+    import_file = forms.FileField()
+    import_format = forms.ChoiceField(choices=(('jsonl', 'JSON Lines'), ('csv', 'CSV'),
+                                               ('case', 'CASE package')))
+    dry_run = forms.BooleanField(required=False, initial=True,
+                                 help_text='Check the file, without importing anything.')
@@ -0,0 +1,50 @@
+"""In-process cache for rendered page fragments.
+
+Entries are keyed by a version stamp stored in the db, such as
+  SubjectArea.summary_version, so every process sees an edit as soon as the
+  version is bumped. Old entries are never read again, and age out of the LRU.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+
+
+class LRUCache(object):
+    """A dict with a maximum size, that drops its least recently used entry when full."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        """Return the value stored for key, or None."""
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Rendered sa_summary trees, keyed by (sa id, summary_version, variant).
+summary_cache = LRUCache(getattr(settings, 'SUMMARY_CACHE_SIZE', 500))
+
+def get_summary_key(subject_area, editor):
+    """Editors see private elements, so they get their own copy of a summary."""
+    variant = 'editor' if editor else 'public'
+    return (subject_area.id, subject_area.summary_version, variant)
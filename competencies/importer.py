@@ -0,0 +1,234 @@
+"""Import a tree of elements into an organization, from JSON Lines, CSV or CASE.
+
+Files have the layout that export.py writes: one row per element, with the
+  fields in EXPORT_FIELDS. id and parent_id only have to be unique within the
+  file, and a parent's row has to come before its children's rows. order sorts
+  siblings, and may be left out to keep the order of the file.
+
+CASE packages are read by case.py, and turned into the same rows.
+
+The whole file is validated before anything is written. Then each level is
+  created with one bulk insert, in a single transaction.
+"""
+import codecs
+import csv
+import json
+
+from django.db import transaction
+
+from competencies.models import Organization, TREE_MODELS, MODELS_BY_KEY, get_next_order
+from competencies.export import EXPORT_FIELDS
+from competencies import utils
+
+IMPORT_FORMATS = ('jsonl', 'csv', 'case')
+
+# The types each type of element may be placed under.
+PARENT_KEYS = {'sa': ('o',),
+               'sda': ('sa',),
+               'ca': ('sa', 'sda'),
+               'eu': ('ca',),
+               'lt': ('eu',),
+               }
+
+TRUE_VALUES = ('true', '1', 'yes')
+FALSE_VALUES = ('false', '0', 'no', '')
+
+
+class ImportRow():
+    """One validated row of an import file."""
+    def __init__(self, line, key, file_id, parent_key, parent_id, order, public, text,
+                 description, student_friendly):
+        self.line = line
+        self.key = key
+        self.file_id = file_id
+        self.parent_key = parent_key
+        self.parent_id = parent_id
+        self.order = order
+        self.public = public
+        self.text = text
+        self.description = description
+        self.student_friendly = student_friendly
+
+
+def iterate_rows(lines, import_format):
+    """Yield (line number, dict) for each row of an import file.
+    A row that can't be read yields (line number, None)."""
+    if import_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_num, row if isinstance(row, dict) else None
+
+def parse_boolean(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError
+
+def parse_row(line_num, row, seen, location='line'):
+    """Validate one row against the rows before it.
+    seen is the set of (type, id) pairs of the rows read so far.
+    location names what line_num counts, in error messages.
+    Returns (ImportRow, errors)."""
+    errors = []
+    def error(message):
+        errors.append('%s %d: %s' % (location, line_num, message))
+    if row is None:
+        error('not a valid row')
+        return None, errors
+
+    key = str(row.get('type') or '').strip()
+    file_id = str(row.get('id') or '').strip()
+    parent_key = str(row.get('parent_type') or '').strip()
+    parent_id = str(row.get('parent_id') or '').strip()
+    text = str(row.get('text') or '').strip()
+
+    model = MODELS_BY_KEY.get(key)
+    if not model:
+        error("unknown type '%s'" % key)
+    if not file_id:
+        error('missing id')
+    elif (key, file_id) in seen:
+        error("duplicate id '%s' for type '%s'" % (file_id, key))
+
+    if model and parent_key not in PARENT_KEYS[key]:
+        error("a '%s' can't be placed under a '%s'" % (key, parent_key))
+    elif model and parent_key != 'o' and (parent_key, parent_id) not in seen:
+        error("parent %s '%s' is not defined above this line" % (parent_key, parent_id))
+
+    if not text:
+        error('missing text')
+    elif model:
+        max_length = model._meta.get_field(model.text_field).max_length
+        if len(text) > max_length:
+            error('text is longer than %d characters' % max_length)
+
+    order = row.get('order')
+    if order in (None, ''):
+        order = None
+    else:
+        try:
+            order = int(order)
+        except (TypeError, ValueError):
+            error("order '%s' is not a number" % order)
+
+    try:
+        public = parse_boolean(row.get('public', ''))
+    except ValueError:
+        error("public '%s' is not true or false" % row.get('public'))
+        public = False
+
+    if errors:
+        return None, errors
+    seen.add((key, file_id))
+    return ImportRow(line_num, key, file_id, parent_key, parent_id, order, public, text,
+                     str(row.get('description') or ''),
+                     str(row.get('student_friendly') or '')), []
+
+def parse_import(import_file, import_format):
+    """Read and validate a whole import file, opened in binary mode.
+    Returns (rows, errors). errors is a list of messages, each starting with
+      the line it refers to; if it's not empty, the file shouldn't be imported.
+    """
+    if import_format == 'case':
+        from competencies.case import parse_case
+        return parse_case(import_file)
+
+    rows, errors, seen = [], [], set()
+    try:
+        lines = codecs.iterdecode(import_file, 'utf-8')
+        for line_num, row in iterate_rows(lines, import_format):
+            import_row, row_errors = parse_row(line_num, row, seen)
+            errors += row_errors
+            if import_row:
+                rows.append(import_row)
+    except (csv.Error, UnicodeDecodeError) as e:
+        errors.append('could not read file: %s' % e)
+    if import_format == 'csv' and not errors and rows == []:
+        errors.append('no rows found; the first line should be the header: %s'
+                      % ','.join(EXPORT_FIELDS))
+    return rows, errors
+
+def count_rows(rows):
+    """Return a (type, count) pair for each type of element, from the top down."""
+    return [(model.path_key, len([row for row in rows if row.key == model.path_key]))
+            for model in TREE_MODELS]
+
+def import_elements(organization, rows):
+    """Create validated rows under organization, after its existing subject areas.
+    Everything happens in one transaction, with organization locked. Each
+      level is created with one bulk insert; see utils.bulk_create_in_order().
+    Returns the same counts as count_rows().
+    """
+    # For each row created, its new id and the tree_path of its children,
+    #   keyed by (type, file id).
+    new_ids, subtree_paths = {}, {('o', ''): 'o%d/' % organization.id}
+    # The new sa id of each sda, keyed by file id.
+    sda_sa_ids = {}
+
+    with transaction.atomic():
+        # Lock organization, so nothing else takes the positions of the new sas.
+        Organization.objects.select_for_update().get(pk=organization.pk)
+        for model in TREE_MODELS:
+            level_rows = [row for row in rows if row.key == model.path_key]
+            if not level_rows:
+                continue
+            group_attname = model._meta.order_with_respect_to.attname
+
+            elements = []
+            for row in level_rows:
+                parent_key = row.parent_key
+                parent_ref = (parent_key, row.parent_id if parent_key != 'o' else '')
+                element = model(**{model.text_field: row.text})
+                element.public = row.public
+                element.description = row.description
+                element.student_friendly = row.student_friendly
+                element.organization_id = organization.id
+                element.tree_path = subtree_paths[parent_ref]
+                if parent_key == 'sda':
+                    # A ca under an sda is still ordered within its sa.
+                    element.subdiscipline_area_id = new_ids[parent_ref]
+                    element.subject_area_id = sda_sa_ids[row.parent_id]
+                elif parent_key != 'o':
+                    setattr(element, group_attname, new_ids[parent_ref])
+                element.import_row = row
+                element.import_parent_id = new_ids[parent_ref] if parent_key != 'o' else 0
+                elements.append(element)
+
+            # Siblings are sorted by order. cas are numbered across their sa, so
+            #   the sa's own cas come first, then each sda's cas in turn; an
+            #   order only has to sort a ca among cas with the same parent.
+            elements.sort(key=lambda element: (getattr(element, group_attname),
+                                               element.import_row.parent_key != 'sa',
+                                               element.import_parent_id,
+                                               element.import_row.order is None,
+                                               element.import_row.order or 0,
+                                               element.import_row.line))
+            if model.path_key == 'sa':
+                # New sas go after the org's existing ones.
+                utils.bulk_create_in_order(model, elements, {'organization': organization},
+                                           first_order=get_next_order(model, organization.id))
+            else:
+                group_ids = set(getattr(element, group_attname) for element in elements)
+                utils.bulk_create_in_order(model, elements, {group_attname + '__in': group_ids})
+
+            for element in elements:
+                row = element.import_row
+                new_ids[(row.key, row.file_id)] = element.id
+                subtree_paths[(row.key, row.file_id)] = element.get_subtree_path()
+                if row.key == 'sda':
+                    sda_sa_ids[row.file_id] = element.subject_area_id
+
+    return count_rows(rows)
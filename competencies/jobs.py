@@ -0,0 +1,266 @@
+"""Background jobs, for work that is too slow to do inside a request.
+
+Views queue jobs with enqueue(), and the run_jobs management command runs them:
+    $ python manage.py run_jobs
+
+A job that was running when its worker died is claimed again once it has gone
+  JOB_STALE_SECONDS without saving progress, and resumes from its checkpoint.
+"""
+import json
+import traceback
+from datetime import timedelta
+
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from competencies.models import BackgroundJob, Organization, SubjectArea, MODELS_BY_KEY
+from competencies import utils, pdf_cache, organization_pdf, ordering, trash
+
+JOB_STALE_SECONDS = 300
+ENQUEUE_ATTEMPTS = 3
+
+job_handlers = {}
+
+
+def job_handler(job_type):
+    """Register a function as the handler for a type of job."""
+    def register(function):
+        job_handlers[job_type] = function
+        return function
+    return register
+
+def enqueue(job_type, params, key, organization=None, total=0):
+    """Queue a new job, unless a job with the same key is already active.
+    Returns the job that will do the work."""
+    for attempt in range(ENQUEUE_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return BackgroundJob.objects.create(job_type=job_type, active_key=key,
+                                                    organization=organization,
+                                                    params=json.dumps(params), total=total)
+        except IntegrityError as error:
+            if 'active_key' not in str(error) or attempt == ENQUEUE_ATTEMPTS - 1:
+                raise
+            # The active job may have finished since the insert failed; if so, try again.
+            job = get_active_job(key)
+            if job:
+                return job
+
+def get_active_job(key):
+    """Return the queued or running job with this key, or None."""
+    return BackgroundJob.objects.filter(active_key=key).first()
+
+def get_latest_job(job_type, organization):
+    """Return the most recent job of this type for an organization, or None."""
+    return BackgroundJob.objects.filter(job_type=job_type,
+                                        organization=organization).order_by('-id').first()
+
+def claim_next_job():
+    """Mark the oldest queued or stale job as running, and return it.
+    Returns None if there is nothing to do."""
+    stale = timezone.now() - timedelta(seconds=JOB_STALE_SECONDS)
+    candidates = BackgroundJob.objects.filter(
+        Q(status=BackgroundJob.QUEUED) | Q(status=BackgroundJob.RUNNING, updated__lt=stale))
+    for job in candidates.order_by('id')[:10]:
+        if claim_job(job):
+            return job
+    return None
+
+def claim_job(job):
+    """Mark a queued or stale job as running, and reload it.
+    Returns False if another worker claimed it first."""
+    # Conditional update, so two workers can't claim the same job.
+    claimed = BackgroundJob.objects.filter(id=job.id, status=job.status,
+                                           updated=job.updated).update(
+        status=BackgroundJob.RUNNING, updated=timezone.now())
+    if claimed:
+        job.refresh_from_db()
+    return bool(claimed)
+
+def lock_job(job):
+    """Lock job's row until the end of the current transaction, and reload its
+    checkpoint and progress.
+    A handler calls this at the start of each step of work. While the step
+      runs, another worker trying to claim the job as stale waits on the lock,
+      and by the time it gets the row, the step's checkpoint has been saved
+      and the job is no longer stale.
+    """
+    locked = BackgroundJob.objects.select_for_update().get(id=job.id)
+    job.checkpoint, job.progress = locked.checkpoint, locked.progress
+
+def run_job(job):
+    """Run a claimed job to completion, and record how it ended."""
+    try:
+        job_handlers[job.job_type](job)
+    except Exception:
+        job.status = BackgroundJob.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = BackgroundJob.DONE
+    job.active_key = None
+    job.save()
+
+def run_pending_jobs():
+    """Run jobs until there are none left. Returns the number of jobs run."""
+    num_jobs = 0
+    job = claim_next_job()
+    while job:
+        run_job(job)
+        num_jobs += 1
+        job = claim_next_job()
+    return num_jobs
+
+
+# --- Job handlers ---
+
+def fork_job_key(forking_org):
+    return 'fork:%d' % forking_org.id
+
+def enqueue_fork(forking_org, original_org):
+    """Queue a fork of original_org into forking_org.
+    Returns None if the fork is not allowed."""
+    if not original_org.public or original_org == forking_org:
+        return None
+    if forking_org.subjectarea_set.exists():
+        return None
+    params = {'original_org_id': original_org.id}
+    return enqueue('fork', params, fork_job_key(forking_org), organization=forking_org,
+                   total=utils.count_public_elements(original_org))
+
+@job_handler('fork')
+def run_fork(job):
+    """Copy original_org into forking_org one subject area at a time.
+    Each subject area is copied in its own transaction, with forking_org
+      locked, along with the checkpoint that records the copy, so an
+      interrupted fork resumes where it left off without copying anything twice.
+    """
+    forking_org = job.organization
+    original_org = Organization.objects.get(id=job.get_params()['original_org_id'])
+    # {original sa id: copy's id}; json keys are strings.
+    forked_sas = job.get_checkpoint().get('forked_sas', {})
+
+    sas = original_org.subjectarea_set.filter(public=True).exclude(id__in=map(int, forked_sas))
+    for sa in sas:
+        with transaction.atomic():
+            Organization.objects.select_for_update().get(pk=forking_org.pk)
+            # Another worker may have copied this sa, if it took over the job.
+            lock_job(job)
+            forked_sas = job.get_checkpoint().get('forked_sas', {})
+            if str(sa.id) in forked_sas:
+                continue
+            sa_map, num_copied = utils.fork_subject_areas(forking_org, original_org, [sa])
+            forked_sas[str(sa.id)] = sa_map.get(sa.id)
+            job.save_checkpoint({'forked_sas': forked_sas}, job.progress + num_copied)
+
+    job.progress = job.total
+
+
+def summary_pdf_job_key(digest):
+    return 'sa_summary_pdf:%s' % digest
+
+def enqueue_summary_pdf(sa, editor, digest, engine=pdf_cache.DEFAULT_SUMMARY_ENGINE):
+    """Queue a build of sa's summary pdf, as an editor or the public sees it.
+    Requests for the same content share one job."""
+    params = {'sa_id': sa.id, 'editor': editor, 'engine': engine}
+    return enqueue('sa_summary_pdf', params, summary_pdf_job_key(digest),
+                   organization=sa.organization, total=1)
+
+@job_handler('sa_summary_pdf')
+def run_summary_pdf(job):
+    """Build a summary pdf into the pdf cache.
+    The pdf is built from the subject area as it is now, which is what the
+      download will look for if it has been edited since the job was queued.
+    """
+    params = job.get_params()
+    sa = SubjectArea.objects.get(id=params['sa_id'])
+    kwargs = {} if params['editor'] else {'public': True}
+    tree = utils.get_subject_area_tree(sa, kwargs)
+    engine = params.get('engine', pdf_cache.DEFAULT_SUMMARY_ENGINE)
+    digest = pdf_cache.get_summary_digest(sa.organization, sa, tree, params['editor'], engine)
+    pdf_cache.get_or_store_pdf(digest, pdf_cache.summary_pdf_builder(sa.organization, sa, tree,
+                                                                     engine))
+    job.progress = job.total
+
+def organization_pdf_job_key(digest):
+    return 'organization_pdf:%s' % digest
+
+def enqueue_organization_pdf(organization, editor, digest, num_sas):
+    """Queue a build of a pdf of the whole organization, as an editor or the
+    public sees it. Requests for the same content share one job."""
+    params = {'editor': editor}
+    return enqueue('organization_pdf', params, organization_pdf_job_key(digest),
+                   organization=organization, total=num_sas)
+
+@job_handler('organization_pdf')
+def run_organization_pdf(job):
+    """Build an organization's pdf into the pdf cache.
+    Subject areas are laid out in parallel; progress counts finished subject areas.
+    """
+    editor = job.get_params()['editor']
+    organization = job.organization
+    kwargs = {} if editor else {'public': True}
+    trees = organization_pdf.get_organization_trees(organization, kwargs)
+    digest = pdf_cache.get_organization_digest(organization, trees, editor)
+    job.total = len(trees)
+
+    def on_section(num_done):
+        job.save_checkpoint({}, num_done)
+
+    def build_pdf(pdf_file):
+        organization_pdf.build_organization_pdf(organization, trees, pdf_file, on_section)
+    pdf_cache.get_or_store_pdf(digest, build_pdf)
+    job.progress = job.total
+
+
+def rebalance_order_job_key(model, group_id):
+    return 'rebalance_order:%s:%d' % (model.path_key, group_id)
+
+def enqueue_rebalance_order(model, group_id):
+    """Queue spreading out a crowded group of siblings. See competencies.ordering."""
+    params = {'model': model.path_key, 'group_id': group_id}
+    return enqueue('rebalance_order', params, rebalance_order_job_key(model, group_id), total=1)
+
+@job_handler('rebalance_order')
+def run_rebalance_order(job):
+    params = job.get_params()
+    ordering.rebalance_group(MODELS_BY_KEY[params['model']], params['group_id'])
+    job.progress = job.total
+
+
+PURGE_TRASH_JOB_KEY = 'purge_trash'
+
+def enqueue_purge_trash():
+    """Queue a purge of trash entries that have outlived TRASH_RETENTION_DAYS.
+    There's only ever one purge active. run_jobs queues one with the other
+      housekeeping jobs, and the purge_trash command runs one right away."""
+    return enqueue('purge_trash', {}, PURGE_TRASH_JOB_KEY)
+
+@job_handler('purge_trash')
+def run_purge_trash(job):
+    """Purge expired trash entries, oldest first. Progress counts elements deleted."""
+    for entry in trash.get_expired_entries():
+        num_deleted = trash.purge_entry(entry)
+        job.save_checkpoint({}, job.progress + num_deleted)
+    job.total = job.progress
+
+
+SWEEP_PDF_CACHE_JOB_KEY = 'sweep_pdf_cache'
+
+def enqueue_sweep_pdf_cache():
+    """Queue a sweep of old files from the pdf cache. See competencies.pdf_cache."""
+    return enqueue('sweep_pdf_cache', {}, SWEEP_PDF_CACHE_JOB_KEY)
+
+@job_handler('sweep_pdf_cache')
+def run_sweep_pdf_cache(job):
+    """Progress counts files deleted."""
+    job.progress = job.total = pdf_cache.sweep_cache()
+
+
+# run_jobs queues these every HOUSEKEEPING_INTERVAL_SECONDS.
+HOUSEKEEPING_INTERVAL_SECONDS = 3600
+
+def enqueue_housekeeping():
+    """Queue the jobs that keep the db and the pdf cache from growing forever."""
+    enqueue_purge_trash()
+    enqueue_sweep_pdf_cache()
@@ -0,0 +1,33 @@
+"""Export every element of an organization, public or not.
+
+    $ python manage.py export_organization 3 > organization_3.jsonl
+    $ python manage.py export_organization 3 --format csv --output organization_3.csv
+    $ python manage.py export_organization 3 --format case --output organization_3.json
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from competencies import export
+from competencies.models import Organization
+
+
+class Command(BaseCommand):
+    help = "Write an organization's elements as JSON Lines, CSV or a CASE package."
+
+    def add_arguments(self, parser):
+        parser.add_argument('organization_id', type=int)
+        parser.add_argument('--format', choices=export.EXPORT_FORMATS, default='jsonl')
+        parser.add_argument('--output', help='File to write to. Defaults to stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            organization = Organization.objects.get(id=options['organization_id'])
+        except Organization.DoesNotExist:
+            raise CommandError('No organization with id %d.' % options['organization_id'])
+
+        lines = export.iterate_export(organization, options['format'], {})
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
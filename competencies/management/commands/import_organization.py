@@ -0,0 +1,42 @@
+"""Import elements into an organization, from a file written by export_organization,
+  or from a CASE package.
+
+    $ python manage.py import_organization 3 organization.jsonl --dry-run
+    $ python manage.py import_organization 3 organization.csv --format csv
+    $ python manage.py import_organization 3 framework.json --format case
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from competencies import importer
+from competencies.models import Organization
+
+
+class Command(BaseCommand):
+    help = "Add the elements in a JSON Lines, CSV or CASE file to an organization."
+
+    def add_arguments(self, parser):
+        parser.add_argument('organization_id', type=int)
+        parser.add_argument('input')
+        parser.add_argument('--format', choices=importer.IMPORT_FORMATS, default='jsonl')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                            help='Validate the file, without importing anything.')
+
+    def handle(self, *args, **options):
+        try:
+            organization = Organization.objects.get(id=options['organization_id'])
+        except Organization.DoesNotExist:
+            raise CommandError('No organization with id %d.' % options['organization_id'])
+
+        with open(options['input'], 'rb') as input_file:
+            rows, errors = importer.parse_import(input_file, options['format'])
+        if errors:
+            raise CommandError('%s is not valid:\n%s' % (options['input'], '\n'.join(errors)))
+
+        if options['dry_run']:
+            counts = importer.count_rows(rows)
+            verb = 'Would import'
+        else:
+            counts = importer.import_elements(organization, rows)
+            verb = 'Imported'
+        for key, count in counts:
+            self.stdout.write('%s %d %s.' % (verb, count, key))
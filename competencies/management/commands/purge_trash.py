@@ -0,0 +1,25 @@
+"""Purge trashed elements that have outlived TRASH_RETENTION_DAYS, now.
+
+run_jobs queues a purge every hour, so this is only needed when no worker
+  is running, or to purge right away. It runs the same purge_trash job the
+  worker would:
+    $ python manage.py purge_trash
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from competencies.models import BackgroundJob
+from competencies import jobs
+
+
+class Command(BaseCommand):
+    help = 'Delete trashed elements older than TRASH_RETENTION_DAYS from the db.'
+
+    def handle(self, *args, **options):
+        job = jobs.enqueue_purge_trash()
+        if not jobs.claim_job(job):
+            self.stdout.write('A purge is already running.')
+            return
+        jobs.run_job(job)
+        if job.status == BackgroundJob.FAILED:
+            raise CommandError(job.error)
+        self.stdout.write('Purged %d element(s).' % job.progress)
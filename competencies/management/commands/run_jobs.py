@@ -0,0 +1,37 @@
+"""Run background jobs queued by the site, such as forks.
+
+Run this alongside gunicorn:
+    $ python manage.py run_jobs
+
+The worker also queues a purge of expired trash and a sweep of the pdf cache
+  every HOUSEKEEPING_INTERVAL_SECONDS. If you only run jobs with --once, from
+  cron, each run queues them.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from competencies import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs. Polls for new jobs unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Run all pending jobs, then exit.')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait between polls for new jobs.')
+
+    def handle(self, *args, **options):
+        next_housekeeping = 0
+        while True:
+            if time.time() >= next_housekeeping:
+                jobs.enqueue_housekeeping()
+                next_housekeeping = time.time() + jobs.HOUSEKEEPING_INTERVAL_SECONDS
+            num_jobs = jobs.run_pending_jobs()
+            if num_jobs:
+                self.stdout.write('Ran %d job(s).' % num_jobs)
+            if options['once']:
+                break
+            time.sleep(options['interval'])
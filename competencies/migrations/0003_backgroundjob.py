@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('competencies', '0002_auto_20150823_1646'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('job_type', models.CharField(max_length=50)),
+                ('active_key', models.CharField(max_length=500, unique=True, blank=True, null=True)),
+                ('status', models.CharField(max_length=20, default='queued', choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')])),
+                ('params', models.TextField(default='{}')),
+                ('checkpoint', models.TextField(default='{}')),
+                ('progress', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('organization', models.ForeignKey(blank=True, null=True, to='competencies.Organization')),
+            ],
+        ),
+    ]
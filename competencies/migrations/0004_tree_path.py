@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def backfill_tree_paths(apps, schema_editor):
+    """Build tree_path for existing elements, one level at a time.
+    Each level's paths come from the level above, with one UPDATE per level
+      that reads each parent's path in a subquery."""
+    quote = schema_editor.quote_name
+
+    def table(model_name):
+        return quote(apps.get_model('competencies', model_name)._meta.db_table)
+
+    def set_paths(model_name, parent_model_name, parent_column, parent_key, where=''):
+        """Set each element's path to its parent's path plus the parent's key and id."""
+        schema_editor.execute(
+            "UPDATE %(table)s SET tree_path = ("
+            "SELECT parent.tree_path || '%(parent_key)s' || parent.id || '/'"
+            " FROM %(parent_table)s parent WHERE parent.id = %(table)s.%(parent_column)s)"
+            "%(where)s"
+            % {'table': table(model_name), 'parent_table': table(parent_model_name),
+               'parent_column': quote(parent_column), 'parent_key': parent_key,
+               'where': where})
+
+    schema_editor.execute("UPDATE %s SET tree_path = 'o' || organization_id || '/'"
+                          % table('SubjectArea'))
+    set_paths('SubdisciplineArea', 'SubjectArea', 'subject_area_id', 'sa')
+    set_paths('CompetencyArea', 'SubjectArea', 'subject_area_id', 'sa',
+              ' WHERE subdiscipline_area_id IS NULL')
+    set_paths('CompetencyArea', 'SubdisciplineArea', 'subdiscipline_area_id', 'sda',
+              ' WHERE subdiscipline_area_id IS NOT NULL')
+    set_paths('EssentialUnderstanding', 'CompetencyArea', 'competency_area_id', 'ca')
+    set_paths('LearningTarget', 'EssentialUnderstanding', 'essential_understanding_id', 'eu')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('competencies', '0003_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='competencyarea',
+            name='tree_path',
+            field=models.CharField(max_length=255, blank=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='essentialunderstanding',
+            name='tree_path',
+            field=models.CharField(max_length=255, blank=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='learningtarget',
+            name='tree_path',
+            field=models.CharField(max_length=255, blank=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='subdisciplinearea',
+            name='tree_path',
+            field=models.CharField(max_length=255, blank=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='subjectarea',
+            name='tree_path',
+            field=models.CharField(max_length=255, blank=True, db_index=True),
+        ),
+        migrations.RunPython(backfill_tree_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+BACKFILL_BATCH_SIZE = 1000
+
+ELEMENT_MODELS = ['subdisciplinearea', 'competencyarea', 'essentialunderstanding',
+                  'learningtarget']
+
+
+def backfill_organizations(apps, schema_editor):
+    """Set organization on existing elements, from the top of their tree_path.
+    Works through each table in batches of ids, with one UPDATE per
+      organization in each batch."""
+    for model_name in ELEMENT_MODELS:
+        model = apps.get_model('competencies', model_name)
+        ids = list(model.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), BACKFILL_BATCH_SIZE):
+            batch_ids = ids[start:start + BACKFILL_BATCH_SIZE]
+            ids_by_org = {}
+            for id, tree_path in model.objects.filter(id__in=batch_ids).values_list(
+                    'id', 'tree_path'):
+                org_id = int(tree_path.split('/')[0][1:])
+                ids_by_org.setdefault(org_id, []).append(id)
+            for org_id, org_element_ids in ids_by_org.items():
+                model.objects.filter(id__in=org_element_ids).update(organization=org_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('competencies', '0004_tree_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name=model_name,
+            name='organization',
+            field=models.ForeignKey(editable=False, to='competencies.Organization', null=True),
+        ) for model_name in ELEMENT_MODELS
+    ] + [
+        migrations.RunPython(backfill_organizations, migrations.RunPython.noop),
+    ] + [
+        migrations.AlterField(
+            model_name=model_name,
+            name='organization',
+            field=models.ForeignKey(editable=False, to='competencies.Organization'),
+        ) for model_name in ELEMENT_MODELS
+    ]
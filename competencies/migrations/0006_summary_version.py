@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('competencies', '0005_element_organization'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subjectarea',
+            name='summary_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# Matches competencies.models.ORDER_GAP when this migration was written.
+ORDER_GAP = 1024
+
+ELEMENT_MODELS = ('SubjectArea', 'SubdisciplineArea', 'CompetencyArea',
+                  'EssentialUnderstanding', 'LearningTarget')
+
+
+def spread_order(apps, schema_editor):
+    """Multiply every _order by ORDER_GAP. Order is kept, and siblings end up
+    ORDER_GAP apart. One UPDATE per model."""
+    for model_name in ELEMENT_MODELS:
+        model = apps.get_model('competencies', model_name)
+        model.objects.update(_order=models.F('_order') * ORDER_GAP)
+
+def pack_order(apps, schema_editor):
+    """Number each group of siblings 0, 1, 2..., keeping their order."""
+    for model_name in ELEMENT_MODELS:
+        model = apps.get_model('competencies', model_name)
+        group_attname = model._meta.order_with_respect_to.attname
+        rows = model.objects.order_by(group_attname, '_order', 'id').values_list(
+            'id', group_attname, '_order')
+        last_group_id, position = None, 0
+        for id, group_id, order in rows:
+            position = position + 1 if group_id == last_group_id else 0
+            last_group_id = group_id
+            if order != position:
+                model.objects.filter(id=id).update(_order=position)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('competencies', '0006_summary_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(spread_order, pack_order),
+    ]
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('competencies', '0007_sparse_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrashEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('element_type', models.CharField(max_length=10)),
+                ('element_id', models.IntegerField()),
+                ('text', models.TextField()),
+                ('num_elements', models.IntegerField(default=1)),
+                ('deleted_at', models.DateTimeField(db_index=True)),
+                ('deleted_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('organization', models.ForeignKey(to='competencies.Organization')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='competencyarea',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='essentialunderstanding',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='learningtarget',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subdisciplinearea',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subjectarea',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='competencyarea',
+            name='trash_entry',
+            field=models.ForeignKey(blank=True, null=True, editable=False, related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='competencies.TrashEntry'),
+        ),
+        migrations.AddField(
+            model_name='essentialunderstanding',
+            name='trash_entry',
+            field=models.ForeignKey(blank=True, null=True, editable=False, related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='competencies.TrashEntry'),
+        ),
+        migrations.AddField(
+            model_name='learningtarget',
+            name='trash_entry',
+            field=models.ForeignKey(blank=True, null=True, editable=False, related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='competencies.TrashEntry'),
+        ),
+        migrations.AddField(
+            model_name='subdisciplinearea',
+            name='trash_entry',
+            field=models.ForeignKey(blank=True, null=True, editable=False, related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='competencies.TrashEntry'),
+        ),
+        migrations.AddField(
+            model_name='subjectarea',
+            name='trash_entry',
+            field=models.ForeignKey(blank=True, null=True, editable=False, related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='competencies.TrashEntry'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='trashentry',
+            unique_together=set([('element_type', 'element_id')]),
+        ),
+    ]
@@ -1,4 +1,11 @@
-from django.db import models
+import json
+import re
+
+from django.db import models, transaction
+from django.db.models import F, Value, Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.db.models.functions import Concat, Substr
 from django.forms import ModelForm, TextInput, Textarea, SelectMultiple, CheckboxSelectMultiple
 from django.forms import EmailField
 from django.contrib.auth.models import User
@@ -32,17 +39,141 @@ class Organization(models.Model):
     def __str__(self):
         return self.name
 
+    def get_subtree_path(self):
+        """Prefix of the tree_path of every element in this organization."""
+        return 'o%d/' % self.id
+
+# tree_path: Each element stores the path of its ancestors, from the organization
+#   down, such as 'o1/sa3/sda7/ca12/' for an eu. A whole subtree can then be
+#   selected at each level with one indexed query, and an element's ancestors
+#   can be read from its own row.
+#   save() keeps paths up to date when elements are created or moved. Code that
+#   bypasses save(), such as bulk_create(), must set tree_path itself.
+# Every element also has an organization fk, taken from the top of its tree_path,
+#   so an element's organization is one lookup away. It's maintained alongside
+#   tree_path, and the same goes for code that bypasses save().
+
+def parse_tree_path(tree_path):
+    """Turn a tree_path into a list of (path_key, id) pairs, from the top down."""
+    return [(key, int(id)) for key, id in re.findall(r'([a-z]+)(\d+)/', tree_path)]
+
+def build_tree_path(pairs):
+    """Turn a list of (path_key, id) pairs into a tree_path."""
+    return ''.join('%s%d/' % (key, id) for key, id in pairs)
+
+# Siblings are ordered by _order, with gaps between them, so an element can be
+#   moved or inserted by changing only its own _order. See competencies.ordering.
+ORDER_GAP = 1024
+
+def get_next_order(model, group_id):
+    """Return the _order that puts a new element after every sibling in its group."""
+    group_field = model._meta.order_with_respect_to
+    max_order = model._base_manager.filter(**{group_field.attname: group_id}).aggregate(
+        max_order=Max('_order'))['max_order']
+    return 0 if max_order is None else max_order + ORDER_GAP
+
+# Deleting an element moves it and its descendants to the trash, by setting
+#   deleted_at, and they are only removed from the db once they have been in the
+#   trash for a while. See competencies.trash.
+#   objects leaves out trashed elements, so the rest of the site never sees
+#   them; all_objects includes them.
+
+class ElementManager(models.Manager):
+    def get_queryset(self):
+        return super(ElementManager, self).get_queryset().filter(deleted_at=None)
+
 class CoreElement(models.Model):
     public = models.BooleanField(default=False)
     student_friendly = models.TextField(blank=True)
     description = models.TextField(blank=True)
+    tree_path = models.CharField(max_length=255, blank=True, db_index=True)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False)
+    # The trash entry this element was deleted with.
+    trash_entry = models.ForeignKey('TrashEntry', blank=True, null=True, editable=False,
+                                    on_delete=models.SET_NULL, related_name='+')
+
+    objects = ElementManager()
+    all_objects = models.Manager()
+
+    # Short name for this type of element, used in tree paths.
+    path_key = ''
+    # Field that holds the element's own text.
+    text_field = ''
 
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(CoreElement, cls).from_db(db, field_names, values)
+        # Remember the stored path, so save() can tell when an element has moved.
+        instance._saved_tree_path = (instance.pk, instance.__dict__.get('tree_path'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is not None:
+            return super(CoreElement, self).save(*args, **kwargs)
+
+        self.tree_path = self.get_parent_path()
+        self.organization_id = self.get_ancestor_ids()['o']
+        saved_pk, saved_tree_path = getattr(self, '_saved_tree_path', (None, None))
+        if saved_pk is not None and saved_pk == self.pk and saved_tree_path != self.tree_path:
+            with transaction.atomic():
+                super(CoreElement, self).save(*args, **kwargs)
+                self.move_descendant_paths(saved_tree_path)
+        else:
+            super(CoreElement, self).save(*args, **kwargs)
+        self._saved_tree_path = (self.pk, self.tree_path)
+
+    def _do_insert(self, manager, using, fields, update_pk, raw):
+        # Django numbers a new element by counting its siblings, which can
+        #   collide with spaced out positions. Put it after its last sibling.
+        #   The group's row is locked first, like a bulk insert into the group
+        #   locks it, so the two can't take the same positions.
+        if not raw:
+            group_field = self._meta.order_with_respect_to
+            group_id = getattr(self, group_field.attname)
+            list(group_field.related_model._base_manager.select_for_update().filter(
+                pk=group_id).values_list('pk'))
+            self._order = get_next_order(type(self), group_id)
+        return super(CoreElement, self)._do_insert(manager, using, fields, update_pk, raw)
+
+    def get_parent_path(self):
+        """The tree_path this element should have, based on its parent."""
+        return self.get_parent().get_subtree_path()
+
+    def get_subtree_path(self):
+        """Prefix of the tree_path of every descendant of this element."""
+        return '%s%s%d/' % (self.tree_path, self.path_key, self.id)
+
+    def get_ancestor_ids(self):
+        """Return a dict of this element's ancestors' ids, keyed by path_key."""
+        return dict(parse_tree_path(self.tree_path))
+
+    def get_subject_area_id(self):
+        """Id of the subject area this element is in."""
+        return self.get_ancestor_ids()['sa']
+
+    def move_descendant_paths(self, old_tree_path):
+        """Rewrite descendants' paths and organizations after this element has
+        moved from old_tree_path. One UPDATE per level below this element.
+        Trashed descendants move too, so they can be restored or purged later."""
+        old_prefix = '%s%s%d/' % (old_tree_path, self.path_key, self.id)
+        new_prefix = self.get_subtree_path()
+        for model in get_descendant_models(self._meta.concrete_model):
+            model.all_objects.filter(tree_path__startswith=old_prefix).update(
+                tree_path=Concat(Value(new_prefix), Substr('tree_path', len(old_prefix) + 1),
+                                 output_field=models.CharField()),
+                organization_id=self.organization_id)
+
 class SubjectArea(CoreElement):
     subject_area = models.CharField(max_length=500)
     organization = models.ForeignKey(Organization)
+    # Bumped whenever anything in this subject area changes. See bump_summary_versions().
+    summary_version = models.PositiveIntegerField(default=0, editable=False)
+
+    path_key = 'sa'
+    text_field = 'subject_area'
 
     def __str__(self):
         return self.subject_area
@@ -56,12 +187,34 @@ class SubjectArea(CoreElement):
     def get_parent(self):
         return self.organization
 
+    def get_parent_path(self):
+        # Build from organization_id, so organization isn't loaded.
+        return 'o%d/' % self.organization_id
+
+    def get_subject_area_id(self):
+        return self.id
+
+    def save(self, *args, **kwargs):
+        # summary_version is only changed by bump_summary_versions(). Leave the stored
+        #   value alone, rather than write back a copy that may have gone stale.
+        updating = not self._state.adding
+        if updating:
+            self.summary_version = F('summary_version')
+        super(SubjectArea, self).save(*args, **kwargs)
+        if updating:
+            self.refresh_from_db(fields=['summary_version'])
+
     def get_organization(self):
         return self.organization
 
 class SubdisciplineArea(CoreElement):
     subdiscipline_area = models.CharField(max_length=500)
     subject_area = models.ForeignKey(SubjectArea)
+    # Copy of the organization at the top of tree_path, set by save().
+    organization = models.ForeignKey(Organization, editable=False)
+
+    path_key = 'sda'
+    text_field = 'subdiscipline_area'
 
     def __str__(self):
         return self.subdiscipline_area
@@ -76,12 +229,17 @@ class SubdisciplineArea(CoreElement):
         return self.subject_area
 
     def get_organization(self):
-        return self.subject_area.get_organization()
+        return self.organization
 
 class CompetencyArea(CoreElement):
     competency_area = models.CharField(max_length=500)
     subject_area = models.ForeignKey(SubjectArea)
     subdiscipline_area = models.ForeignKey(SubdisciplineArea, blank=True, null=True)
+    # Copy of the organization at the top of tree_path, set by save().
+    organization = models.ForeignKey(Organization, editable=False)
+
+    path_key = 'ca'
+    text_field = 'competency_area'
 
     def __str__(self):
         return self.competency_area
@@ -110,11 +268,16 @@ class CompetencyArea(CoreElement):
             return self.subject_area
 
     def get_organization(self):
-        return self.subject_area.get_organization()
+        return self.organization
 
 class EssentialUnderstanding(CoreElement):
     essential_understanding = models.CharField(max_length=2000)
     competency_area = models.ForeignKey(CompetencyArea)
+    # Copy of the organization at the top of tree_path, set by save().
+    organization = models.ForeignKey(Organization, editable=False)
+
+    path_key = 'eu'
+    text_field = 'essential_understanding'
 
     def __str__(self):
         return self.essential_understanding
@@ -129,11 +292,16 @@ class EssentialUnderstanding(CoreElement):
         return self.competency_area
 
     def get_organization(self):
-        return self.competency_area.get_organization()
+        return self.organization
 
 class LearningTarget(CoreElement):
     learning_target = models.CharField(max_length=2000)
     essential_understanding = models.ForeignKey(EssentialUnderstanding)
+    # Copy of the organization at the top of tree_path, set by save().
+    organization = models.ForeignKey(Organization, editable=False)
+
+    path_key = 'lt'
+    text_field = 'learning_target'
 
     def __str__(self):
         return self.learning_target
@@ -148,7 +316,112 @@ class LearningTarget(CoreElement):
         return self.essential_understanding
 
     def get_organization(self):
-        return self.essential_understanding.get_organization()
+        return self.organization
+
+
+# Element types in the hierarchy, from the top down.
+TREE_MODELS = [SubjectArea, SubdisciplineArea, CompetencyArea, EssentialUnderstanding,
+               LearningTarget]
+MODELS_BY_KEY = {model.path_key: model for model in TREE_MODELS}
+
+def get_descendant_models(model):
+    """Element types that can be below an element of the given type, from the top down.
+    For an Organization, this is every element type."""
+    if model not in TREE_MODELS:
+        return TREE_MODELS
+    return TREE_MODELS[TREE_MODELS.index(model) + 1:]
+
+
+# --- Summary versions ---
+# Rendered subject area summaries are cached by summary_version, so bumping a
+#   subject area's version makes its cached summaries unreachable.
+#   Saving or deleting an element bumps its subject area through signals. Code
+#   that changes elements without save() or delete(), such as update() or
+#   set_<model>_order(), must call bump_summary_versions() itself.
+
+def bump_summary_versions(sa_ids):
+    """Bump the summary version of each subject area in sa_ids, in one UPDATE."""
+    SubjectArea.objects.filter(id__in=sa_ids).update(summary_version=F('summary_version') + 1)
+
+@receiver([post_save, post_delete])
+def bump_element_summary_version(sender, instance, raw=False, **kwargs):
+    # Trashed elements already left their summaries when they were trashed.
+    if sender in TREE_MODELS and not raw and instance.deleted_at is None:
+        bump_summary_versions([instance.get_subject_area_id()])
+
+
+# --- Trash ---
+
+class TrashEntry(models.Model):
+    """An element that was deleted, along with everything below it.
+    The element's rows stay in place, marked with deleted_at and this entry,
+      until the entry is restored or purged.
+    """
+    organization = models.ForeignKey(Organization)
+    element_type = models.CharField(max_length=10)
+    element_id = models.IntegerField()
+    text = models.TextField()
+    num_elements = models.IntegerField(default=1)
+    deleted_at = models.DateTimeField(db_index=True)
+    deleted_by = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        unique_together = ('element_type', 'element_id')
+
+    def __str__(self):
+        return '%s %d' % (self.element_type, self.element_id)
+
+    def get_model(self):
+        return MODELS_BY_KEY[self.element_type]
+
+
+# --- Background jobs ---
+
+class BackgroundJob(models.Model):
+    """Work that is too slow to do inside a request. See competencies.jobs.
+
+    params and checkpoint are stored as json. A job saves its checkpoint as it
+      makes progress, so a job interrupted by a worker restart can resume.
+    active_key is set while a job is queued or running, so only one job
+      with a given key can be active at a time.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((QUEUED, 'queued'), (RUNNING, 'running'),
+                      (DONE, 'done'), (FAILED, 'failed'))
+
+    job_type = models.CharField(max_length=50)
+    organization = models.ForeignKey(Organization, blank=True, null=True)
+    active_key = models.CharField(max_length=500, unique=True, blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    params = models.TextField(default='{}')
+    checkpoint = models.TextField(default='{}')
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s job %d (%s)' % (self.job_type, self.id, self.status)
+
+    def get_params(self):
+        return json.loads(self.params)
+
+    def get_checkpoint(self):
+        return json.loads(self.checkpoint)
+
+    def save_checkpoint(self, checkpoint, progress):
+        """Record progress. Call inside the transaction that did the work,
+        so the checkpoint never disagrees with the db."""
+        self.checkpoint = json.dumps(checkpoint)
+        self.progress = progress
+        self.save()
+
+    def is_active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
 
 
 # --- ModelForms ---
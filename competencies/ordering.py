@@ -0,0 +1,147 @@
+"""Sparse ordering of sibling elements.
+
+Siblings are ordered by _order, as order_with_respect_to sets it up, but
+  their positions are spread ORDER_GAP apart instead of being numbered
+  0, 1, 2... To put a group in a new order, the elements that are already in
+  order relative to each other stay where they are, and only the rest are
+  given new positions in the gaps between them. Moving one element changes
+  one row.
+
+When a gap gets crowded, the group is spread out again by a background
+  rebalance job. If there's no room at all, the group is spread out right away.
+"""
+from bisect import bisect_left
+
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField
+
+from competencies.models import ORDER_GAP
+
+# A gap narrower than this triggers a background rebalance of the group.
+MIN_ORDER_GAP = 8
+
+
+def get_longest_ordered_run(ids, positions):
+    """Return the set of ids in the longest subsequence of ids whose positions
+    are already strictly increasing. Patience sorting, so O(n log n)."""
+    tail_positions, tail_indexes, previous = [], [], [None] * len(ids)
+    for index, id in enumerate(ids):
+        slot = bisect_left(tail_positions, positions[id])
+        if slot > 0:
+            previous[index] = tail_indexes[slot - 1]
+        if slot == len(tail_positions):
+            tail_positions.append(positions[id])
+            tail_indexes.append(index)
+        else:
+            tail_positions[slot] = positions[id]
+            tail_indexes[slot] = index
+    run = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        run.add(ids[index])
+        index = previous[index]
+    return run
+
+def plan_order(ids, positions):
+    """Work out new positions that put ids in order, moving as few as possible.
+    positions maps each id to its current _order.
+    Returns (changes, crowded). changes maps each id that moves to its new
+      position, or is None if there's no room and the group must be spread out.
+      crowded is True if a gap used is narrower than MIN_ORDER_GAP.
+    """
+    keep = get_longest_ordered_run(ids, positions)
+    changes, crowded = {}, False
+    start = 0
+    while start < len(ids):
+        if ids[start] in keep:
+            start += 1
+            continue
+        end = start
+        while end < len(ids) and ids[end] not in keep:
+            end += 1
+        # Runs are as long as possible, so their neighbours are staying put.
+        run = ids[start:end]
+        low = positions[ids[start - 1]] if start > 0 else None
+        high = positions[ids[end]] if end < len(ids) else None
+        if low is None and high is None:
+            new_positions = [ORDER_GAP * num for num in range(len(run))]
+        elif low is None:
+            new_positions = [high - ORDER_GAP * (len(run) - num) for num in range(len(run))]
+        elif high is None:
+            new_positions = [low + ORDER_GAP * (num + 1) for num in range(len(run))]
+        else:
+            step = (high - low) // (len(run) + 1)
+            if step < 1:
+                return None, True
+            crowded = crowded or step < MIN_ORDER_GAP
+            new_positions = [low + step * (num + 1) for num in range(len(run))]
+        changes.update(zip(run, new_positions))
+        start = end
+    return changes, crowded
+
+def spread_order(ids):
+    """Positions ORDER_GAP apart, for ids in order."""
+    return {id: ORDER_GAP * num for num, id in enumerate(ids)}
+
+def write_positions(model, changes):
+    """Set the _order of each id in changes, with one UPDATE."""
+    if changes:
+        model.all_objects.filter(id__in=list(changes)).update(
+            _order=Case(*[When(id=id, then=Value(position)) for id, position in changes.items()],
+                        output_field=IntegerField()))
+
+def apply_order(siblings, ids):
+    """Put the elements of siblings in the order of ids, which lists each of them once.
+    Only elements that are out of place are written. If the group is getting
+      crowded, a rebalance is queued. Call inside a transaction.
+    Returns the number of elements that moved.
+    """
+    model = siblings.model
+    group_attname = model._meta.order_with_respect_to.attname
+    rows = list(siblings.select_for_update().values_list('id', '_order', group_attname))
+    positions = {id: order for id, order, group_id in rows}
+    group_ids = set(group_id for id, order, group_id in rows)
+    changes, crowded = plan_order(ids, positions)
+    if changes is None:
+        # No room; spread out the whole group. cas under different sdas share
+        #   their sa's positions, so respreading just these siblings could
+        #   land them on another sda's cas.
+        groups = {id: group_id for id, order, group_id in rows}
+        changes = {}
+        for group_id in group_ids:
+            changes.update(plan_spread(model, group_id,
+                                       [id for id in ids if groups[id] == group_id]))
+    elif crowded:
+        for group_id in group_ids:
+            enqueue_rebalance(model, group_id)
+    write_positions(siblings.model, changes)
+    return len(changes)
+
+def enqueue_rebalance(model, group_id):
+    from competencies import jobs
+    return jobs.enqueue_rebalance_order(model, group_id)
+
+def plan_spread(model, group_id, ids=()):
+    """Work out positions ORDER_GAP apart for a whole group of siblings, keeping
+    its order, except that the elements of ids take the places the group
+      already gives them in the order of ids.
+    Trashed siblings are spread too, so they go back to the same place if
+      they're restored.
+    Returns a dict of new positions, for the elements that move.
+    """
+    group_attname = model._meta.order_with_respect_to.attname
+    rows = list(model.all_objects.select_for_update().filter(**{group_attname: group_id})
+                .order_by('_order', 'id').values_list('id', '_order'))
+    positions = dict(rows)
+    reordered, moving = iter(ids), set(ids)
+    sequence = [next(reordered) if id in moving else id for id, order in rows]
+    return {id: position for id, position in spread_order(sequence).items()
+            if positions[id] != position}
+
+def rebalance_group(model, group_id):
+    """Spread a whole group of siblings ORDER_GAP apart, keeping their order.
+    Returns the number of elements that moved."""
+    with transaction.atomic():
+        changes = plan_spread(model, group_id)
+        write_positions(model, changes)
+    return len(changes)
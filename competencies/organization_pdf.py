@@ -0,0 +1,105 @@
+"""Pdf of a whole organization: a table of contents, then one section per subject area.
+
+Sections are laid out in parallel, in a pool of worker processes. Workers
+  only run ReportLab; everything they need is loaded from the db first and
+  sent to them, so they never touch the db connection. The finished sections
+  are joined with PyPDF2, and each one gets a bookmark.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+
+from PyPDF2 import PdfFileMerger, PdfFileReader
+from reportlab.lib.pagesizes import landscape, letter
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle
+
+from competencies import utils
+
+
+def get_organization_trees(organization, kwargs):
+    """Load the tree of each visible subject area in organization, in order."""
+    return [utils.get_subject_area_tree(sa, kwargs)
+            for sa in organization.subjectarea_set.filter(**kwargs)]
+
+def render_section(section):
+    """Lay out one subject area's section, and return it as pdf bytes.
+    Runs in a worker process."""
+    from competencies.sa_summary_pdf import PDFTest
+    org, sa, tree = section
+    buffer = BytesIO()
+    PDFTest(buffer).makeSummary(org, sa, tree)
+    return buffer.getvalue()
+
+def render_sections(sections, on_section=None):
+    """Render each section, in parallel when more than one process is allowed.
+    Calls on_section(num_done) as sections finish, in order."""
+    num_processes = getattr(settings, 'PDF_PROCESSES', None) or os.cpu_count() or 1
+    num_processes = min(num_processes, len(sections))
+    if num_processes <= 1:
+        results = map(render_section, sections)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=num_processes)
+        results = executor.map(render_section, sections)
+    try:
+        section_pdfs = []
+        for section_pdf in results:
+            section_pdfs.append(section_pdf)
+            if on_section:
+                on_section(len(section_pdfs))
+        return section_pdfs
+    finally:
+        if executor:
+            executor.shutdown()
+
+def count_pages(pdf_bytes):
+    return PdfFileReader(BytesIO(pdf_bytes)).getNumPages()
+
+def render_contents(org, titles, first_pages):
+    """Lay out the table of contents, and return it as pdf bytes."""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=landscape(letter), topMargin=36, bottomMargin=36)
+    title_style = ParagraphStyle('title', fontName='Helvetica-Bold', fontSize=20,
+                                 spaceAfter=20)
+    elements = [Paragraph(org.name, title_style)]
+    data = [(title, str(page)) for title, page in zip(titles, first_pages)]
+    if data:
+        table = Table(data, colWidths=(8*inch, 1*inch))
+        table.setStyle(TableStyle([('FONTSIZE', (0,0), (-1,-1), 14),
+                                   ('BOTTOMPADDING', (0,0), (-1,-1), 8),
+                                   ('ALIGN', (1,0), (1,-1), 'RIGHT'),
+                                   ]))
+        elements.append(table)
+    doc.build(elements)
+    return buffer.getvalue()
+
+def build_organization_pdf(org, trees, pdf_file, on_section=None):
+    """Write a pdf of every subject area in trees to pdf_file."""
+    sections = [(org, tree.subject_area, tree) for tree in trees]
+    section_pdfs = render_sections(sections, on_section)
+    titles = [tree.subject_area.subject_area for tree in trees]
+
+    # Page numbers depend on the length of the contents, so lay it out until
+    #   its length stops changing. Unless there are many subject areas, the
+    #   contents fit on one page and one pass is enough.
+    section_lengths = [count_pages(section_pdf) for section_pdf in section_pdfs]
+    contents_length, contents_pdf = 1, None
+    while True:
+        first_pages, page = [], contents_length + 1
+        for length in section_lengths:
+            first_pages.append(page)
+            page += length
+        contents_pdf = render_contents(org, titles, first_pages)
+        if count_pages(contents_pdf) == contents_length:
+            break
+        contents_length = count_pages(contents_pdf)
+
+    merger = PdfFileMerger()
+    merger.append(BytesIO(contents_pdf))
+    for title, section_pdf in zip(titles, section_pdfs):
+        merger.append(BytesIO(section_pdf), bookmark=title)
+    merger.write(pdf_file)
@@ -0,0 +1,144 @@
+"""Disk cache for generated pdfs.
+
+Each pdf is stored under PDF_CACHE_DIR, named by a hash of everything that
+  goes into it. An edit changes the hash, so cached files never need to be
+  invalidated, and identical documents share one file. The hash doubles as
+  the pdf's ETag, so clients that already have a pdf get a 304.
+
+An edit leaves the old file behind, so the sweep_pdf_cache job deletes files
+  built more than PDF_CACHE_MAX_AGE_DAYS ago. A pdf that's still wanted is
+  built again on its next request.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+
+# Change this when the pdf layout changes, so old files aren't served.
+PDF_FORMAT_VERSION = 1
+
+
+# Engines that can lay out a summary pdf. Each is a class that takes a file
+#   object, and has a makeSummary(org, sa, tree) method.
+SUMMARY_ENGINES = ('platypus', 'canvas')
+DEFAULT_SUMMARY_ENGINE = 'platypus'
+
+
+def get_summary_engine(engine):
+    """Return the class for a summary engine name, or the default engine's class."""
+    if engine == 'canvas':
+        from competencies.sa_summary_canvas_pdf import CanvasSummary
+        return CanvasSummary
+    from competencies.sa_summary_pdf import PDFTest
+    return PDFTest
+
+def clean_summary_engine(engine):
+    """Return engine if it's a known engine name, or the default engine's name."""
+    return engine if engine in SUMMARY_ENGINES else DEFAULT_SUMMARY_ENGINE
+
+def get_summary_digest(org, sa, tree, editor, engine=DEFAULT_SUMMARY_ENGINE):
+    """Hash everything that appears in a subject area's summary pdf."""
+    def ca_content(ca):
+        return [ca.competency_area, [eu.essential_understanding for eu in ca.eus]]
+
+    content = [PDF_FORMAT_VERSION, 'sa_summary', engine, editor,
+               org.name, org.alias_ca, org.alias_eu, sa.subject_area,
+               [ca_content(ca) for ca in tree.general_cas],
+               [[sda.subdiscipline_area, [ca_content(ca) for ca in sda.cas]]
+                for sda in tree.sdas]]
+    return hashlib.sha1(json.dumps(content).encode('utf-8')).hexdigest()
+
+def get_organization_digest(org, trees, editor):
+    """Hash everything that appears in an organization's pdf."""
+    content = [PDF_FORMAT_VERSION, 'organization'] + [
+        get_summary_digest(org, tree.subject_area, tree, editor) for tree in trees]
+    return hashlib.sha1(json.dumps(content).encode('utf-8')).hexdigest()
+
+def summary_pdf_builder(org, sa, tree, engine=DEFAULT_SUMMARY_ENGINE):
+    """Return a function that writes sa's summary pdf to a file object."""
+    def build_pdf(pdf_file):
+        summary = get_summary_engine(engine)(pdf_file)
+        summary.makeSummary(org, sa, tree)
+    return build_pdf
+
+def get_pdf_path(digest):
+    return os.path.join(settings.PDF_CACHE_DIR, '%s.pdf' % digest)
+
+def get_cached_pdf(digest):
+    """Return the path of the cached pdf for digest, or None."""
+    path = get_pdf_path(digest)
+    if os.path.exists(path):
+        return path
+    return None
+
+def store_pdf(digest, build_pdf):
+    """Build a pdf into the cache, and return its path.
+    build_pdf is called with a file object to write the pdf to. The file is
+      written under a temporary name and then renamed, so a half-written pdf
+      is never served.
+    """
+    if not os.path.isdir(settings.PDF_CACHE_DIR):
+        os.makedirs(settings.PDF_CACHE_DIR, exist_ok=True)
+    path = get_pdf_path(digest)
+    fd, temp_path = tempfile.mkstemp(suffix='.pdf', dir=settings.PDF_CACHE_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as pdf_file:
+            build_pdf(pdf_file)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return path
+
+def get_or_store_pdf(digest, build_pdf):
+    """Return the path of the cached pdf for digest, building it if needed."""
+    return get_cached_pdf(digest) or store_pdf(digest, build_pdf)
+
+def get_max_age_days():
+    return getattr(settings, 'PDF_CACHE_MAX_AGE_DAYS', 30)
+
+def sweep_cache():
+    """Delete cached pdfs built more than PDF_CACHE_MAX_AGE_DAYS ago, along with
+    any temporary files left by builds that died.
+    Returns the number of files deleted."""
+    if not os.path.isdir(settings.PDF_CACHE_DIR):
+        return 0
+    cutoff = time.time() - get_max_age_days() * 24 * 60 * 60
+    num_deleted = 0
+    for entry in os.scandir(settings.PDF_CACHE_DIR):
+        if not entry.name.endswith('.pdf') or entry.stat().st_mtime >= cutoff:
+            continue
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            # Another sweep got to it first.
+            continue
+        num_deleted += 1
+    return num_deleted
+
+def is_not_modified(request, digest, last_modified):
+    """Check the request's conditional headers against a cached pdf."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or digest in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+def serve_pdf(request, digest, path, filename):
+    """Stream a cached pdf, or return a 304 if the client already has it."""
+    last_modified = os.path.getmtime(path)
+    if is_not_modified(request, digest, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(path, 'rb'), content_type='application/pdf')
+        response['Content-Length'] = os.path.getsize(path)
+        response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    response['ETag'] = quote_etag(digest)
+    response['Last-Modified'] = http_date(last_modified)
+    return response
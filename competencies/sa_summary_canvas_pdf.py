@@ -0,0 +1,126 @@
+"""Fast engine for sa_summary pdfs, drawn straight onto a ReportLab canvas.
+
+Draws the same two-column layout as PDFTest, but wraps its own lines and
+  tracks its own position on the page, instead of laying out a platypus Table
+  for every competency area. Text is drawn as plain text, not paragraph markup.
+"""
+from reportlab.lib.pagesizes import landscape, letter
+from reportlab.lib.units import inch
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen.canvas import Canvas
+
+from competencies.sa_summary_pdf import LIGHT_GRAY, DARK_GRAY, SPACER_WIDTH
+from competencies.sa_summary_pdf import CA_COL_WIDTH, EU_COL_WIDTH
+
+PAGE_WIDTH, PAGE_HEIGHT = landscape(letter)
+LEFT_MARGIN = inch
+TOP_MARGIN = BOTTOM_MARGIN = 36
+
+# Cell padding, matching platypus Table defaults.
+H_PADDING, V_PADDING = 6, 3
+BULLET_INDENT = 10
+
+TEXT_FONT, TEXT_SIZE, TEXT_LEADING = 'Helvetica', 10, 12
+
+CA_X = LEFT_MARGIN
+EU_X = LEFT_MARGIN + CA_COL_WIDTH + SPACER_WIDTH
+CA_TEXT_WIDTH = CA_COL_WIDTH - 2*H_PADDING
+EU_TEXT_WIDTH = EU_COL_WIDTH - 2*H_PADDING - BULLET_INDENT
+
+
+class CanvasSummary():
+    def __init__(self, response):
+        # response argument is used as the file object.
+        self.response = response
+        self.canvas = None
+        self.y = 0
+
+    def makeSummary(self, org, sa, tree):
+        """Generates a pdf of the sa_summary page, from sa's SubjectAreaTree."""
+        self.canvas = Canvas(self.response, pagesize=(PAGE_WIDTH, PAGE_HEIGHT))
+        self.y = PAGE_HEIGHT - TOP_MARGIN
+
+        self.draw_heading(org.name, 'Helvetica-Bold', 20, space_after=0)
+        self.draw_heading(sa.subject_area, 'Helvetica', 16, space_after=20)
+
+        # Header row.
+        self.draw_row([org.alias_ca.title()+'s'], [org.alias_eu.title()+'s'],
+                      font='Helvetica-Bold', size=14, leading=17, bottom_padding=10,
+                      bullet=False)
+        self.y -= SPACER_WIDTH
+
+        for ca in tree.general_cas:
+            self.draw_ca(ca)
+        for sda in tree.sdas:
+            self.draw_heading(sda.subdiscipline_area, 'Helvetica-Bold', 14,
+                              space_before=5, space_after=10)
+            for ca in sda.cas:
+                self.draw_ca(ca)
+
+        self.canvas.save()
+        return self.response
+
+    def new_page(self):
+        self.canvas.showPage()
+        self.y = PAGE_HEIGHT - TOP_MARGIN
+
+    def make_room(self, height):
+        """Start a new page, unless height fits on this one."""
+        if self.y - height < BOTTOM_MARGIN:
+            self.new_page()
+
+    def draw_heading(self, text, font, size, space_before=0, space_after=0):
+        """Draw text across the full width of the page."""
+        leading = size * 1.2
+        self.y -= space_before
+        for line in simpleSplit(text, font, size, CA_COL_WIDTH + SPACER_WIDTH + EU_COL_WIDTH):
+            self.make_room(leading)
+            self.canvas.setFont(font, size)
+            self.canvas.drawString(LEFT_MARGIN, self.y - size, line)
+            self.y -= leading
+        self.y -= space_after
+
+    def draw_ca(self, ca):
+        """Draw a competency area beside its eus, one row per eu, then a spacer."""
+        ca_lines = simpleSplit(ca.competency_area, TEXT_FONT, TEXT_SIZE, CA_TEXT_WIDTH)
+        eus = ca.eus or [None]
+        for eu_num, eu in enumerate(eus):
+            eu_lines = []
+            if eu:
+                eu_lines = simpleSplit(eu.essential_understanding, TEXT_FONT, TEXT_SIZE,
+                                       EU_TEXT_WIDTH)
+            last_row = (eu_num == len(eus) - 1)
+            self.draw_row(ca_lines if eu_num == 0 else [], eu_lines,
+                          bottom_padding=10 if last_row else V_PADDING, bullet=bool(eu))
+        self.y -= SPACER_WIDTH
+
+    def draw_row(self, ca_lines, eu_lines, font=TEXT_FONT, size=TEXT_SIZE,
+                 leading=TEXT_LEADING, bottom_padding=V_PADDING, bullet=True):
+        """Draw one row of both columns, a line at a time.
+        Backgrounds are filled a slot at a time, so a row can break across pages."""
+        slots = [V_PADDING] + [leading] * max(len(ca_lines), len(eu_lines), 1)
+        slots.append(bottom_padding)
+        for slot_num, height in enumerate(slots):
+            self.make_room(height)
+            self.fill_backgrounds(height)
+            line_num = slot_num - 1
+            if 0 <= line_num < len(slots) - 2:
+                baseline = self.y - size
+                self.canvas.setFillColorRGB(0, 0, 0)
+                self.canvas.setFont(font, size)
+                if line_num < len(ca_lines):
+                    self.canvas.drawString(CA_X + H_PADDING, baseline, ca_lines[line_num])
+                if line_num < len(eu_lines):
+                    eu_text_x = EU_X + H_PADDING
+                    if bullet:
+                        if line_num == 0:
+                            self.canvas.drawString(eu_text_x, baseline, u'\u2022')
+                        eu_text_x += BULLET_INDENT
+                    self.canvas.drawString(eu_text_x, baseline, eu_lines[line_num])
+            self.y -= height
+
+    def fill_backgrounds(self, height):
+        self.canvas.setFillColorRGB(*DARK_GRAY)
+        self.canvas.rect(CA_X, self.y - height, CA_COL_WIDTH, height, stroke=0, fill=1)
+        self.canvas.setFillColorRGB(*LIGHT_GRAY)
+        self.canvas.rect(EU_X, self.y - height, EU_COL_WIDTH, height, stroke=0, fill=1)
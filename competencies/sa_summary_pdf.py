@@ -7,6 +7,26 @@ from reportlab.lib import colors
 
 from competencies.models import SubjectArea
 
+LIGHT_GRAY = (0.9, 0.9, 0.9)
+DARK_GRAY = (0.75, 0.75, 0.75)
+
+SPACER_WIDTH = 0.05*inch
+CA_COL_WIDTH = 3*inch - SPACER_WIDTH/2
+EU_COL_WIDTH = 6*inch - SPACER_WIDTH/2
+COL_WIDTHS = (CA_COL_WIDTH, SPACER_WIDTH, EU_COL_WIDTH)
+
+HEADER_TABLE_STYLE = TableStyle([('BACKGROUND', (0,0), (0,0), DARK_GRAY),
+                                 ('BACKGROUND', (2,0), (2,0), LIGHT_GRAY),
+                                 ('BOTTOMPADDING', (0,0), (-1,-1), 10),
+                                 ('FONTSIZE', (0,0), (-1,-1), 14),
+                                 ('FONTNAME', (0,0), (-1,-1), 'Helvetica-Bold'),
+                                 ])
+CA_TABLE_STYLE = TableStyle([('BACKGROUND', (0,0), (0,-1), DARK_GRAY),
+                             ('BACKGROUND', (2,0), (2,-1), LIGHT_GRAY),
+                             ('BOTTOMPADDING', (0,-1), (-1,-1), 10),
+                             ('VALIGN', (0,0), (0,0), 'TOP'),
+                             ])
+
 class PDFTest():
     def __init__(self, response):
         # response argument is used as the file object.
@@ -16,127 +36,74 @@ class PDFTest():
         self.title = ''
         self.subtitle = ''
 
-    def makeSummary(self, org, sa, sdas, cas, eus):
-        """Generates a pdf of the sa_summary page."""
+        # Styles are built once, and shared by every element that uses them.
+        self.ca_style = self.styles["Normal"]
+        self.eu_style = ParagraphStyle('eu_style', fontName='Helvetica', bulletText=u'\u2022',
+                                       leftIndent=10, borderWidth=0, borderColor='black')
+        self.title_style = ParagraphStyle('title', fontName='Helvetica-Bold', fontSize=20,
+                                          spaceAfter=0)
+        self.subtitle_style = ParagraphStyle('subtitle', fontName='Helvetica', fontSize=16,
+                                             spaceAfter=20)
+        self.sda_style = ParagraphStyle('sda', fontName='Helvetica-Bold', fontSize=14,
+                                        spaceBefore=5, spaceAfter=10)
+
+    def makeSummary(self, org, sa, tree):
+        """Generates a pdf of the sa_summary page.
+        tree is sa's SubjectAreaTree. Its elements are already grouped, so each
+          element is visited once.
+        """
         # Prep document.
         doc = SimpleDocTemplate(self.response, pagesize=landscape(letter), topMargin=36,
                                 bottomMargin=36)
-        Story = [Spacer(1,0.5*inch)]
-        style = self.styles["Normal"]
-        light_gray = (0.9, 0.9, 0.9)
-        dark_gray = (0.75, 0.75, 0.75)
         elements = []
 
-        # Define styles.
-        eu_style = ParagraphStyle('eu_style', fontName='Helvetica', bulletText=u'\u2022',
-                                  leftIndent=10, borderWidth=0, borderColor='black')
-
         # Add title and subtitle.
-        p_style = ParagraphStyle('title', fontName='Helvetica-Bold', fontSize=20,
-                                 spaceAfter=0)
-        elements.append(Paragraph(org.name, p_style))
-        p_style.fontName = 'Helvetica'
-        p_style.fontSize = 16
-        p_style.spaceAfter = 20
-        elements.append(Paragraph(sa.subject_area, p_style))
-
-        spacer_width = 0.05*inch
-        ca_col_width = 3*inch - spacer_width/2
-        eu_col_width = 6*inch - spacer_width/2
-        col_widths = (ca_col_width, spacer_width, eu_col_width)
-        
+        elements.append(Paragraph(org.name, self.title_style))
+        elements.append(Paragraph(sa.subject_area, self.subtitle_style))
+
         # Build a series of separate tables.
         #  Easy to manage styling this way.
 
         # --- Header row. ---
         data = [(org.alias_ca.title()+'s', '', org.alias_eu.title()+'s')]
-        table = Table(data, colWidths=col_widths)
+        table = Table(data, colWidths=COL_WIDTHS)
+        table.setStyle(HEADER_TABLE_STYLE)
         elements.append(table)
-        table.setStyle(TableStyle([('BACKGROUND', (0,0), (0,0), dark_gray),
-                                   ('BACKGROUND', (2,0), (2,0), light_gray),
-                                   ('BOTTOMPADDING', (0,0), (-1,-1), 10),
-                                   ('FONTSIZE', (0,0), (-1,-1), 14),
-                                   ('FONTNAME', (0,0), (-1,-1), 'Helvetica-Bold'),
-                                   ]))
-        # Clear data.
-        data = []
 
         # Spacer row.
-        self.add_spacer_row(elements, col_widths, spacer_width)
+        self.add_spacer_row(elements)
 
         # --- Subject area competency areas. ---
-        # Each competency area and its eus are a separate table.
-        for ca in cas:
-            if not ca.subdiscipline_area:
-                p_ca = Paragraph(ca.competency_area, style)
-                first_eu = True
-                for eu in eus:
-                    if eu.competency_area == ca:
-                        p_eu = Paragraph(eu.essential_understanding, eu_style)
-                        if first_eu:
-                            data.append((p_ca, '', p_eu))
-                            first_eu = False
-                        else:
-                            data.append(('', '', p_eu))
-                # Make sure to include ca if there were no eu's.
-                if first_eu:
-                    data.append((p_ca, '', ''))
-            if data:
-                # Build table.
-                table = Table(data, colWidths=col_widths)
-                elements.append(table)
-                table.setStyle(TableStyle([('BACKGROUND', (0,0), (0,-1), dark_gray),
-                                           ('BACKGROUND', (2,0), (2,-1), light_gray),
-                                           ('BOTTOMPADDING', (0,-1), (-1,-1), 10),
-                                           ('VALIGN', (0,0), (0,0), 'TOP'),
-                                           ]))
-                data = []
-                self.add_spacer_row(elements, col_widths, spacer_width)
-
+        for ca in tree.general_cas:
+            self.add_ca_table(elements, ca)
 
         # Add sda competency areas.
-        for sda in sdas:
-            # Add a single-row table for the sda.
-            p_style = ParagraphStyle('title', fontName='Helvetica-Bold', fontSize=14,
-                                 spaceBefore=5, spaceAfter=10)
-            elements.append(Paragraph(sda.subdiscipline_area, p_style))
-
-            # Each competency area and its eus are a separate table.
-            for ca in cas:
-                if (ca.subdiscipline_area
-                    and ca.subdiscipline_area.subdiscipline_area == sda.subdiscipline_area):
-                    p_ca = Paragraph(ca.competency_area, style)
-                    #data.append((p, '', ''))
-                    first_eu = True
-                    for eu in eus:
-                        if eu.competency_area == ca:
-                            p_eu = Paragraph(eu.essential_understanding, eu_style)
-                            if first_eu:
-                                data.append((p_ca, '', p_eu))
-                                first_eu = False
-                            else:
-                                data.append(('', '', p_eu))
-                    # Make sure to include ca if there were no eu's.
-                    if first_eu:
-                        data.append((p_ca, '', ''))
-                if data:
-                    # Build table.
-                    table = Table(data, colWidths=col_widths)
-                    elements.append(table)
-                    table.setStyle(TableStyle([('BACKGROUND', (0,0), (0,-1), dark_gray),
-                                               ('BACKGROUND', (2,0), (2,-1), light_gray),
-                                               ('BOTTOMPADDING', (0,-1), (-1,-1), 10),
-                                               ('VALIGN', (0,0), (0,0), 'TOP'),
-                                               ]))
-                    data = []
-                    self.add_spacer_row(elements, col_widths, spacer_width)
+        for sda in tree.sdas:
+            elements.append(Paragraph(sda.subdiscipline_area, self.sda_style))
+            for ca in sda.cas:
+                self.add_ca_table(elements, ca)
 
         # Build the document, and return the response.
         doc.build(elements)
         return self.response
 
-    def add_spacer_row(self, elements, col_widths, spacer_width):
+    def add_ca_table(self, elements, ca):
+        """Add a table for a competency area and its eus, followed by a spacer row."""
+        p_ca = Paragraph(ca.competency_area, self.ca_style)
+        data = [('', '', Paragraph(eu.essential_understanding, self.eu_style))
+                for eu in ca.eus]
+        # Make sure to include ca if there were no eu's.
+        if data:
+            data[0] = (p_ca, '', data[0][2])
+        else:
+            data.append((p_ca, '', ''))
+        table = Table(data, colWidths=COL_WIDTHS)
+        table.setStyle(CA_TABLE_STYLE)
+        elements.append(table)
+        self.add_spacer_row(elements)
+
+    def add_spacer_row(self, elements):
         """Add a spacer row between competency areas."""
         data = [('', '', '')]
-        table = Table(data, colWidths=col_widths, rowHeights=(spacer_width))
+        table = Table(data, colWidths=COL_WIDTHS, rowHeights=(SPACER_WIDTH))
         elements.append(table)
@@ -1,13 +1,29 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
 from random import choice
+from datetime import timedelta
 
+from PyPDF2 import PdfFileReader
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import TestCase
 from django.test.client import Client
 from django.core.urlresolvers import reverse
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, AnonymousUser
+from django.db import connection, transaction
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
 
 from competencies.models import *
-from competencies.views import organization
-from competencies import my_admin, utils
+from competencies.views import organization, is_editor, set_parent_order
+from competencies import my_admin, utils, jobs, export, importer, ordering, case, pdf_cache
+from competencies.fragment_cache import LRUCache, summary_cache
+from competencies.sa_summary_pdf import PDFTest
 from users.models import UserProfile
 
 """DEV NOTES
@@ -61,6 +77,9 @@ class CompetencyViewTests(TestCase):
         #   Ensures a unique name for every element, which makes testing some behaviors easier.
         self.element_number = 0
 
+        # Test dbs reuse ids, so don't let cached summaries leak between tests.
+        summary_cache.clear()
+
     def build_to_organizations(self):
         """Build out system to the organization level."""
         # Build a test organization that user 0 is associated with,
@@ -194,6 +213,43 @@ class CompetencyViewTests(TestCase):
                 self.assertFalse(org in response.context['public_organizations'])
 
 
+    def test_organizations_view_pages(self):
+        """Organizations page is paged, and the public list can be narrowed by name."""
+        self.build_to_organizations()
+        for org_num in range(60):
+            Organization.objects.create(name='Public %02d' % org_num, owner=self.test_user_1,
+                                        public=True)
+        Organization.objects.create(name='Another school', owner=self.test_user_1,
+                                    public=True)
+        editor_org = Organization.objects.create(name='Zebra school', owner=self.test_user_1)
+        editor_org.editors.add(self.test_user_0)
+        test_url = reverse('competencies:organizations')
+
+        # Anonymous users get a page of public orgs from one query, plus a count.
+        with self.assertNumQueries(2):
+            response = self.client.get(test_url)
+        self.assertEqual(len(response.context['public_organizations']), 50)
+        self.assertEqual(response.context['public_organizations'][0].name, 'Another school')
+        response = self.client.get(test_url, {'page': 2})
+        self.assertEqual(len(response.context['public_organizations']), 11)
+
+        # The user's own orgs are listed on their own, tagged with the user's role,
+        #   and public ones are listed with the other public orgs as well.
+        own_org = self.test_organizations[0]
+        own_org.public = True
+        own_org.save()
+        self.client.login(username='testuser0', password='pw')
+        response = self.client.get(test_url, {'prefix': 'public 1'})
+        self.assertEqual(response.context['my_organizations'], [own_org])
+        self.assertEqual(response.context['editor_organizations'], [editor_org])
+        self.assertEqual([org.name for org in response.context['public_organizations']],
+                         ['Public %02d' % org_num for org_num in range(10, 20)])
+        response = self.client.get(test_url, {'prefix': 'test'})
+        self.assertEqual(response.context['my_organizations'], [own_org])
+        public_organizations = response.context['public_organizations']
+        self.assertEqual([(org, org.user_role) for org in public_organizations],
+                         [(own_org, utils.ROLE_OWNER)])
+
     def test_organization_view_logged_in(self):
         """Organization page lists subject areas and subdiscipline areas for that organization."""
         self.build_to_sas()
@@ -207,6 +263,8 @@ class CompetencyViewTests(TestCase):
 
             # For now, all users can see the names of all organizations.
             self.assertEqual(organization, response.context['organization'])
+            self.assertEqual(response.context['is_editor'],
+                             organization_num < self.num_orgs/2)
 
             if organization_num < self.num_orgs/2:
                 # User should see sa and sdas for organization they have permissions on.
@@ -222,6 +280,19 @@ class CompetencyViewTests(TestCase):
                     for sda in sa.subdisciplinearea_set.all():
                         self.assertFalse(sda in response.context['sdas'])
 
+    def test_is_editor(self):
+        """Test that is_editor asks the db once per organization, for each user object."""
+        self.build_to_organizations()
+        editor_org, other_org = self.test_organizations[0], self.test_organizations[-1]
+        user = User.objects.get(id=self.test_user_0.id)
+        with self.assertNumQueries(2):
+            for check in range(3):
+                self.assertTrue(is_editor(user, editor_org))
+                self.assertFalse(is_editor(user, other_org))
+        # Anonymous users are never editors, and don't need a query.
+        with self.assertNumQueries(0):
+            self.assertFalse(is_editor(AnonymousUser(), editor_org))
+
     def test_organization_admin_summary_view(self):
         """Displays a summary of org to owner."""
 
@@ -429,6 +500,17 @@ class CompetencyViewTests(TestCase):
         response = self.client.post(test_url, post_data)
         self.assertEqual(response.status_code, 302)
 
+        # Fork runs in the background; the fork page shows its progress until it's done.
+        self.assertFalse(forking_org.subjectarea_set.exists())
+        response = self.client.get(test_url)
+        self.assertTrue(response.context['fork_job'].is_active())
+        status_url = reverse('competencies:fork_status', args=[forking_org.id])
+        response = self.client.get(status_url)
+        self.assertEqual(json.loads(response.content.decode())['status'], 'queued')
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+        response = self.client.get(status_url)
+        self.assertEqual(json.loads(response.content.decode())['status'], 'done')
+
         # Verify that elements match appropriately.
         #   These tests depend on every element having a unique name.
         forked_sas = forking_org.subjectarea_set.all()
@@ -634,20 +716,619 @@ class CompetencyViewTests(TestCase):
 
         sdas = sa.subdisciplinearea_set.all()
         for sda in sdas:
-            self.assertTrue(sda in response.context['sdas'])
             self.assertTrue(sda.subdiscipline_area in content_str)
 
         cas = sa.competencyarea_set.all()
         for ca in cas:
-            self.assertTrue(ca in response.context['cas'])
             self.assertTrue(ca.competency_area in content_str)
 
         eus = ca.essentialunderstanding_set.all()
         for eu in eus:
-            self.assertTrue(eu in response.context['eus'])
             self.assertTrue(eu.essential_understanding in content_str)
 
+        # A repeat visit uses the cached tree.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(test_url)
+        num_cached_queries = len(queries)
+        summary_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(test_url)
+        num_queries = len(queries)
+        self.assertTrue(num_cached_queries < num_queries)
+
+        # Editing the subject area invalidates the cached tree.
+        #   Rendering cost in queries doesn't grow with the size of the subject area.
+        for eu_num in range(5):
+            EssentialUnderstanding.objects.create(essential_understanding='Extra EU %d' % eu_num,
+                                                  competency_area=ca)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(test_url)
+        self.assertTrue('Extra EU 4' in response.content.decode())
+        self.assertEqual(len(queries), num_queries)
+
+        # Anonymous users get their own copy, without private elements.
+        self.client.logout()
+        response = self.client.get(test_url)
+        self.assertFalse('Extra EU 4' in response.content.decode())
+        # Reordering bumps the version too. Reverse the order directly, then move
+        #   an eu through the view; the summary should show the final db order.
+        self.client.login(username='testuser0', password='pw')
+        ca.set_essentialunderstanding_order(list(reversed(ca.get_essentialunderstanding_order())))
+        move_url = reverse('competencies:move_element',
+                           args=['EssentialUnderstanding', eus[0].id, 'up', sa.id])
+        self.client.get(move_url)
+        content_str = self.client.get(test_url).content.decode()
+        order = [content_str.index(eu.essential_understanding)
+                 for eu in ca.essentialunderstanding_set.all()]
+        self.assertEqual(order, sorted(order))
+
+    def test_sa_summary_pdf_view(self):
+        """Test that summary pdfs are cached by content, and support conditional GETs."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        sa = self.test_organizations[0].subjectarea_set.all()[0]
+        test_url = reverse('competencies:sa_summary_pdf', args=(sa.id,))
+        self.client.login(username='testuser0', password='pw')
+
+        pdf_cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pdf_cache_dir)
+        with self.settings(PDF_CACHE_DIR=pdf_cache_dir):
+            response = self.client.get(test_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+            etag = response['ETag']
+            self.assertEqual(len(os.listdir(pdf_cache_dir)), 1)
+
+            # Client already has this pdf.
+            response = self.client.get(test_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            last_modified = response['Last-Modified']
+            response = self.client.get(test_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+
+            # Anonymous users see a different pdf.
+            self.client.logout()
+            response = self.client.get(test_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.client.login(username='testuser0', password='pw')
+
+            # An edit changes the content, so the old etag no longer matches.
+            eu = EssentialUnderstanding.objects.filter(competency_area__subject_area=sa)[0]
+            eu.essential_understanding = 'Edited EU'
+            eu.save()
+            response = self.client.get(test_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+            # The canvas engine draws the same content into its own cached pdf.
+            response = self.client.get(test_url + '?engine=canvas')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            pdf = PdfFileReader(BytesIO(b''.join(response.streaming_content)))
+            text = ''.join(pdf.getPage(page_num).extractText()
+                           for page_num in range(pdf.getNumPages()))
+            for ca in sa.competencyarea_set.all():
+                self.assertTrue(ca.competency_area in text)
+            self.assertTrue('Edited EU' in text)
+            self.assertEqual(len(os.listdir(pdf_cache_dir)), 4)
+
+            # A sweep deletes pdfs built too long ago, like the ones the edit left behind.
+            canvas_path = pdf_cache.get_pdf_path(response['ETag'].strip('"'))
+            old = time.time() - (pdf_cache.get_max_age_days() + 1) * 24 * 60 * 60
+            for name in os.listdir(pdf_cache_dir):
+                path = os.path.join(pdf_cache_dir, name)
+                if path != canvas_path:
+                    os.utime(path, (old, old))
+            jobs.enqueue_sweep_pdf_cache()
+            self.assertEqual(jobs.run_pending_jobs(), 1)
+            self.assertEqual(os.listdir(pdf_cache_dir), [os.path.basename(canvas_path)])
+
+    def test_sa_summary_pdf_background(self):
+        """Test that a background pdf is built by a shared job, then downloaded."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        sa = self.test_organizations[0].subjectarea_set.all()[0]
+        test_url = reverse('competencies:sa_summary_pdf', args=(sa.id,)) + '?render=background'
+        pdf_cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pdf_cache_dir)
+
+        with self.settings(PDF_CACHE_DIR=pdf_cache_dir):
+            # Concurrent requests share one job, and nothing is built in the request.
+            response = self.client.get(test_url)
+            self.assertEqual(response.status_code, 200)
+            pdf_job = response.context['pdf_job']
+            response = self.client.get(test_url)
+            self.assertEqual(response.context['pdf_job'], pdf_job)
+            self.assertEqual(os.listdir(pdf_cache_dir), [])
+
+            status_url = reverse('competencies:sa_summary_pdf_status', args=(sa.id, pdf_job.id))
+            response = self.client.get(status_url)
+            self.assertEqual(json.loads(response.content.decode())['status'], 'queued')
+
+            self.assertEqual(jobs.run_pending_jobs(), 1)
+            status = json.loads(self.client.get(status_url).content.decode())
+            self.assertEqual(status['status'], 'done')
+
+            # Once built, the pdf is served straight away.
+            response = self.client.get(status['download_url'] + '?render=background')
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_organization_summary_pdf(self):
+        """Test that an organization pdf has a contents page, then a bookmarked section
+        for each subject area."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        org = self.test_organizations[0]
+        test_url = reverse('competencies:organization_summary_pdf', args=(org.id,))
+        self.client.login(username='testuser0', password='pw')
+        pdf_cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pdf_cache_dir)
+
+        with self.settings(PDF_CACHE_DIR=pdf_cache_dir, PDF_PROCESSES=2):
+            response = self.client.get(test_url)
+            pdf_job = response.context['pdf_job']
+            self.assertEqual(pdf_job.total, org.subjectarea_set.count())
+            self.assertEqual(jobs.run_pending_jobs(), 1)
+            status_url = reverse('competencies:organization_summary_pdf_status',
+                                 args=(org.id, pdf_job.id))
+            status = json.loads(self.client.get(status_url).content.decode())
+            self.assertEqual((status['status'], status['progress']), ('done', pdf_job.total))
+
+            response = self.client.get(test_url)
+            pdf = PdfFileReader(BytesIO(b''.join(response.streaming_content)))
+            bookmarks = pdf.getOutlines()
+            self.assertEqual([bookmark.title for bookmark in bookmarks],
+                             [sa.subject_area for sa in org.subjectarea_set.all()])
+            # The contents page lists every subject area, and each section follows it.
+            contents = pdf.getPage(0).extractText()
+            for sa in org.subjectarea_set.all():
+                self.assertTrue(sa.subject_area in contents)
+            self.assertTrue(pdf.getNumPages() > len(bookmarks))
+
+    def test_make_summary_same_named_sdas(self):
+        """Test that the summary pdf groups cas by sda, not by sda name."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        org = self.test_organizations[0]
+        sa = org.subjectarea_set.all()[0]
+        sa.subdisciplinearea_set.update(subdiscipline_area='Same SDA')
+        tree = utils.get_subject_area_tree(sa, {})
+
+        buffer = BytesIO()
+        with self.assertNumQueries(0):
+            PDFTest(buffer).makeSummary(org, sa, tree)
+        pdf = PdfFileReader(BytesIO(buffer.getvalue()))
+        text = ''.join(pdf.getPage(page_num).extractText()
+                       for page_num in range(pdf.getNumPages()))
+        for ca in tree.cas:
+            self.assertEqual(text.count(ca.competency_area), 1)
+
+    def test_organization_export(self):
+        """Test that an export streams every visible element, parents first."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        org = self.test_organizations[0]
+        for eu in EssentialUnderstanding.objects.all():
+            LearningTarget.objects.create(essential_understanding=eu, learning_target='LT')
+        test_url = reverse('competencies:organization_export', args=(org.id,))
+
+        # Editors get every element, in chunks.
+        self.client.login(username='testuser0', password='pw')
+        export.EXPORT_CHUNK_SIZE, chunk_size = 5, export.EXPORT_CHUNK_SIZE
+        try:
+            response = self.client.get(test_url)
+            rows = [json.loads(line) for line in
+                    b''.join(response.streaming_content).decode().splitlines()]
+        finally:
+            export.EXPORT_CHUNK_SIZE = chunk_size
+        num_elements = sum(model.objects.filter(organization=org).count()
+                           for model in TREE_MODELS)
+        self.assertEqual(len(rows), num_elements)
+        seen = {('o', org.id)}
+        for row in rows:
+            self.assertTrue((row['parent_type'], row['parent_id']) in seen)
+            seen.add((row['type'], row['id']))
+        ca = CompetencyArea.objects.filter(subdiscipline_area__isnull=False)[0]
+        ca_row = [row for row in rows if row['type'] == 'ca' and row['id'] == ca.id][0]
+        self.assertEqual((ca_row['parent_type'], ca_row['parent_id'], ca_row['text']),
+                         ('sda', ca.subdiscipline_area_id, ca.competency_area))
+
+        # Everyone else only gets public elements, of a public org.
+        self.client.logout()
+        sa = org.subjectarea_set.all()[0]
+        sa.public = True
+        sa.save()
+        self.assertEqual(self.client.get(test_url).status_code, 404)
+        org.public = True
+        org.save()
+        response = self.client.get(test_url + '?format=csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(export.EXPORT_FIELDS))
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('sa,%d,o,%d,' % (sa.id, org.id)))
+
+        # The management command exports everything.
+        output = StringIO()
+        call_command('export_organization', str(org.id), stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), num_elements)
+
+    def get_structure(self, organization):
+        """Return each element's type, parent's text, order and text, for comparing trees."""
+        rows = list(export.iterate_elements(organization, {}))
+        texts = {(row['type'], row['id']): row['text'] for row in rows}
+        texts[('o', organization.id)] = ''
+        return sorted((row['type'], texts[(row['parent_type'], row['parent_id'])],
+                       row['order'], row['text']) for row in rows)
+
+    def test_organization_import(self):
+        """Test that an export imports into another org, and that bad files import nothing."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        org = self.test_organizations[0]
+        for eu in EssentialUnderstanding.objects.all():
+            LearningTarget.objects.create(essential_understanding=eu, learning_target='LT')
+        output = StringIO()
+        call_command('export_organization', str(org.id), '--format', 'csv', stdout=output)
+        export_csv = output.getvalue().encode()
+
+        new_org = Organization.objects.create(name='Imported', owner=self.test_user_0)
+        new_org.editors.add(self.test_user_0)
+        test_url = reverse('competencies:organization_import', args=(new_org.id,))
+        self.client.login(username='testuser0', password='pw')
+
+        # A dry run counts the elements, without creating any.
+        response = self.client.post(test_url, {'import_file': SimpleUploadedFile('o.csv',
+                                                                                 export_csv),
+                                               'import_format': 'csv', 'dry_run': 'on'})
+        counts = dict(response.context['counts'])
+        self.assertEqual(counts['ca'], CompetencyArea.objects.filter(organization=org).count())
+        self.assertFalse(new_org.subjectarea_set.exists())
+
+        # Errors are reported with their line numbers, and nothing is created.
+        bad_file = '\n'.join([
+            json.dumps({'type': 'sa', 'id': 1, 'parent_type': 'o', 'text': 'SA'}),
+            json.dumps({'type': 'ca', 'id': 1, 'parent_type': 'sda', 'parent_id': 9,
+                        'text': 'CA'}),
+            'not json',
+            json.dumps({'type': 'eu', 'id': 1, 'parent_type': 'sa', 'parent_id': 1,
+                        'text': ''}),
+        ]).encode()
+        response = self.client.post(test_url, {'import_file': SimpleUploadedFile('b.jsonl',
+                                                                                 bad_file),
+                                               'import_format': 'jsonl'})
+        self.assertEqual(response.context['errors'],
+                         ["line 2: parent sda '9' is not defined above this line",
+                          'line 3: not a valid row',
+                          "line 4: a 'eu' can't be placed under a 'sa'",
+                          'line 4: missing text'])
+        self.assertFalse(new_org.subjectarea_set.exists())
+
+        # A real import recreates the tree, in the same order.
+        response = self.client.post(test_url, {'import_file': SimpleUploadedFile('o.csv',
+                                                                                 export_csv),
+                                               'import_format': 'csv'})
+        self.assertEqual(dict(response.context['counts']), counts)
+        self.assertEqual(self.get_structure(new_org), self.get_structure(org))
+        for ca in CompetencyArea.objects.filter(organization=new_org,
+                                                subdiscipline_area__isnull=False):
+            self.assertEqual(ca.subject_area_id, ca.subdiscipline_area.subject_area_id)
+
+        # The management command validates too.
+        output = StringIO()
+        call_command('import_organization', str(new_org.id), os.devnull, '--dry-run',
+                     stdout=output)
+        self.assertEqual(output.getvalue().splitlines()[0], 'Would import 0 sa.')
+
+    def test_case_import_export(self):
+        """Test that a CASE package round-trips, and that bad items are reported."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        org = self.test_organizations[0]
+        for eu in EssentialUnderstanding.objects.all():
+            LearningTarget.objects.create(essential_understanding=eu, learning_target='LT')
+        self.client.login(username='testuser0', password='pw')
+        response = self.client.get(reverse('competencies:organization_export', args=(org.id,))
+                                   + '?format=case')
+        package = b''.join(response.streaming_content)
+        parsed = json.loads(package.decode())
+        self.assertEqual(parsed['CFDocument']['title'], org.name)
+        num_elements = sum(model.objects.filter(organization=org).count()
+                           for model in TREE_MODELS)
+        self.assertEqual((len(parsed['CFItems']), len(parsed['CFAssociations'])),
+                         (num_elements, num_elements))
+
+        new_org = Organization.objects.create(name='Imported', owner=self.test_user_0)
+        with tempfile.NamedTemporaryFile(suffix='.json') as package_file:
+            package_file.write(package)
+            package_file.flush()
+            call_command('import_organization', str(new_org.id), package_file.name,
+                         '--format', 'case', stdout=StringIO())
+        self.assertEqual(self.get_structure(new_org), self.get_structure(org))
+
+        # An lt can't have children, an item with no parent can't be placed, and
+        #   an item whose parent has an error isn't imported either.
+        lt_item = [item for item in parsed['CFItems']
+                   if item['CFItemType'] == 'Learning Target'][0]
+        parsed['CFItems'] += [{'identifier': 'child-of-lt', 'fullStatement': 'Too deep'},
+                              {'identifier': 'orphan', 'fullStatement': 'Orphan'},
+                              {'identifier': 'no-text', 'fullStatement': ''},
+                              {'identifier': 'child-of-no-text', 'fullStatement': 'Child'}]
+        for origin, destination in [('child-of-lt', lt_item),
+                                    ('no-text', parsed['CFDocument']),
+                                    ('child-of-no-text', {'identifier': 'no-text'})]:
+            parsed['CFAssociations'].append({'associationType': 'isChildOf',
+                                             'originNodeURI': {'identifier': origin},
+                                             'destinationNodeURI': destination})
+        rows, errors = importer.parse_import(BytesIO(json.dumps(parsed).encode()), 'case')
+        self.assertEqual(len(rows), num_elements)
+        self.assertEqual(errors, ["item %d: a learning target can't have children"
+                                  % (num_elements + 1),
+                                  'item %d: not a child of the CFDocument or of another item'
+                                  % (num_elements + 2),
+                                  'item %d: missing text' % (num_elements + 3),
+                                  'item %d: its parent, item %d, was not imported'
+                                  % (num_elements + 4, num_elements + 3)])
+
+    def test_case_sequence_numbers(self):
+        """Test that CASE sequence numbers count each sibling group from 1, after a reorder."""
+        self.num_orgs = 1
+        self.num_elements = 3
+        self.build_to_eus()
+        org = self.test_organizations[0]
+        sa = org.subjectarea_set.all()[0]
+        sda = sa.subdisciplinearea_set.all()[0]
+        general_ids = list(sa.competencyarea_set.filter(
+            subdiscipline_area=None).values_list('id', flat=True))
+        sda_ids = list(sda.competencyarea_set.values_list('id', flat=True))
+        self.client.login(username='testuser0', password='pw')
+        new_ids = general_ids[1:] + general_ids[:1]
+        self.client.post(reverse('competencies:reorder_elements', args=('sa', sa.id, 'ca')),
+                         {'order': ','.join(str(id) for id in new_ids)})
+
+        response = self.client.get(reverse('competencies:organization_export', args=(org.id,))
+                                   + '?format=case')
+        parsed = json.loads(b''.join(response.streaming_content).decode())
+        sequence_numbers = {association['originNodeURI']['identifier']:
+                            association['sequenceNumber']
+                            for association in parsed['CFAssociations']}
+        for ids in (new_ids, sda_ids):
+            self.assertEqual([sequence_numbers[case.get_identifier('ca', id)] for id in ids],
+                             list(range(1, len(ids) + 1)))
+
+    def test_api(self):
+        """Test the json api's visibility, pagination, sparse trees and ETags."""
+        self.build_to_eus()
+        org = self.test_organizations[0]
+        org.public = True
+        org.save()
+        sa = org.subjectarea_set.all()[0]
+
+        # Anonymous users see public orgs, and only public elements.
+        response = self.client.get(reverse('competencies:api_organizations') + '?page_size=1')
+        data = json.loads(response.content.decode())
+        self.assertEqual((data['count'], data['num_pages']), (1, 1))
+        self.assertEqual(data['results'][0]['name'], org.name)
+        response = self.client.get(reverse('competencies:api_subject_area', args=(sa.id,)))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('competencies:api_subject_areas', args=(org.id,)))
+        self.assertEqual(json.loads(response.content.decode())['results'], [])
+        # Private orgs are hidden from everyone but their editors.
+        private_org = self.test_organizations[1]
+        for url_name in ('api_organization', 'api_subject_areas'):
+            test_url = reverse('competencies:' + url_name, args=(private_org.id,))
+            self.assertEqual(self.client.get(test_url).status_code, 404)
+            self.client.login(username='testuser0', password='pw')
+            self.assertEqual(self.client.get(test_url).status_code, 404)
+            self.client.login(username='testuser1', password='pw')
+            self.assertEqual(self.client.get(test_url).status_code, 200)
+            self.client.logout()
+
+        # Editors see their private orgs, and whole trees.
+        self.client.login(username='testuser0', password='pw')
+        response = self.client.get(reverse('competencies:api_organizations') + '?page=2')
+        self.assertEqual(response.status_code, 400)
+        test_url = reverse('competencies:api_subject_area', args=(sa.id,))
+        response = self.client.get(test_url + '?fields=id,text')
+        tree = json.loads(response.content.decode())
+        self.assertEqual(set(tree), {'id', 'text', 'children'})
+        ca = CompetencyArea.objects.filter(subject_area=sa, subdiscipline_area__isnull=True)[0]
+        ca_node = [node for node in tree['children'] if node['id'] == ca.id][0]
+        self.assertEqual([node['text'] for node in ca_node['children']],
+                         [eu.essential_understanding for eu in ca.essentialunderstanding_set.all()])
+        response = self.client.get(test_url + '?depth=0')
+        self.assertNotIn('children', json.loads(response.content.decode()))
+        self.assertEqual(self.client.get(test_url + '?fields=nope').status_code, 400)
+
+        # A tree the client already has costs a 304, with no tree queries.
+        etag = self.client.get(test_url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(test_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in queries if 'competencyarea' in q['sql']])
+
+        # An edit changes the ETag.
+        ca.competency_area = 'Changed'
+        ca.save()
+        response = self.client.get(test_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_lru_cache(self):
+        """Test that the fragment cache drops its least recently used entry when full."""
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c'), len(cache)), (1, 3, 2))
+
+
+    def test_edit_sa_summary_writes_changes(self):
+        """Test that saving the edit page only writes the sa's changes, and that
+        saving an element inline only writes that element."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        sa = self.test_organizations[0].subjectarea_set.all()[0]
+        test_url = reverse('competencies:edit_sa_summary', args=(sa.id,))
+        self.client.login(username='testuser0', password='pw')
+
+        # Submitting the sa form unchanged writes nothing, and builds no other forms.
+        post_data = {'subject_area': sa.subject_area, 'description': sa.description}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(test_url, post_data)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse([q for q in queries if 'UPDATE' in q['sql']])
+        self.assertFalse([q for q in queries if 'competencyarea' in q['sql']])
+
+        # An inline edit writes one element and its summary version.
+        version = SubjectArea.objects.get(id=sa.id).summary_version
+        ca = sa.competencyarea_set.all()[0]
+        eu = ca.essentialunderstanding_set.all()[0]
+        element_url = reverse('competencies:element_form', args=('eu', eu.id))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(element_url, {'essential_understanding': 'changed eu'})
+        self.assertEqual(response.status_code, 200)
+        updates = [q['sql'] for q in queries if 'UPDATE' in q['sql']]
+        self.assertEqual(len(updates), 2)
+        self.assertIn('essentialunderstanding', updates[0])
+        self.assertEqual(EssentialUnderstanding.objects.get(id=eu.id).essential_understanding,
+                         'changed eu')
+        self.assertEqual(SubjectArea.objects.get(id=sa.id).summary_version, version + 1)
+
+        # Posting an element's form unchanged writes nothing.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(element_url, {'essential_understanding': 'changed eu'})
+        self.assertFalse([q for q in queries if 'UPDATE' in q['sql']])
+
+    def test_element_form(self):
+        """Test loading and saving one element's form, for inline editing."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        ca = CompetencyArea.objects.filter(organization=self.test_organizations[0])[0]
+        test_url = reverse('competencies:element_form', args=('ca', ca.id))
+
+        # Only editors can load forms.
+        self.assertEqual(self.client.get(test_url).status_code, 302)
+        self.client.login(username='testuser1', password='pw')
+        self.assertEqual(self.client.get(test_url).status_code, 403)
+
+        self.client.login(username='testuser0', password='pw')
+        data = json.loads(self.client.get(test_url).content.decode())
+        self.assertIn(ca.competency_area, data['html'])
+
+        # Saving writes one row, and the summary version.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(test_url, {'competency_area': 'inline ca',
+                                                   'public': 'on'})
+        data = json.loads(response.content.decode())
+        self.assertEqual((data['element']['text'], data['element']['public']), ('inline ca', True))
+        updates = [q['sql'] for q in queries if 'UPDATE' in q['sql']]
+        self.assertTrue('competencyarea' in updates[0] and 'summary_version' in updates[1])
+        self.assertTrue(SubjectArea.objects.get(id=ca.subject_area_id).public)
+
+        # An invalid form comes back with its errors.
+        response = self.client.post(test_url, {'competency_area': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('This field is required', json.loads(response.content.decode())['html'])
+        self.assertEqual(CompetencyArea.objects.get(id=ca.id).competency_area, 'inline ca')
+
+    def test_reorder_elements(self):
+        """Test that a whole sibling group is reordered in one request, and one UPDATE.
+        Only the element that is out of place is moved."""
+        self.num_orgs = 1
+        self.num_elements = 3
+        self.build_to_eus()
+        sa = self.test_organizations[0].subjectarea_set.all()[0]
+        sda = sa.subdisciplinearea_set.all()[0]
+        general_ids = list(sa.competencyarea_set.filter(
+            subdiscipline_area=None).values_list('id', flat=True))
+        sda_ids = list(sda.competencyarea_set.values_list('id', flat=True))
+        self.assertTrue(len(general_ids) > 1 and sda_ids)
+        all_order = sa.get_competencyarea_order()
+        test_url = reverse('competencies:reorder_elements', args=('sa', sa.id, 'ca'))
 
+        self.client.login(username='testuser1', password='pw')
+        self.assertEqual(self.client.post(test_url, {'order': ''}).status_code, 403)
+
+        # Moving the last general ca to the top leaves the sda's cas in place.
+        self.client.login(username='testuser0', password='pw')
+        new_ids = general_ids[-1:] + general_ids[:-1]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(test_url,
+                                        {'order': ','.join(str(id) for id in new_ids)})
+        self.assertEqual(json.loads(response.content.decode())['moved'], 1)
+        updates = [q for q in queries if 'UPDATE' in q['sql']]
+        self.assertEqual(len(updates), 2)
+        new_order = sa.get_competencyarea_order()
+        self.assertEqual([id for id in new_order if id in general_ids], new_ids)
+        self.assertEqual([new_order.index(id) for id in sda_ids],
+                         [all_order.index(id) for id in sda_ids])
+
+        # The order must list the whole group, once each.
+        for bad_order in (new_ids[:-1], new_ids + new_ids[:1], new_ids[:-1] + sda_ids[:1]):
+            response = self.client.post(test_url,
+                                        {'order': ','.join(str(id) for id in bad_order)})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(sa.get_competencyarea_order(), new_order)
+
+    def test_sparse_order(self):
+        """Test that inserts and moves only write their own row, and crowded groups rebalance."""
+        self.num_orgs = 1
+        self.num_elements = 4
+        self.build_to_eus()
+        ca = CompetencyArea.objects.filter(organization=self.test_organizations[0])[0]
+        eus = ca.essentialunderstanding_set.all()
+        self.assertEqual([eu._order for eu in eus], [0, ORDER_GAP, 2*ORDER_GAP, 3*ORDER_GAP])
+
+        # A new element goes after its last sibling.
+        new_eu = EssentialUnderstanding.objects.create(competency_area=ca,
+                                                       essential_understanding='new eu')
+        self.assertEqual(new_eu._order, 4*ORDER_GAP)
+
+        # Moving the last element to the top writes one row.
+        order = ca.get_essentialunderstanding_order()
+        new_order = order[-1:] + order[:-1]
+        with CaptureQueriesContext(connection) as queries:
+            set_parent_order(new_eu, new_order)
+        updates = [q['sql'] for q in queries if 'UPDATE' in q['sql']]
+        self.assertEqual(len(updates), 2)
+        self.assertIn('summary_version', updates[1])
+        self.assertEqual(ca.get_essentialunderstanding_order(), new_order)
+
+        # Squeezing into a crowded gap queues a rebalance, which spreads the group out.
+        siblings = ca.essentialunderstanding_set.all()
+        for move in range(9):
+            order = ca.get_essentialunderstanding_order()
+            order.insert(1, order.pop())
+            with transaction.atomic():
+                ordering.apply_order(siblings, order)
+            self.assertEqual(ca.get_essentialunderstanding_order(), order)
+        self.assertEqual(BackgroundJob.objects.filter(job_type='rebalance_order').count(), 1)
+        jobs.run_pending_jobs()
+        self.assertEqual([eu._order for eu in ca.essentialunderstanding_set.all()],
+                         [ORDER_GAP * num for num in range(5)])
+        self.assertEqual(ca.get_essentialunderstanding_order(), order)
+
+        # When there's no room at all, the whole sa is spread out, so cas under
+        #   an sda can't end up sharing positions with the sa's own cas.
+        sa = ca.subject_area
+        general_cas = list(sa.competencyarea_set.filter(subdiscipline_area=None))
+        sda_cas = list(CompetencyArea.objects.filter(subject_area=sa).exclude(
+            subdiscipline_area=None))
+        for position, sa_ca in enumerate(general_cas + sda_cas):
+            CompetencyArea.objects.filter(id=sa_ca.id).update(
+                _order=position if sa_ca in general_cas
+                else ORDER_GAP * (position - len(general_cas) + 1))
+        general_ids = [general_ca.id for general_ca in general_cas]
+        new_ids = [general_ids[0], general_ids[2], general_ids[1]] + general_ids[3:]
+        with transaction.atomic():
+            ordering.apply_order(sa.competencyarea_set.filter(subdiscipline_area=None), new_ids)
+        positions = list(sa.competencyarea_set.values_list('_order', flat=True))
+        self.assertEqual(len(set(positions)), len(positions))
+        self.assertEqual(list(sa.competencyarea_set.filter(
+            subdiscipline_area=None).values_list('id', flat=True)), new_ids)
 
     def test_edit_sa_summary_view(self):
         """Lets user edit a subject area and its sdas, gstds, and pis."""
@@ -683,36 +1364,37 @@ class CompetencyViewTests(TestCase):
         sa = SubjectArea.objects.get(pk=sa_pk)
         self.assertEqual(sa.subject_area, 'modified subject area')
 
+        # Other elements are edited one at a time, through element_form.
         # --- Test modifying a subdiscipline area. ---
         sda = sa.subdisciplinearea_set.all()[0]
         sda_pk = sda.pk
-        sda_form_element_name = 'sda_form_%d-subdiscipline_area' % sda.id
-        post_data = {sda_form_element_name: 'modified sda',}
-        response = self.client.post(test_url, post_data)
+        element_url = reverse('competencies:element_form', args=('sda', sda.id))
+        post_data = {'subdiscipline_area': 'modified sda',}
+        response = self.client.post(element_url, post_data)
 
-        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.status_code, 200)
         sda = SubdisciplineArea.objects.get(pk=sda_pk)
         self.assertEqual(sda.subdiscipline_area, 'modified sda')
 
         # --- Test modifying a competency area. ---
         ca = sa.competencyarea_set.all()[0]
         ca_pk = ca.pk
-        ca_form_element_name = 'ca_form_%d-competency_area' % ca.id
-        post_data = {ca_form_element_name: 'modified ca',}
-        response = self.client.post(test_url, post_data)
+        element_url = reverse('competencies:element_form', args=('ca', ca.id))
+        post_data = {'competency_area': 'modified ca',}
+        response = self.client.post(element_url, post_data)
 
-        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.status_code, 200)
         ca = CompetencyArea.objects.get(pk=ca_pk)
         self.assertEqual(ca.competency_area, 'modified ca')
 
         # --- Test modifying an essential understanding. ---
         eu = ca.essentialunderstanding_set.all()[0]
         eu_pk = eu.pk
-        eu_form_element_name = 'eu_form_%d-essential_understanding' % eu.id
-        post_data = {eu_form_element_name: 'modified eu',}
-        response = self.client.post(test_url, post_data)
+        element_url = reverse('competencies:element_form', args=('eu', eu.id))
+        post_data = {'essential_understanding': 'modified eu',}
+        response = self.client.post(element_url, post_data)
 
-        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.status_code, 200)
         eu = EssentialUnderstanding.objects.get(pk=eu_pk)
         self.assertEqual(eu.essential_understanding, 'modified eu')
 
@@ -786,7 +1468,17 @@ class CompetencyViewTests(TestCase):
             org.public = False
             org.save()
             # Calling utils.cvd() saves to db, but doesn't modify original objects.
-            utils.cascade_visibility_down(org, 'private')
+            #   It issues one update per level, plus one to bump summary versions,
+            #   and reports how many elements changed.
+            with CaptureQueriesContext(connection) as queries:
+                changed = utils.cascade_visibility_down(org, 'private')
+            updates = [q for q in queries.captured_queries if 'UPDATE' in q['sql']]
+            self.assertEqual(len(updates), 6)
+            self.assertEqual(changed['SubjectArea'], org.subjectarea_set.count())
+            self.assertEqual(changed['EssentialUnderstanding'],
+                             EssentialUnderstanding.objects.filter(
+                                 competency_area__subject_area__organization=org).count())
+            self.assertEqual(changed['LearningTarget'], 0)
 
         # Test that all orgs are private.
         for org in self.test_organizations:
@@ -798,6 +1490,15 @@ class CompetencyViewTests(TestCase):
             for db_element in db_elements:
                 self.assertFalse(db_element.public)
 
+        # Cascading from an sda only reaches that sda's cas and eus.
+        sda = self.test_sdas[0]
+        changed = utils.cascade_visibility_down(sda, 'public')
+        self.assertEqual(list(changed.keys()), ['CompetencyArea', 'EssentialUnderstanding',
+                                                'LearningTarget'])
+        self.assertEqual(set(CompetencyArea.objects.filter(public=True)),
+                         set(sda.competencyarea_set.all()))
+        self.assertFalse(SubdisciplineArea.objects.filter(public=True).exists())
+
     def test_cascade_public_up(self):
         """Test utils.cascade_public_up()."""
         # Make sure to test that organization is not set public on cascade.
@@ -811,7 +1512,9 @@ class CompetencyViewTests(TestCase):
         self.assertFalse(eu.public)
         eu.public = True
         # Cascade public up, and test cascade.
+        #   Cascade updates the db, so reload eu to see its ancestors' new values.
         utils.cascade_public_up(eu)
+        eu = EssentialUnderstanding.objects.get(id=eu.id)
         element = eu.get_parent()
         while element.__class__ != Organization:
             self.assertTrue(element.public)
@@ -819,6 +1522,215 @@ class CompetencyViewTests(TestCase):
         # Element is now org, verify it's still private.
         self.assertFalse(element.public)
 
+        # Publishing many elements at once publishes the union of their ancestors,
+        #   one update per level, plus one to bump summary versions.
+        SubjectArea.objects.update(public=False)
+        SubdisciplineArea.objects.update(public=False)
+        CompetencyArea.objects.update(public=False)
+        sda_ca = CompetencyArea.objects.filter(subdiscipline_area__isnull=False)[0]
+        elements = list(sda_ca.essentialunderstanding_set.all()) + [sda_ca]
+        with CaptureQueriesContext(connection) as queries:
+            changed = utils.cascade_public_up_batch(elements)
+        updates = [q for q in queries.captured_queries if 'UPDATE' in q['sql']]
+        self.assertEqual(len(updates), 4)
+        self.assertEqual(changed, {'SubjectArea': 1, 'SubdisciplineArea': 1, 'CompetencyArea': 1})
+        self.assertEqual(list(SubjectArea.objects.filter(public=True)), [sda_ca.subject_area])
+        self.assertEqual(list(SubdisciplineArea.objects.filter(public=True)),
+                         [sda_ca.subdiscipline_area])
+
+    def test_get_subject_area_tree(self):
+        """Test that the tree loader groups elements, in a fixed number of queries."""
+        self.num_orgs = 1
+        self.build_to_eus()
+        sa = self.test_organizations[0].subjectarea_set.all()[0]
+        for eu in EssentialUnderstanding.objects.filter(competency_area__subject_area=sa):
+            LearningTarget.objects.create(essential_understanding=eu,
+                                          learning_target='LT for %d' % eu.id)
+
+        # One query each for sdas, cas, eus, and lts.
+        with self.assertNumQueries(4):
+            tree = utils.get_subject_area_tree(sa, {})
+
+            # Walking the tree should not hit the db.
+            for ca in tree.general_cas:
+                self.assertFalse(ca.subdiscipline_area_id)
+                for eu in ca.eus:
+                    self.assertEqual(eu.competency_area, ca)
+                    self.assertEqual(len(eu.lts), 1)
+            for sda in tree.sdas:
+                for ca in sda.cas:
+                    self.assertEqual(ca.subdiscipline_area, sda)
+
+        self.assertEqual(list(tree.sdas), list(sa.subdisciplinearea_set.all()))
+        self.assertEqual(list(tree.cas), list(sa.competencyarea_set.all()))
+        self.assertEqual(len(tree.eus), len(tree.cas) * self.num_elements)
+        self.assertEqual(len(tree.lts), len(tree.eus))
+
+        # Visibility filter is applied at every level.
+        public_ca = tree.general_cas[0]
+        public_ca.public = True
+        public_ca.save()
+        tree = utils.get_subject_area_tree(sa, {'public': True})
+        self.assertEqual(tree.general_cas, [public_ca])
+        self.assertEqual(tree.sdas, [])
+        self.assertEqual(tree.eus, [])
+
+    def test_fork_organization(self):
+        """Test utils.fork_organization() copies every level, in order, including lts."""
+        self.build_to_eus()
+        original_org, forking_org = self.test_organizations
+        original_org.public = True
+        original_org.save()
+        utils.cascade_visibility_down(original_org, 'public')
+        for eu in EssentialUnderstanding.objects.filter(
+                competency_area__subject_area__organization=original_org):
+            for lt_num in range(2):
+                LearningTarget.objects.create(essential_understanding=eu, public=True,
+                                              learning_target='LT %d %d' % (lt_num, eu.id))
+        # Delete all of forking_org's elements, so it can fork.
+        forking_org.subjectarea_set.all().delete()
+
+        # Reorder a ca group, to make sure order is copied rather than insertion order.
+        original_sa = original_org.subjectarea_set.all()[0]
+        ca_order = original_sa.get_competencyarea_order()
+        original_sa.set_competencyarea_order(list(reversed(ca_order)))
+
+        self.assertEqual(utils.fork_organization(forking_org, original_org), forking_org)
+
+        def summarize(org):
+            summary = []
+            for sa in org.subjectarea_set.all():
+                tree = utils.get_subject_area_tree(sa, {})
+                summary.append(sa.subject_area)
+                for ca in tree.cas:
+                    summary.append((ca.competency_area, str(ca.subdiscipline_area)))
+                    for eu in ca.eus:
+                        summary.append(eu.essential_understanding)
+                        summary += [lt.learning_target for lt in eu.lts]
+            return summary
+
+        self.assertEqual(summarize(forking_org), summarize(original_org))
+        forked_lts = LearningTarget.objects.filter(
+            essential_understanding__competency_area__subject_area__organization=forking_org)
+        original_lts = LearningTarget.objects.filter(
+            essential_understanding__competency_area__subject_area__organization=original_org)
+        self.assertEqual(forked_lts.count(), original_lts.count())
+        # Copies take on forking org's visibility.
+        self.assertFalse(forking_org.subjectarea_set.filter(public=True).exists())
+        # Copies get paths within the forking org.
+        for lt in forked_lts:
+            self.assertEqual(lt.tree_path, lt.get_parent().get_subtree_path())
+
+        # A non-empty org can't fork.
+        num_sas = SubjectArea.objects.count()
+        self.assertIsNone(utils.fork_organization(forking_org, original_org))
+        self.assertEqual(SubjectArea.objects.count(), num_sas)
+
+    def test_fork_job_resumes(self):
+        """Test that an interrupted fork job resumes without copying anything twice."""
+        self.build_to_eus()
+        original_org, forking_org = self.test_organizations
+        original_org.public = True
+        original_org.save()
+        utils.cascade_visibility_down(original_org, 'public')
+        forking_org.subjectarea_set.all().delete()
+
+        job = jobs.enqueue_fork(forking_org, original_org)
+        self.assertEqual(job.total, utils.count_public_elements(original_org))
+        # Only one fork job can be active for an org.
+        self.assertEqual(jobs.enqueue_fork(forking_org, original_org), job)
+
+        # Simulate a worker that copied the first sa, then died.
+        job = jobs.claim_next_job()
+        first_sa = original_org.subjectarea_set.all()[0]
+        with transaction.atomic():
+            sa_map, num_copied = utils.fork_subject_areas(forking_org, original_org, [first_sa])
+            job.save_checkpoint({'forked_sas': {str(first_sa.id): sa_map[first_sa.id]}},
+                                num_copied)
+        self.assertIsNone(jobs.claim_next_job())
+        stale = timezone.now() - timedelta(seconds=jobs.JOB_STALE_SECONDS + 1)
+        BackgroundJob.objects.filter(id=job.id).update(updated=stale)
+
+        # Another worker picks up the stale job, and finishes it.
+        first_worker_job = job
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+        job = BackgroundJob.objects.get(id=job.id)
+        self.assertEqual(job.status, BackgroundJob.DONE)
+        self.assertEqual(job.progress, job.total)
+        # The checkpoint records each sa's copy.
+        self.assertEqual(sorted(job.get_checkpoint()['forked_sas'].values()),
+                         sorted(forking_org.subjectarea_set.values_list('id', flat=True)))
+        self.assertEqual([sa.subject_area for sa in forking_org.subjectarea_set.all()],
+                         [sa.subject_area for sa in original_org.subjectarea_set.all()])
+        self.assertEqual(CompetencyArea.objects.filter(subject_area__organization=forking_org).count(),
+                         CompetencyArea.objects.filter(subject_area__organization=original_org).count())
+
+        # If the first worker was only slow, it reads the new checkpoint before
+        #   each sa, and copies nothing more.
+        jobs.run_fork(first_worker_job)
+        self.assertEqual(forking_org.subjectarea_set.count(),
+                         original_org.subjectarea_set.count())
+
+    def test_tree_path(self):
+        """Test that tree paths are set on save, and follow elements that move."""
+        self.build_to_eus()
+        org = self.test_organizations[0]
+        sda = SubdisciplineArea.objects.filter(subject_area__organization=org)[0]
+        ca = sda.competencyarea_set.all()[0]
+        eu = ca.essentialunderstanding_set.all()[0]
+        lt = LearningTarget.objects.create(essential_understanding=eu, learning_target='LT')
+        self.assertEqual(lt.tree_path, 'o%d/sa%d/sda%d/ca%d/eu%d/' % (
+            org.id, sda.subject_area_id, sda.id, ca.id, eu.id))
+        self.assertEqual(utils.get_ancestors(lt), [sda.subject_area, sda, ca, eu])
+        self.assertEqual(utils.count_descendants(ca),
+                         {'EssentialUnderstanding': ca.essentialunderstanding_set.count(),
+                          'LearningTarget': 1})
+
+        # Move the ca out of its sda; its descendants' paths follow it.
+        num_sda_descendants = sum(utils.count_descendants(sda).values())
+        num_ca_subtree = sum(utils.count_descendants(ca).values()) + 1
+        ca.subdiscipline_area = None
+        with CaptureQueriesContext(connection) as queries:
+            ca.save()
+        # The ca itself, its eus and lts, and its subject area's summary version.
+        updates = [q for q in queries.captured_queries if 'UPDATE' in q['sql']]
+        self.assertEqual(len(updates), 4)
+        lt = LearningTarget.objects.get(id=lt.id)
+        self.assertEqual(lt.tree_path, 'o%d/sa%d/ca%d/eu%d/' % (
+            org.id, sda.subject_area_id, ca.id, eu.id))
+        self.assertEqual(sum(utils.count_descendants(sda).values()),
+                         num_sda_descendants - num_ca_subtree)
+        for eu in ca.essentialunderstanding_set.all():
+            self.assertEqual(eu.tree_path, ca.get_subtree_path())
+
+    def test_element_organization(self):
+        """Test that every element stores its organization, and finds it in one query."""
+        self.build_to_eus()
+        for eu in EssentialUnderstanding.objects.all():
+            LearningTarget.objects.create(essential_understanding=eu, learning_target='LT')
+        for model in TREE_MODELS:
+            for element in model.objects.all():
+                # Walk up the fk chain to check the stored organization.
+                ancestor = element.get_parent()
+                while ancestor.__class__ != Organization:
+                    ancestor = ancestor.get_parent()
+                self.assertEqual(element.organization_id, ancestor.id)
+
+        lt = LearningTarget.objects.all()[0]
+        with self.assertNumQueries(1):
+            self.assertEqual(lt.get_organization().id, int(lt.tree_path.split('/')[0][1:]))
+
+        # Forked copies belong to the forking org.
+        original_org, forking_org = self.test_organizations
+        original_org.public = True
+        original_org.save()
+        utils.cascade_visibility_down(original_org, 'public')
+        forking_org.subjectarea_set.all().delete()
+        utils.fork_organization(forking_org, original_org)
+        self.assertEqual(
+            LearningTarget.objects.filter(organization=forking_org).count(),
+            LearningTarget.objects.filter(organization=original_org).count())
+
     def test_move_element(self):
         """Test that move_element() results in the proper new order when appropriate."""
         # Tests: sa eu, sda eu; sa first eu up, sa last eu down
@@ -970,3 +1882,68 @@ class CompetencyViewTests(TestCase):
         for eu in eus:
             if eu.essential_understanding != first_eu.essential_understanding:
                 self.assertTrue(eu in current_eus)
+
+    def test_trash_restore_and_purge(self):
+        """Deleting moves a subtree to the trash; it can be restored until it's purged."""
+        self.num_elements = 2
+        self.build_to_eus()
+        org = Organization.objects.all()[0]
+        sa = org.subjectarea_set.all()[0]
+        ca = sa.competencyarea_set.all()[0]
+        eus = list(ca.essentialunderstanding_set.all())
+        sa.public = True
+        sa.save()
+        utils.cascade_visibility_down(sa, 'public')
+        self.client.login(username='testuser0', password='pw')
+
+        # Delete one eu on its own, then its whole ca.
+        for element_type, element in [('EssentialUnderstanding', eus[0]),
+                                      ('CompetencyArea', ca)]:
+            response = self.client.post(reverse('competencies:delete_element',
+                                                args=[element_type, element.id]),
+                                        {'confirm_delete': True})
+            self.assertRedirects(response, reverse('competencies:sa_summary', args=[sa.id]))
+        self.assertFalse(CompetencyArea.objects.filter(id=ca.id).exists())
+        self.assertFalse(EssentialUnderstanding.objects.filter(competency_area=ca).exists())
+        self.assertEqual(EssentialUnderstanding.all_objects.filter(competency_area=ca).count(),
+                         len(eus))
+        ca_entry = TrashEntry.objects.get(element_type='ca', element_id=ca.id)
+        self.assertEqual(ca_entry.num_elements, len(eus))
+        # The purge queued by the deletes finds nothing old enough to purge.
+        self.assertEqual(jobs.run_pending_jobs(), 1)
+        self.assertEqual(TrashEntry.objects.count(), 2)
+
+        # The sa is made private while the ca is in the trash.
+        sa.public = False
+        sa.save()
+        utils.cascade_visibility_down(sa, 'private')
+
+        # Restoring the ca leaves the eu that was deleted first in the trash,
+        #   and makes the restored elements private, like their sa.
+        trash_url = reverse('competencies:organization_trash', args=[org.id])
+        response = self.client.get(trash_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, ca.competency_area)
+        response = self.client.post(trash_url, {'restore': ca_entry.id})
+        self.assertRedirects(response, trash_url)
+        self.assertEqual(self.client.post(trash_url, {'restore': ca_entry.id}).status_code, 404)
+        self.assertEqual(self.client.post(trash_url).status_code, 400)
+        self.assertFalse(CompetencyArea.objects.get(id=ca.id).public)
+        self.assertEqual(list(ca.essentialunderstanding_set.all()), eus[1:])
+        self.assertFalse(ca.essentialunderstanding_set.filter(public=True).exists())
+
+        # Moving the ca moves its trashed eu along with it.
+        other_sda = sa.subdisciplinearea_set.all()[0]
+        ca.subdiscipline_area = other_sda
+        ca.save()
+        self.assertEqual(EssentialUnderstanding.all_objects.get(id=eus[0].id).tree_path,
+                         ca.get_subtree_path())
+
+        # Once the retention period is over, a purge removes the eu for good.
+        TrashEntry.objects.update(deleted_at=timezone.now() - timedelta(days=31))
+        output = StringIO()
+        call_command('purge_trash', stdout=output)
+        self.assertIn('Purged 1 element(s).', output.getvalue())
+        self.assertFalse(TrashEntry.objects.exists())
+        self.assertFalse(EssentialUnderstanding.all_objects.filter(id=eus[0].id).exists())
+        self.assertEqual(list(ca.essentialunderstanding_set.all()), eus[1:])
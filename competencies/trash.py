@@ -0,0 +1,125 @@
+"""Deleting elements into a trash, restoring them, and purging old trash.
+
+Deleting an element marks it and everything below it with deleted_at and
+  a new TrashEntry, one UPDATE per level. Nothing is removed from the db, so
+  deleting a big subject area is as quick as deleting a single eu, and a
+  mistake can be undone from the organization's trash page.
+
+Restoring an entry brings back the rows marked with it. Descendants that
+  were deleted on their own before that keep their own entries, and stay in
+  the trash. Restored elements take on their parent's visibility, in case the
+  parent was made private in the meantime.
+
+Entries older than TRASH_RETENTION_DAYS are purged by the purge_trash job,
+  from the bottom level up, PURGE_BATCH_SIZE rows per DELETE. Trashed
+  elements have already left their subject areas' summaries, so deleting
+  them doesn't bump summary versions.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from competencies.models import TrashEntry, MODELS_BY_KEY
+from competencies.models import get_descendant_models, parse_tree_path
+from competencies.models import bump_summary_versions
+from competencies import utils
+
+PURGE_BATCH_SIZE = 1000
+
+
+def get_retention_days():
+    return getattr(settings, 'TRASH_RETENTION_DAYS', 30)
+
+def trash_element(element, user=None):
+    """Move element and its descendants to the trash.
+    Returns the new TrashEntry."""
+    model = element._meta.concrete_model
+    prefix = element.get_subtree_path()
+    with transaction.atomic():
+        entry = TrashEntry.objects.create(organization_id=element.organization_id,
+                                          element_type=element.path_key,
+                                          element_id=element.id,
+                                          text=getattr(element, element.text_field),
+                                          deleted_at=timezone.now(),
+                                          deleted_by=user)
+        bump_summary_versions([element.get_subject_area_id()])
+        marks = {'deleted_at': entry.deleted_at, 'trash_entry': entry}
+        num_elements = model.objects.filter(id=element.id).update(**marks)
+        for descendant_model in get_descendant_models(model):
+            num_elements += descendant_model.objects.filter(
+                tree_path__startswith=prefix).update(**marks)
+        entry.num_elements = num_elements
+        entry.save(update_fields=['num_elements'])
+    enqueue_purge()
+    return entry
+
+def is_parent_trashed(element):
+    """True if the element's parent is in the trash, so it can't be restored."""
+    parent_key, parent_id = parse_tree_path(element.tree_path)[-1]
+    if parent_key == 'o':
+        return False
+    return not MODELS_BY_KEY[parent_key].objects.filter(id=parent_id).exists()
+
+def is_parent_public(element):
+    if element.path_key == 'sa':
+        return element.organization.public
+    return element.is_parent_public()
+
+def restore_element(entry):
+    """Take entry's element, and what was deleted along with it, out of the trash.
+    If the element's parent is private, the restored elements are made private.
+    Returns False, and restores nothing, if the element's parent is in the trash."""
+    model = entry.get_model()
+    element = model.all_objects.get(id=entry.element_id)
+    if is_parent_trashed(element):
+        return False
+    prefix = element.get_subtree_path()
+    with transaction.atomic():
+        marks = {'deleted_at': None, 'trash_entry': None}
+        model.all_objects.filter(id=element.id).update(**marks)
+        for descendant_model in get_descendant_models(model):
+            descendant_model.all_objects.filter(tree_path__startswith=prefix,
+                                                trash_entry=entry).update(**marks)
+        entry.delete()
+        if element.public and not is_parent_public(element):
+            model.objects.filter(id=element.id).update(public=False)
+            utils.cascade_visibility_down(element, 'private')
+        bump_summary_versions([element.get_subject_area_id()])
+    return True
+
+def purge_entry(entry, batch_size=PURGE_BATCH_SIZE):
+    """Delete entry's element and everything below it from the db, a batch at a time.
+    Entries for elements below it are removed along with them.
+    Returns the number of elements deleted."""
+    model = entry.get_model()
+    element = model.all_objects.filter(id=entry.element_id).first()
+    num_deleted = 0
+    if element:
+        prefix = element.get_subtree_path()
+        for descendant_model in reversed(get_descendant_models(model)):
+            descendants = descendant_model.all_objects.filter(tree_path__startswith=prefix)
+            while True:
+                with transaction.atomic():
+                    ids = list(descendants.values_list('id', flat=True)[:batch_size])
+                    if not ids:
+                        break
+                    TrashEntry.objects.filter(element_type=descendant_model.path_key,
+                                              element_id__in=ids).delete()
+                    descendant_model.all_objects.filter(id__in=ids).delete()
+                num_deleted += len(ids)
+    with transaction.atomic():
+        if element:
+            model.all_objects.filter(id=element.id).delete()
+            num_deleted += 1
+        entry.delete()
+    return num_deleted
+
+def get_expired_entries():
+    cutoff = timezone.now() - timedelta(days=get_retention_days())
+    return TrashEntry.objects.filter(deleted_at__lt=cutoff).order_by('deleted_at')
+
+def enqueue_purge():
+    from competencies import jobs
+    return jobs.enqueue_purge_trash()
@@ -25,12 +25,57 @@ urlpatterns = patterns('',
     # --- PDF generating pages ---
     url(r'^sa_summary_pdf/(?P<sa_id>\d+)/$', views.sa_summary_pdf, name='sa_summary_pdf'),
 
+    # sa_summary_pdf/id/status/job_id: Progress of a background pdf, as json.
+    url(r'^sa_summary_pdf/(?P<sa_id>\d+)/status/(?P<job_id>\d+)/$', views.sa_summary_pdf_status,
+        name='sa_summary_pdf_status'),
+
+    # organization_summary_pdf/id: One pdf of every subject area in an organization.
+    url(r'^organization_summary_pdf/(?P<organization_id>\d+)/$', views.organization_summary_pdf,
+        name='organization_summary_pdf'),
+
+    # organization_summary_pdf/id/status/job_id: Progress of an organization pdf, as json.
+    url(r'^organization_summary_pdf/(?P<organization_id>\d+)/status/(?P<job_id>\d+)/$',
+        views.organization_summary_pdf_status, name='organization_summary_pdf_status'),
+
+
+    # --- Export pages ---
+
+    # organization_export/id: An organization's elements, as JSON Lines, CSV or CASE.
+    url(r'^organization_export/(?P<organization_id>\d+)/$', views.organization_export,
+        name='organization_export'),
+
+    # organization_import/id: Add elements to an organization from a JSON Lines, CSV or CASE file.
+    url(r'^organization_import/(?P<organization_id>\d+)/$', views.organization_import,
+        name='organization_import'),
+
+
+    # --- Read-only json api ---
+
+    # api/organizations: Public organizations, and those the user edits.
+    url(r'^api/organizations/$', views.api_organizations, name='api_organizations'),
+
+    # api/organizations/id: One organization.
+    url(r'^api/organizations/(?P<organization_id>\d+)/$', views.api_organization,
+        name='api_organization'),
+
+    # api/organizations/id/subject_areas: An organization's visible subject areas.
+    url(r'^api/organizations/(?P<organization_id>\d+)/subject_areas/$',
+        views.api_subject_areas, name='api_subject_areas'),
+
+    # api/subject_areas/id: A subject area's visible elements, as a tree.
+    url(r'^api/subject_areas/(?P<sa_id>\d+)/$', views.api_subject_area,
+        name='api_subject_area'),
+
 
     # --- Edit system pages ---
 
     # edit_sa_summary/id: Edit a summary for a given subject area.
     url(r'^edit_sa_summary/(?P<sa_id>\d+)/$', views.edit_sa_summary, name='edit_sa_summary'),                       
 
+    # element_form/element_type/id: Load or save one element's form, as json.
+    url(r'^element_form/(?P<element_type>\w+)/(?P<element_id>\d+)/$', views.element_form,
+        name='element_form'),
+
     # edit_sa_summary_order/id: Modify the order of elements within a subject area.
     url(r'^edit_sa_summary_order/(?P<sa_id>\d+)/$', views.edit_sa_summary_order,
         name='edit_sa_summary_order'),                       
@@ -39,10 +84,18 @@ urlpatterns = patterns('',
     url(r'^move_element/(?P<element_type>\w+)/(?P<element_id>\d+)/(?P<direction>\w+)/(?P<sa_id>\d+)/$',
         views.move_element, name='move_element'),
 
+    # reorder_elements/parent_type/parent_id/element_type: Reorder a group of siblings.
+    url(r'^reorder_elements/(?P<parent_type>\w+)/(?P<parent_id>\d+)/(?P<element_type>\w+)/$',
+        views.reorder_elements, name='reorder_elements'),
+
     # delete_element/element_type/element_id/
     url(r'^delete_element/(?P<element_type>\w+)/(?P<element_id>\d+)/',
         views.delete_element, name='delete_element'),
 
+    # organization_trash/id: Deleted elements of an organization, which can be restored.
+    url(r'^organization_trash/(?P<organization_id>\d+)/$', views.organization_trash,
+        name='organization_trash'),
+
     # organization_admin_summary/id: Summarize an organization.
     url(r'^organization_admin_summary/(?P<organization_id>\d+)/$', views.organization_admin_summary, name='organization_admin_summary'),
 
@@ -52,6 +105,9 @@ urlpatterns = patterns('',
     # fork/id: Fork an existing school into the current school.
     url(r'^fork/(?P<organization_id>\d+)/$', views.fork, name='fork'),
 
+    # fork/id/status: Progress of a background fork, as json.
+    url(r'^fork/(?P<organization_id>\d+)/status/$', views.fork_status, name='fork_status'),
+
     # --- New element pages ---
 
     # new_organization: Create a new organization.
@@ -1,112 +1,374 @@
 """Helper functions for views.py."""
-from competencies.models import Organization
+from collections import OrderedDict
 
+from django.db import transaction
+from django.db.models import Prefetch, Case, When, Value, F, Q, IntegerField
+
+from competencies.models import Organization, SubjectArea, SubdisciplineArea
+from competencies.models import CompetencyArea, EssentialUnderstanding, LearningTarget
+from competencies.models import TREE_MODELS, MODELS_BY_KEY, get_descendant_models, parse_tree_path
+from competencies.models import build_tree_path, bump_summary_versions
+from competencies.models import ORDER_GAP, get_next_order
+from competencies import ordering
+
+
+class SubjectAreaTree():
+    """All visible elements of a subject area, grouped the way they are displayed.
+
+    sdas, cas, eus and lts are flat lists, in display order.
+    general_cas are the cas that don't belong to an sda.
+    Each sda has a list of its cas in sda.cas, each ca has a list of its eus
+      in ca.eus, and each eu has a list of its lts in eu.lts.
+    """
+    def __init__(self, subject_area, sdas, cas):
+        self.subject_area = subject_area
+        self.sdas = sdas
+        self.cas = cas
+        self.eus = [eu for ca in cas for eu in ca.eus]
+        self.lts = [lt for eu in self.eus for lt in eu.lts]
+
+        # Group cas under their sdas, using ids so no sda is loaded lazily.
+        self.general_cas = []
+        sdas_by_id = {}
+        for sda in sdas:
+            sda.cas = []
+            sdas_by_id[sda.id] = sda
+        for ca in cas:
+            if ca.subdiscipline_area_id is None:
+                self.general_cas.append(ca)
+            elif ca.subdiscipline_area_id in sdas_by_id:
+                sda = sdas_by_id[ca.subdiscipline_area_id]
+                sda.cas.append(ca)
+                # Set cached parent, so ca.subdiscipline_area doesn't hit the db.
+                ca.subdiscipline_area = sda
+
+# A user's role in an organization, as tagged by annotate_user_role().
+ROLE_NONE, ROLE_EDITOR, ROLE_OWNER = 0, 1, 2
+
+def get_editor_org_ids(user):
+    """Subquery of the ids of the organizations user edits."""
+    return Organization.editors.through.objects.filter(user=user).values('organization_id')
+
+def annotate_user_role(organizations, user):
+    """Tag each organization with user_role, in the same query.
+    Editing is checked with a subquery instead of a join, so each organization
+      stays one row, and the queryset can be paged."""
+    if not user.is_authenticated():
+        user_role = Value(ROLE_NONE, output_field=IntegerField())
+    else:
+        user_role = Case(When(owner=user, then=Value(ROLE_OWNER)),
+                         When(id__in=get_editor_org_ids(user), then=Value(ROLE_EDITOR)),
+                         default=Value(ROLE_NONE), output_field=IntegerField())
+    return organizations.annotate(user_role=user_role)
+
+def get_user_organizations(user):
+    """Get the organizations user owns or edits, by name, tagged with user_role."""
+    organizations = Organization.objects.filter(Q(owner=user) |
+                                                Q(id__in=get_editor_org_ids(user)))
+    return annotate_user_role(organizations, user).order_by('name', 'id')
+
+def get_public_organizations(user, prefix=''):
+    """Get the public organizations whose names start with prefix, by name,
+    tagged with user_role."""
+    organizations = Organization.objects.filter(public=True, name__istartswith=prefix)
+    return annotate_user_role(organizations, user).order_by('name', 'id')
+
+def get_subject_area_tree(subject_area, kwargs):
+    """Get all sdas, cas, eus, and lts of a subject area, as a SubjectAreaTree.
+    kwargs is the visibility filter, applied at every level.
+    Uses the same number of queries, no matter how big the subject area is.
+    """
+    eu_queryset = EssentialUnderstanding.objects.filter(**kwargs)
+    lt_queryset = LearningTarget.objects.filter(**kwargs)
+    sdas = list(subject_area.subdisciplinearea_set.filter(**kwargs))
+    cas = list(subject_area.competencyarea_set.filter(**kwargs).prefetch_related(
+        Prefetch('essentialunderstanding_set', queryset=eu_queryset, to_attr='eus'),
+        Prefetch('eus__learningtarget_set', queryset=lt_queryset, to_attr='lts')))
+    for ca in cas:
+        ca.subject_area = subject_area
+    return SubjectAreaTree(subject_area, sdas, cas)
+
+
+def get_descendant_querysets(element):
+    """Get a queryset of element's descendants for each level below element,
+    from the top level down, as a list of (model, queryset) pairs.
+    Each queryset is a single indexed query on tree_path."""
+    prefix = element.get_subtree_path()
+    return [(model, model.objects.filter(tree_path__startswith=prefix))
+            for model in get_descendant_models(element._meta.concrete_model)]
+
+def count_descendants(element):
+    """Count element's descendants at each level below it.
+    Returns an OrderedDict keyed by model name."""
+    return OrderedDict((model.__name__, descendants.count())
+                       for model, descendants in get_descendant_querysets(element))
+
+def get_ancestors(element):
+    """Get element's ancestors, from its subject area down to its parent.
+    Ancestor ids come from element's tree_path, so each level is one query by id."""
+    return [MODELS_BY_KEY[key].objects.get(id=id)
+            for key, id in parse_tree_path(element.tree_path) if key in MODELS_BY_KEY]
+
+def update_changed_elements(changed):
+    """Write the edited fields of a set of elements, with one UPDATE per type.
+    changed is a list of (element, names of changed fields). Each field is set
+      with a CASE on id, so an element that didn't change a field keeps its
+      value. Nothing is saved through save(), so summary versions are bumped here.
+    Returns the number of elements updated.
+    """
+    fields_by_model = OrderedDict((model, {}) for model in TREE_MODELS)
+    for element, fields in changed:
+        for field in fields:
+            fields_by_model[type(element)].setdefault(field, []).append(element)
+
+    num_updated, sa_ids = 0, set()
+    with transaction.atomic():
+        for model, elements_by_field in fields_by_model.items():
+            if not elements_by_field:
+                continue
+            updates, ids = {}, set()
+            for field, elements in elements_by_field.items():
+                output_field = model._meta.get_field(field)
+                updates[field] = Case(*[When(id=element.id, then=Value(getattr(element, field)))
+                                        for element in elements],
+                                      default=F(field), output_field=output_field)
+                ids.update(element.id for element in elements)
+                sa_ids.update(element.get_subject_area_id() for element in elements)
+            num_updated += model.objects.filter(id__in=ids).update(**updates)
+        if sa_ids:
+            bump_summary_versions(sa_ids)
+    return num_updated
+
+def save_edited_elements(changed):
+    """Write edited elements, and cascade any privacy changes, in one transaction.
+    changed is a list of (element, names of changed fields), as for
+      update_changed_elements().
+    """
+    privacy_changed = [element for element, fields in changed if 'public' in fields]
+    with transaction.atomic():
+        update_changed_elements(changed)
+
+        # Cascade privacy settings appropriately.
+        #   Change to private takes precedence, so process changes to public first.
+        changed_to_public = [element for element in privacy_changed if element.public]
+        changed_to_private = [element for element in privacy_changed if not element.public]
+
+        # Cascading public happens upwards. Setting an element public makes all its
+        #   ancestors public.
+        if changed_to_public:
+            cascade_public_up_batch(changed_to_public)
+
+        # Cascading private happens downwards. Setting an element private hides all
+        #   its descendants.
+        for element in changed_to_private:
+            cascade_visibility_down(element, 'private')
+
+def reorder_siblings(siblings, new_ids):
+    """Put a whole group of sibling elements in the order of new_ids.
+    siblings is a queryset of every element in the group. Only elements that
+      are out of place get new positions, written with one UPDATE. See
+      competencies.ordering.
+    Raises ValueError if new_ids aren't exactly the ids in the group.
+    Returns the number of elements that moved.
+    """
+    model = siblings.model
+    with transaction.atomic():
+        current = list(siblings.select_for_update().values_list('id', 'tree_path'))
+        if len(set(new_ids)) != len(new_ids) or set(new_ids) != set(row[0] for row in current):
+            raise ValueError('order must list each element of the group exactly once')
+
+        num_moved = ordering.apply_order(siblings, new_ids)
+        if num_moved:
+            sa_ids = set(dict(parse_tree_path(tree_path)).get('sa') for id, tree_path in current)
+            sa_ids.discard(None)
+            if model is SubjectArea:
+                sa_ids.update(new_ids)
+            bump_summary_versions(sa_ids)
+    return num_moved
 
 def cascade_visibility_down(element, visibility_mode):
-    """Sets visibility for all descendents of an element. (cascades down)."""
+    """Sets visibility for all descendents of an element. (cascades down).
+    Issues one UPDATE per level below element, all in one transaction.
+    Returns an OrderedDict of the number of elements changed at each level,
+      keyed by model name.
+    """
     # Does nothing to given element.
-    
-    # Find all related objects, and set them all to the appropriate visibility mode.
-    links = [rel.get_accessor_name() for rel in element._meta.get_all_related_objects()]
-    for link in links:
-        objects = getattr(element, link).all()
-        for object in objects:
-            try:
-                if visibility_mode == 'private':
-                    if object.public:
-                        object.public = False
-                        object.save()
-                elif visibility_mode == 'public':
-                    if not object.public:
-                        object.public = True
-                        object.save()
-            except Exception as e:
-                # Must not be a public/ private object
-                #print("Can't set object private:", object, e)
-                pass
-            
-            # Check if this object has related objects, if so continue cascading.
-            if object._meta.get_all_related_objects():
-                cascade_visibility_down(object, visibility_mode)
+    public = (visibility_mode == 'public')
+    changed = OrderedDict()
+    with transaction.atomic():
+        for model, descendants in get_descendant_querysets(element):
+            changed[model.__name__] = descendants.filter(public=not public).update(public=public)
+        if any(changed.values()):
+            if isinstance(element, Organization):
+                bump_summary_versions(element.subjectarea_set.values_list('id', flat=True))
+            else:
+                bump_summary_versions([element.get_subject_area_id()])
+    return changed
 
 def cascade_public_up(element):
     """Sets visibility to public for all ancestors of an element. (cascades up)."""
-    # Does nothing to given element.
+    return cascade_public_up_batch([element])
+
+def cascade_public_up_batch(elements):
+    """Sets visibility to public for all ancestors of a list of elements.
+    Issues one UPDATE per level above the elements, all in one transaction,
+      so ancestors shared by several elements are only published once.
+    Returns an OrderedDict of the number of ancestors changed at each level,
+      keyed by model name.
+    """
+    # Does nothing to given elements.
     # Does not affect organization; that is managed separately.
     #   This allows an organization to be set up, and then made visible all at once.
     # Only sets elements public, because I can't see any reason to cascade private upwards.
+    # Ancestor ids come from each element's tree_path, so nothing is fetched.
+    ancestor_ids = {}
+    for element in elements:
+        for key, id in parse_tree_path(element.tree_path):
+            ancestor_ids.setdefault(key, set()).add(id)
 
-    element = element.get_parent()
-    while element.__class__ != Organization:
-        if not element.public:
-            element.public = True
-            element.save()
-        # Get next parent element.
-        element = element.get_parent()
+    changed = OrderedDict()
+    with transaction.atomic():
+        for model in TREE_MODELS:
+            if model.path_key in ancestor_ids:
+                ancestors = model.objects.filter(id__in=ancestor_ids[model.path_key], public=False)
+                changed[model.__name__] = ancestors.update(public=True)
+        if any(changed.values()):
+            bump_summary_versions(ancestor_ids['sa'])
+    return changed
 
 def fork_organization(forking_org, original_org):
-    """Copy all elements of original_org to forking_org."""
-    # Make sure forking_org is empty, and original_org is public.
+    """Copy all public elements of original_org to forking_org.
+    Everything happens in one transaction, so a failed fork leaves forking_org
+      empty. Large forks should run in the background; see jobs.run_fork().
+    Returns forking_org, or None if the fork is not allowed.
+    """
     # Make sure original_org is public, and forking_org is empty.
-    #print("Forking", original_org.name, "to", forking_org.name, "...")
     if not original_org.public:
-        #print("Can't fork - original org is private.")
-        return None
-    if forking_org.subjectarea_set.all():
-        #print("Can't fork - forking org is not empty.")
         return None
     if original_org == forking_org:
-        #print("Can't fork - original org is forking org.")
         return None
 
-    # Copy all elements from original to forking org.
-    #   There's definitely a more efficient way to do this, but quick and dirty for now.
-    #   (Follow relations automatically.)
+    with transaction.atomic():
+        # Lock forking_org, so two forks can't fill it at the same time.
+        Organization.objects.select_for_update().get(pk=forking_org.pk)
+        if forking_org.subjectarea_set.exists():
+            return None
+        sas = original_org.subjectarea_set.filter(public=True)
+        fork_subject_areas(forking_org, original_org, sas)
+
+    return forking_org
+
+def fork_subject_areas(forking_org, original_org, sas):
+    """Copy some of original_org's sas, and their public descendants, to the
+      end of forking_org. Each level is read with one query, and copied with
+      one bulk insert. Call inside a transaction, with forking_org locked.
+    Returns an {old sa id: new sa id} dict, and the number of elements copied.
+    """
     # Set each element's privacy setting to match forking_org's privacy.
     #   This makes public elements public only if forking_org is public.
-    from copy import deepcopy
-    for sa in original_org.subjectarea_set.filter(public=True):
-        original_sa = deepcopy(sa)
-        sa.pk = None
-        sa.organization = forking_org
-        sa.public = forking_org.public
-        sa.save()
-
-        # Copy this sa's sdas.
-        for sda in original_sa.subdisciplinearea_set.filter(public=True):
-            original_sda = deepcopy(sda)
-            sda.pk = None
-            sda.subject_area = sa
-            sda.public = forking_org.public
-            sda.save()
-
-            # Copy this sda's cas.
-            for ca in original_sda.competencyarea_set.filter(public=True):
-                original_ca = deepcopy(ca)
-                ca.pk = None
-                ca.subject_area = sa
-                ca.subdiscipline_area = sda
-                ca.public = forking_org.public
-                ca.save()
-
-                # Copy this ca's eus.
-                for eu in original_ca.essentialunderstanding_set.filter(public=True):
-                    eu.pk = None
-                    eu.competency_area = ca
-                    eu.public = forking_org.public
-                    eu.save()
-
-        # Copy this sa's cas.
-        for ca in original_sa.competencyarea_set.filter(public=True, subdiscipline_area=None):
-            original_ca = deepcopy(ca)
-            ca.pk = None
-            ca.subject_area = sa
-            ca.public = forking_org.public
-            ca.save()
-            
-            # Copy this ca's eus.
-            for eu in original_ca.essentialunderstanding_set.filter(public=True):
-                eu.pk = None
-                eu.competency_area = ca
-                eu.public = forking_org.public
-                eu.save()
+    public = forking_org.public
+    sa_ids = [sa.id for sa in sas]
+    # {old id: new id} maps for each level copied so far, keyed by path_key.
+    path_maps = {'o': {original_org.id: forking_org.id}}
+
+    sa_map = bulk_copy_elements(SubjectArea.objects.filter(id__in=sa_ids, public=True),
+                                {'organization': path_maps['o']}, path_maps,
+                                public, {'organization': forking_org},
+                                first_order=get_next_order(SubjectArea, forking_org.id))
+    path_maps['sa'] = sa_map
+    new_sa_ids = list(sa_map.values())
+
+    sdas = SubdisciplineArea.objects.filter(subject_area__in=sa_ids, public=True)
+    path_maps['sda'] = bulk_copy_elements(sdas, {'subject_area': sa_map}, path_maps,
+                                          public, {'subject_area__in': new_sa_ids})
+
+    cas = CompetencyArea.objects.filter(subject_area__in=sa_ids, public=True)
+    path_maps['ca'] = bulk_copy_elements(cas, {'subject_area': sa_map,
+                                               'subdiscipline_area': path_maps['sda']},
+                                         path_maps, public, {'subject_area__in': new_sa_ids})
+
+    eus = EssentialUnderstanding.objects.filter(competency_area__subject_area__in=sa_ids,
+                                                public=True)
+    path_maps['eu'] = bulk_copy_elements(eus, {'competency_area': path_maps['ca']}, path_maps,
+                                         public, {'competency_area__subject_area__in': new_sa_ids})
+
+    lts = LearningTarget.objects.filter(
+        essential_understanding__competency_area__subject_area__in=sa_ids, public=True)
+    path_maps['lt'] = bulk_copy_elements(lts, {'essential_understanding': path_maps['eu']},
+                                         path_maps, public,
+                                         {'essential_understanding__competency_area__subject_area__in': new_sa_ids})
+
+    return sa_map, sum(len(id_map) for key, id_map in path_maps.items() if key != 'o')
+
+def count_public_elements(organization):
+    """Count the public elements of an organization, at every level.
+    Elements with a private ancestor are counted too, so this is an upper
+      bound on what a fork of the organization copies."""
+    prefix = organization.get_subtree_path()
+    return sum(model.objects.filter(tree_path__startswith=prefix, public=True).count()
+               for model in TREE_MODELS)
+
+def bulk_copy_elements(elements, parent_maps, path_maps, public, groups_filter, first_order=0):
+    """Copy a set of elements of one type with a single bulk insert.
+
+    parent_maps maps each fk field to remap onto an {old id: new id} dict.
+      Elements whose parent was not copied are skipped. A null fk is left null.
+    path_maps holds an {old id: new id} dict for each level above, keyed by
+      path_key, and is used to build the copies' tree_paths.
+    groups_filter and first_order are passed on to bulk_create_in_order().
+    Returns an {old id: new id} dict for the copied elements.
+    """
+    model = elements.model
+    group_field = model._meta.order_with_respect_to.name
+
+    original_ids, copies = [], []
+    for element in elements.order_by(group_field + '__id', '_order', 'id'):
+        skip = False
+        for field, id_map in parent_maps.items():
+            old_parent_id = getattr(element, field + '_id')
+            if old_parent_id is None:
+                continue
+            if old_parent_id not in id_map:
+                skip = True
+                break
+            setattr(element, field + '_id', id_map[old_parent_id])
+        if skip:
+            continue
+
+        original_ids.append(element.id)
+        element.pk = None
+        element.public = public
+        path = [(key, path_maps[key][id]) for key, id in parse_tree_path(element.tree_path)]
+        element.tree_path = build_tree_path(path)
+        element.organization_id = path[0][1]
+        copies.append(element)
+
+    bulk_create_in_order(model, copies, groups_filter, first_order)
+    return {original_id: copy.id for original_id, copy in zip(original_ids, copies)}
+
+def bulk_create_in_order(model, elements, groups_filter, first_order=0):
+    """Create elements of one type with a single bulk insert, and set their ids.
+    Elements keep their list order within each group, starting at first_order;
+      use get_next_order() when adding to a group that already has children.
+
+    bulk_create doesn't return ids, so elements are given _order values
+      ORDER_GAP apart within their group, and matched back to the new rows by
+      (group, _order). groups_filter selects the elements' groups. Nothing else
+      may be added to those groups until the transaction ends, so lock them,
+      or create them in the same transaction.
+    """
+    group_attname = model._meta.order_with_respect_to.attname
+    next_order = {}
+    for element in elements:
+        group_id = getattr(element, group_attname)
+        element._order = next_order.get(group_id, first_order)
+        next_order[group_id] = element._order + ORDER_GAP
+
+    model.objects.bulk_create(elements)
+
+    new_ids = {(group_id, order): new_id for new_id, group_id, order in
+               model.objects.filter(_order__gte=first_order, **groups_filter).values_list(
+                   'id', group_attname, '_order')}
+    for element in elements:
+        element.id = new_ids[(getattr(element, group_attname), element._order)]
+    return elements
@@ -1,9 +1,15 @@
-from django.shortcuts import render_to_response, redirect
+from django.shortcuts import render_to_response, redirect, get_object_or_404
 from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.forms.models import modelform_factory, modelformset_factory, inlineformset_factory
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.http import HttpResponseBadRequest, Http404
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import transaction
+from django.db.models import Q
 from django.db.models.loading import get_model
 from django.contrib.auth import logout, login, authenticate
 from django.contrib.auth.decorators import login_required
@@ -12,9 +18,21 @@ from copy import copy
 from collections import OrderedDict
 
 from competencies.models import *
-from competencies.forms import ForkForm
+from competencies.forms import ForkForm, ImportForm
 from competencies import my_admin
-from . import utils
+from . import utils, jobs, pdf_cache, organization_pdf, export, importer, api, ordering, trash
+from .fragment_cache import summary_cache, get_summary_key
+
+
+# The model and form for each type of element that can be edited inline, by path_key.
+ELEMENT_FORMS = {'sa': (SubjectArea, SubjectAreaForm),
+                 'sda': (SubdisciplineArea, SubdisciplineAreaForm),
+                 'ca': (CompetencyArea, CompetencyAreaForm),
+                 'eu': (EssentialUnderstanding, EssentialUnderstandingForm),
+                 }
+
+# Organizations per page of the organizations listing.
+ORGANIZATIONS_PAGE_SIZE = 50
 
 
 def index(request):
@@ -32,24 +50,40 @@ def no_edit_permission(request, school_id):
 
 # --- Simple views, for exploring system without changing it: ---
 def organizations(request):
+    """Lists the organizations the user owns and can edit, then the public
+    organizations, a page at a time. ?prefix= narrows the public organizations
+    to those whose names start with it."""
     my_organizations, editor_organizations = [], []
     if request.user.is_authenticated():
-        my_organizations = Organization.objects.filter(owner=request.user)
-        editor_organizations = request.user.organization_set.all()
-    # Remove owned orgs from editor_organizations
-    editor_organizations = [org for org in editor_organizations if org not in my_organizations]
-    public_organizations = Organization.objects.filter(public=True)
+        # One query, split up by the role each org was tagged with.
+        for org in utils.get_user_organizations(request.user):
+            if org.user_role == utils.ROLE_OWNER:
+                my_organizations.append(org)
+            else:
+                editor_organizations.append(org)
+
+    prefix = request.GET.get('prefix', '').strip()
+    paginator = Paginator(utils.get_public_organizations(request.user, prefix),
+                          ORGANIZATIONS_PAGE_SIZE)
+    try:
+        page = paginator.page(request.GET.get('page', 1))
+    except PageNotAnInteger:
+        page = paginator.page(1)
+    except EmptyPage:
+        page = paginator.page(paginator.num_pages)
+
     return render_to_response('competencies/organizations.html',
                               {'my_organizations': my_organizations,
                                'editor_organizations': editor_organizations,
-                               'public_organizations': public_organizations,
+                               'public_organizations': page.object_list,
+                               'page': page,
+                               'prefix': prefix,
                                },
                               context_instance=RequestContext(request))
 
 def organization(request, organization_id):
     """Displays subject areas and subdiscipline areas for a given organization."""
     organization = Organization.objects.get(id=organization_id)
-    editors = organization.editors.all()
     if organization.subjectarea_set.all():
         can_fork = False
     else:
@@ -60,7 +94,7 @@ def organization(request, organization_id):
     return render_to_response('competencies/organization.html',
                               {'organization': organization, 'subject_areas': sas,
                                'sdas': sdas, 'can_fork': can_fork,
-                               'editors': editors,
+                               'is_editor': is_editor(request.user, organization),
                                },
                               context_instance=RequestContext(request))
 
@@ -70,32 +104,142 @@ def sa_summary(request, sa_id):
     organization = sa.organization
     kwargs = get_visibility_filter(request.user, organization)
 
-    sdas, cas, eus = get_sda_ca_eu_elements(sa, kwargs)
+    # The tree is only rebuilt when sa's summary_version has changed.
+    cache_key = get_summary_key(sa, editor=not kwargs)
+    tree_html = summary_cache.get(cache_key)
+    if tree_html is None:
+        tree = utils.get_subject_area_tree(sa, kwargs)
+        tree_html = render_to_string('competencies/sa_summary_tree.html', {'tree': tree})
+        summary_cache.set(cache_key, tree_html)
     
     return render_to_response('competencies/sa_summary.html',
                               {'subject_area': sa, 'organization': organization,
-                               'sdas': sdas, 'cas': cas, 'eus': eus,},
+                               'tree_html': mark_safe(tree_html),},
                               context_instance=RequestContext(request))
 
 def sa_summary_pdf(request, sa_id):
-    """Return a pdf of the sa_summary page."""
+    """Return a pdf of the sa_summary page.
+    Pdfs are cached on disk by content, and clients that already have the
+      current pdf get a 304.
+    With ?render=background, a pdf that isn't cached yet is built by a
+      background job, and a page is shown that downloads it when it's ready.
+    With ?engine=canvas, the pdf is drawn by the faster canvas engine.
+    """
     #print('Generating pdf of sa_summary...')
 
     sa = SubjectArea.objects.get(id=sa_id)
     org = sa.organization
     kwargs = get_visibility_filter(request.user, org)
 
-    sdas, cas, eus = get_sda_ca_eu_elements(sa, kwargs)
+    engine = pdf_cache.clean_summary_engine(request.GET.get('engine'))
+    tree = utils.get_subject_area_tree(sa, kwargs)
+    digest = pdf_cache.get_summary_digest(org, sa, tree, editor=not kwargs, engine=engine)
+
+    path = pdf_cache.get_cached_pdf(digest)
+    if path is None:
+        if request.GET.get('render') == 'background':
+            pdf_job = jobs.enqueue_summary_pdf(sa, not kwargs, digest, engine)
+            return render_to_response('competencies/sa_summary_pdf.html',
+                                      {'subject_area': sa, 'organization': org,
+                                       'pdf_job': pdf_job,},
+                                      context_instance=RequestContext(request))
+        path = pdf_cache.store_pdf(digest, pdf_cache.summary_pdf_builder(org, sa, tree, engine))
 
-    response = HttpResponse(content_type='application/pdf')
     filename = 'sa_summary_%s.pdf' % sa.subject_area
+    return pdf_cache.serve_pdf(request, digest, path, filename)
+
+def sa_summary_pdf_status(request, sa_id, job_id):
+    """Report progress of a background pdf as json, for the pdf page to poll."""
+    pdf_job = BackgroundJob.objects.get(id=job_id, job_type='sa_summary_pdf')
+    download_url = reverse('competencies:sa_summary_pdf', args=[sa_id])
+    engine = pdf_job.get_params().get('engine', pdf_cache.DEFAULT_SUMMARY_ENGINE)
+    if engine != pdf_cache.DEFAULT_SUMMARY_ENGINE:
+        download_url += '?engine=%s' % engine
+    return JsonResponse({'status': pdf_job.status,
+                         'download_url': download_url,
+                         })
+
+def organization_summary_pdf(request, organization_id):
+    """Return a pdf of every subject area in an organization, with a table of contents.
+    Pdfs are cached on disk by content. One that isn't cached yet is built by
+      a background job, and a page is shown that downloads it when it's ready.
+    """
+    organization = Organization.objects.get(id=organization_id)
+    kwargs = get_visibility_filter(request.user, organization)
+
+    trees = organization_pdf.get_organization_trees(organization, kwargs)
+    digest = pdf_cache.get_organization_digest(organization, trees, editor=not kwargs)
+
+    path = pdf_cache.get_cached_pdf(digest)
+    if path is None:
+        pdf_job = jobs.enqueue_organization_pdf(organization, not kwargs, digest, len(trees))
+        return render_to_response('competencies/organization_summary_pdf.html',
+                                  {'organization': organization, 'pdf_job': pdf_job,},
+                                  context_instance=RequestContext(request))
+
+    filename = 'summary_%s.pdf' % organization.name
+    return pdf_cache.serve_pdf(request, digest, path, filename)
+
+def organization_summary_pdf_status(request, organization_id, job_id):
+    """Report progress of a background organization pdf as json, for the pdf page to poll."""
+    pdf_job = BackgroundJob.objects.get(id=job_id, job_type='organization_pdf')
+    return JsonResponse({'status': pdf_job.status,
+                         'progress': pdf_job.progress,
+                         'total': pdf_job.total,
+                         'download_url': reverse('competencies:organization_summary_pdf',
+                                                 args=[organization_id]),
+                         })
+
+def organization_export(request, organization_id):
+    """Stream every element of an organization the user can see, as JSON Lines,
+    or as CSV or a CASE package with ?format=csv or ?format=case."""
+    organization = get_object_or_404(Organization, id=organization_id)
+    if not organization.public and not is_editor(request.user, organization):
+        raise Http404
+    kwargs = get_visibility_filter(request.user, organization)
+
+    export_format = request.GET.get('format')
+    if export_format not in export.EXPORT_FORMATS:
+        export_format = 'jsonl'
+    content_type, extension = export.EXPORT_FILE_TYPES[export_format]
+
+    response = StreamingHttpResponse(export.iterate_export(organization, export_format, kwargs),
+                                     content_type=content_type)
+    filename = 'organization_%d.%s' % (organization.id, extension)
     response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response
 
-    from competencies.sa_summary_pdf import PDFTest
-    pdf_test = PDFTest(response)
-    pdf = pdf_test.makeSummary(org, sa, sdas, cas, eus)
+@login_required
+def organization_import(request, organization_id):
+    """Add elements to an organization from an uploaded JSON Lines, CSV or CASE file.
+    The whole file is checked first; nothing is imported if any line has an error."""
+    organization = Organization.objects.get(id=organization_id)
+    if not has_edit_permission(request.user, organization):
+        return redirect(reverse('competencies:no_edit_permission', args=[organization_id,]))
 
-    return pdf
+    errors, counts, dry_run = [], None, True
+    if request.method != 'POST':
+        import_form = ImportForm()
+    else:
+        import_form = ImportForm(request.POST, request.FILES)
+        if import_form.is_valid():
+            rows, errors = importer.parse_import(import_form.cleaned_data['import_file'],
+                                                 import_form.cleaned_data['import_format'])
+            dry_run = import_form.cleaned_data['dry_run']
+            if not errors:
+                if dry_run:
+                    counts = importer.count_rows(rows)
+                else:
+                    counts = importer.import_elements(organization, rows)
+
+    return render_to_response('competencies/organization_import.html',
+                              {'organization': organization,
+                               'import_form': import_form,
+                               'errors': errors,
+                               'counts': counts,
+                               'dry_run': dry_run,
+                               },
+                              context_instance=RequestContext(request))
 
 @login_required
 def organization_admin_summary(request, organization_id):
@@ -113,6 +257,71 @@ def organization_admin_summary(request, organization_id):
                               context_instance=RequestContext(request))
 
 
+# --- Read-only json api ---
+def api_organizations(request):
+    """List the public organizations, and those the user edits, a page at a time."""
+    organizations = Organization.objects.filter(public=True)
+    if request.user.is_authenticated():
+        organizations = Organization.objects.filter(
+            Q(public=True) | Q(editors=request.user)).distinct()
+    try:
+        page, data = api.get_page(request, organizations.order_by('name', 'id'))
+    except api.ApiError as e:
+        return api.error_response(str(e))
+    data['results'] = [api.serialize_organization(org) for org in page]
+    return api.json_response(request, data)
+
+def get_api_organization(user, organization_id):
+    """Return the organization, if it's public or user edits it, or None."""
+    organization = Organization.objects.filter(id=organization_id).first()
+    if organization and (organization.public or is_editor(user, organization)):
+        return organization
+    return None
+
+def api_organization(request, organization_id):
+    organization = get_api_organization(request.user, organization_id)
+    if not organization:
+        return api.error_response('no such organization', status=404)
+    return api.json_response(request, api.serialize_organization(organization))
+
+def api_subject_areas(request, organization_id):
+    """List an organization's visible subject areas, a page at a time."""
+    organization = get_api_organization(request.user, organization_id)
+    if not organization:
+        return api.error_response('no such organization', status=404)
+    kwargs = get_visibility_filter(request.user, organization)
+    try:
+        fields = api.parse_fields(request.GET.get('fields'), api.ELEMENT_FIELDS)
+        page, data = api.get_page(request, organization.subjectarea_set.filter(**kwargs))
+    except api.ApiError as e:
+        return api.error_response(str(e))
+    data['results'] = [api.serialize_element(sa, fields) for sa in page]
+    return api.json_response(request, data)
+
+def api_subject_area(request, sa_id):
+    """A subject area's visible elements, nested as a tree.
+    ?depth= cuts the tree off, and ?fields= picks each element's fields."""
+    try:
+        sa = SubjectArea.objects.get(id=sa_id)
+    except SubjectArea.DoesNotExist:
+        return api.error_response('no such subject area', status=404)
+    kwargs = get_visibility_filter(request.user, sa.organization)
+    if kwargs and not (sa.public and sa.organization.public):
+        return api.error_response('no such subject area', status=404)
+    try:
+        fields = api.parse_fields(request.GET.get('fields'), api.ELEMENT_FIELDS)
+        depth = api.parse_depth(request.GET.get('depth'))
+    except api.ApiError as e:
+        return api.error_response(str(e))
+
+    # Only load the tree if the client doesn't already have it.
+    etag = api.get_tree_etag(sa, not kwargs, fields, depth)
+    if api.is_not_modified(request, etag):
+        return api.not_modified(etag)
+    tree = utils.get_subject_area_tree(sa, kwargs)
+    return api.json_response(request, api.serialize_tree(tree, fields, depth), etag=etag)
+
+
 # --- Views for editing content. ---
 @login_required
 def organization_admin_edit(request, organization_id):
@@ -137,7 +346,7 @@ def organization_admin_edit(request, organization_id):
 
         # Make sure no organization owner was not removed from editors.
         # DEV: Should prevent this from happening at all, by overriding form.save()?
-        if organization.owner not in organization.editors.all():
+        if not organization.editors.filter(id=organization.owner_id).exists():
             organization.editors.add(organization.owner)
 
         # Redirect to summary page after processing form.
@@ -150,15 +359,22 @@ def organization_admin_edit(request, organization_id):
                                   
 @login_required
 def fork(request, organization_id):
-    """Fork an existing school."""
+    """Fork an existing school.
+    The fork runs in the background; this page shows its progress until it's done."""
     forking_organization = Organization.objects.get(id=organization_id)
-    if request.method != 'POST':
+    if not has_edit_permission(request.user, forking_organization):
+        return redirect(reverse('competencies:no_edit_permission', args=[organization_id,]))
+
+    fork_job = jobs.get_active_job(jobs.fork_job_key(forking_organization))
+    if request.method != 'POST' or fork_job:
         fork_form = ForkForm()
     else:
         fork_form = ForkForm(request.POST)
         if fork_form.is_valid():
-            original_org = Organization.objects.get(pk=request.POST['organization'])
-            utils.fork_organization(forking_organization, original_org)
+            original_org = fork_form.cleaned_data['organization']
+            fork_job = jobs.enqueue_fork(forking_organization, original_org)
+            if fork_job:
+                return redirect(reverse('competencies:fork', args=[organization_id,]))
             return redirect(reverse('competencies:organization', args=[organization_id,]))
         else:
             #print('\n\ninvalid:', fork_form)
@@ -169,9 +385,27 @@ def fork(request, organization_id):
                               {'forking_organization': forking_organization,
                                'organizations': organizations,
                                'fork_form': fork_form,
+                               'fork_job': fork_job,
                                },
                               context_instance=RequestContext(request))
 
+@login_required
+def fork_status(request, organization_id):
+    """Report progress of an organization's fork as json, for the fork page to poll."""
+    forking_organization = Organization.objects.get(id=organization_id)
+    if not has_edit_permission(request.user, forking_organization):
+        return JsonResponse({'error': 'no edit permission'}, status=403)
+
+    fork_job = jobs.get_latest_job('fork', forking_organization)
+    if not fork_job:
+        return JsonResponse({'status': None})
+    return JsonResponse({'status': fork_job.status,
+                         'progress': fork_job.progress,
+                         'total': fork_job.total,
+                         'organization_url': reverse('competencies:organization',
+                                                     args=[organization_id,]),
+                         })
+
 @login_required
 def edit_sa_summary(request, sa_id):
     """Edit the elements in sa_summary."""
@@ -188,80 +422,67 @@ def edit_sa_summary(request, sa_id):
         redirect_url = '/no_edit_permission/' + str(organization.id)
         return redirect(redirect_url)
 
-    sdas, cas, eus = get_sda_ca_eu_elements(subject_area, kwargs)
-
-    # Respond to submitted data.
+    # Respond to submitted data. The page only submits the sa's form; other
+    #   elements are saved one at a time through element_form.
     if request.method == 'POST':
-        # Store elements that have had their privacy setting changed,
-        #   for processing after all forms have been processed.
-        privacy_changed = []
-        process_form(request, subject_area, 'sa', privacy_changed)
-        for sda in sdas:
-            process_form(request, sda, 'sda', privacy_changed)
-        for ca in cas:
-            process_form(request, ca, 'ca', privacy_changed)
-        for eu in eus:
-            process_form(request, eu, 'eu', privacy_changed)
-
-        # Cascade privacy settings appropriately.
-        #   Change to private takes precedence, so process changes to public first.
-        changed_to_public = [element for element in privacy_changed if element.public]
-        changed_to_private = [element for element in privacy_changed if not element.public]
-
-        # Cascading public happens upwards. Setting an element public makes all its
-        #   ancestors public.
-        for element in changed_to_public:
-            utils.cascade_public_up(element)
-        
-        # Cascading private happens downwards. Setting an element private hides all
-        #   its descendants.
-        for element in changed_to_private:
-            utils.cascade_visibility_down(element, 'private')
-
-        # If any privacy settings were changed, need to refresh elements
-        #   to make sure forms are based on updated elements.
-        subject_area = SubjectArea.objects.get(id=sa_id)
-        organization = subject_area.organization
-        sdas, cas, eus = get_sda_ca_eu_elements(subject_area, kwargs)
+        changed = []
+        process_form(request, subject_area, 'sa', changed)
+        if changed:
+            utils.save_edited_elements(changed)
 
         # Redirect back to view page.
         return redirect('/sa_summary/%s' % sa_id)
 
-    # Build forms. Not in an else clause, because even POST requests need
-    #  forms re-generated.
+    tree = utils.get_subject_area_tree(subject_area, kwargs)
+
+    # Only the sa's form is built here. Other elements start collapsed, and
+    #   the page loads an element's form from element_form when it's opened.
     sa_form = generate_form(subject_area, 'sa')
-    sda_forms = []
-    for sda in sdas:
-        sda_form = generate_form(sda, 'sda')
-        sda_form.my_id = sda.id
-        sda_forms.append(sda_form)
-    zipped_sda_forms = list(zip(sdas, sda_forms))
-
-    ca_forms = []
-    for ca in cas:
-        ca_form = generate_form(ca, 'ca')
-        ca_form.my_id = ca.id
-        ca_forms.append(ca_form)
-    zipped_ca_forms = list(zip(cas, ca_forms))
-
-    eu_forms = []
-    for eu in eus:
-        eu_form = generate_form(eu, 'eu')
-        eu_form.my_id = eu.id
-        eu_forms.append(eu_form)
-    zipped_eu_forms = list(zip(eus, eu_forms))
-    
 
     return render_to_response('competencies/edit_sa_summary.html',
                               {'subject_area': subject_area, 'organization': organization,
-                               'sdas': sdas, 'cas': cas, 'eus': eus,
+                               'tree': tree,
                                'sa_form': sa_form,
-                               'zipped_sda_forms': zipped_sda_forms,
-                               'zipped_ca_forms': zipped_ca_forms,
-                               'zipped_eu_forms': zipped_eu_forms,
                                },
                               context_instance=RequestContext(request))
 
+@login_required
+def element_form(request, element_type, element_id):
+    """Edit a single element, for the edit page's inline forms.
+    GET returns the element's form as html, in json. POST saves the element,
+      writing only its changed fields, and returns the saved element as json;
+      an invalid form comes back with its errors, with status 400.
+    """
+    if element_type not in ELEMENT_FORMS:
+        return JsonResponse({'error': 'unknown element type'}, status=404)
+    model, form_class = ELEMENT_FORMS[element_type]
+    try:
+        element = model.objects.get(id=element_id)
+    except model.DoesNotExist:
+        return JsonResponse({'error': 'no such element'}, status=404)
+    if not has_edit_permission(request.user, element.get_organization()):
+        return JsonResponse({'error': 'no edit permission'}, status=403)
+
+    status = 200
+    if request.method != 'POST':
+        form = form_class(instance=element)
+    else:
+        form = form_class(request.POST, instance=element)
+        if form.is_valid():
+            if form.has_changed():
+                utils.save_edited_elements([(element, form.changed_data)])
+            return JsonResponse({'status': 'saved',
+                                 'element': api.serialize_element(element, api.ELEMENT_FIELDS),
+                                 })
+        status = 400
+
+    form_url = reverse('competencies:element_form', args=[element_type, element.id])
+    html = render_to_string('competencies/element_form.html',
+                            {'form': form, 'form_url': form_url},
+                            context_instance=RequestContext(request))
+    return JsonResponse({'status': 'invalid' if status == 400 else 'form', 'html': html},
+                        status=status)
+
 def edit_sa_summary_order(request, sa_id):
     """Modify the order of sdas, cas, and eus within a subject area."""
 
@@ -274,12 +495,12 @@ def edit_sa_summary_order(request, sa_id):
         redirect_url = '/no_edit_permission/' + str(organization.id)
         return redirect(redirect_url)
 
-    sdas, cas, eus = get_sda_ca_eu_elements(subject_area, kwargs)
+    tree = utils.get_subject_area_tree(subject_area, kwargs)
 
 
     return render_to_response('competencies/edit_sa_summary_order.html',
                               {'subject_area': subject_area, 'organization': organization,
-                               'sdas': sdas, 'cas': cas, 'eus': eus,
+                               'tree': tree,
                                },
                               context_instance=RequestContext(request))
 
@@ -292,8 +513,8 @@ def move_element(request, element_type, element_id, direction, sa_id):
     object_to_move = get_model('competencies', element_type).objects.get(id=element_id)
     order = get_parent_order(object_to_move)
 
-    # Make sure user can edit this organization.
-    if request.user not in sa.organization.editors.all():
+    # Make sure user can edit this element's organization.
+    if not has_edit_permission(request.user, object_to_move.organization):
         redirect_url = reverse('competencies:index')
         return redirect(redirect_url)
     
@@ -333,44 +554,117 @@ def move_element(request, element_type, element_id, direction, sa_id):
 
     return redirect(edit_order_url)
 
+# The groups of siblings that can be reordered, as (parent type, child type).
+#   An sa's cas are its general cas; an sda's cas are grouped under the sda.
+REORDER_GROUPS = (('o', 'sa'), ('sa', 'sda'), ('sa', 'ca'), ('sda', 'ca'), ('ca', 'eu'),
+                  ('eu', 'lt'))
+
+@login_required
+def reorder_elements(request, parent_type, parent_id, element_type):
+    """Put a whole group of siblings in a new order, in one request.
+    POST order, a comma-separated list of every sibling's id in its new order.
+      Returns json, with status 400 if order doesn't match the group.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST the new order'}, status=405)
+    if (parent_type, element_type) not in REORDER_GROUPS:
+        return JsonResponse({'error': 'unknown group'}, status=404)
+
+    parent_model = Organization if parent_type == 'o' else MODELS_BY_KEY[parent_type]
+    try:
+        parent = parent_model.objects.get(id=parent_id)
+    except parent_model.DoesNotExist:
+        return JsonResponse({'error': 'no such element'}, status=404)
+    organization = parent if parent_type == 'o' else parent.get_organization()
+    if not has_edit_permission(request.user, organization):
+        return JsonResponse({'error': 'no edit permission'}, status=403)
+
+    if parent_type == 'o':
+        parent_path = build_tree_path([('o', parent.id)])
+    else:
+        parent_path = parent.get_subtree_path()
+    siblings = MODELS_BY_KEY[element_type].objects.filter(tree_path=parent_path)
+    try:
+        new_ids = [int(id) for id in request.POST.get('order', '').split(',') if id.strip()]
+        num_moved = utils.reorder_siblings(siblings, new_ids)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'status': 'saved', 'order': new_ids, 'moved': num_moved})
+
+@login_required
 def delete_element(request, element_type, element_id):
     """Confirm that user wants to delete an element, and all its descendants.
-    Option to cancel, which will go back to edit_sa_summary,
-    or delete element which will then redirect to sa_summary."""
-    # DEV: Can use a single delete_element page.
-    #  GET request shows confirmation form; POST request follows through on delete.
-
-    # DEV: Should pass element type alias, which should be used on submit button.
+    GET shows the confirmation form, with a count of what will be deleted.
+    POST moves the element to the organization's trash, then redirects to
+      sa_summary, or to the organization if a subject area was deleted.
+    """
+    models_by_name = {model.__name__: model for model in TREE_MODELS}
+    if element_type not in models_by_name:
+        return redirect(reverse('competencies:index'))
+    element = models_by_name[element_type].objects.get(id=element_id)
+    org = element.get_organization()
+    if not has_edit_permission(request.user, org):
+        redirect_url = '/no_edit_permission/' + str(org.id)
+        return redirect(redirect_url)
+    sa = SubjectArea.objects.get(id=element.get_subject_area_id())
 
-    # DEV: This needs to be generalized.
-    eu = EssentialUnderstanding.objects.get(id=element_id)
-    ca = eu.competency_area
-    sa = ca.subject_area
-    org = sa.organization
-    
-    if request.method == 'POST' and request.POST['confirm_delete']:
-        eu.delete()
+    if request.method == 'POST' and request.POST.get('confirm_delete'):
+        trash.trash_element(element, request.user)
+        if element.path_key == 'sa':
+            return redirect(reverse('competencies:organization', args=[org.id,]))
         return redirect(reverse('competencies:sa_summary', args=[sa.id,]))
 
+    descendant_counts = []
+    for model, descendants in utils.get_descendant_querysets(element):
+        count = descendants.count()
+        if count:
+            descendant_counts.append((getattr(org, 'alias_' + model.path_key), count))
     return render_to_response('competencies/delete_element.html',
                               {'organization': org, 'subject_area': sa,
-                               'eu': eu,
+                               'element': element,
+                               'element_text': getattr(element, element.text_field),
+                               'element_alias': getattr(org, 'alias_' + element.path_key),
+                               'descendant_counts': descendant_counts,
+                               'retention_days': trash.get_retention_days(),
                                },
                               context_instance=RequestContext(request))
 
+@login_required
+def organization_trash(request, organization_id):
+    """List an organization's deleted elements. POST restore, the id of a trash
+    entry, to put that element back."""
+    organization = Organization.objects.get(id=organization_id)
+    if not has_edit_permission(request.user, organization):
+        return redirect(reverse('competencies:no_edit_permission', args=[organization_id,]))
+
+    entries = organization.trashentry_set.select_related('deleted_by').order_by('-deleted_at')
+    restore_failed = None
+    if request.method == 'POST':
+        entry_id = request.POST.get('restore', '')
+        if not entry_id.isdigit():
+            return HttpResponseBadRequest('POST restore, the id of a trash entry.')
+        # The entry is gone if someone else restored it, or it was purged.
+        entry = get_object_or_404(entries, id=entry_id)
+        if trash.restore_element(entry):
+            return redirect(reverse('competencies:organization_trash', args=[organization_id,]))
+        restore_failed = entry
+
+    for entry in entries:
+        entry.alias = getattr(organization, 'alias_' + entry.element_type)
+    return render_to_response('competencies/organization_trash.html',
+                              {'organization': organization,
+                               'entries': entries,
+                               'restore_failed': restore_failed,
+                               'retention_days': trash.get_retention_days(),
+                               },
+                              context_instance=RequestContext(request))
 
-def get_sda_ca_eu_elements(subject_area, kwargs):
-    """Get all sdas, cas, and eus associated with a subject area."""
-    sdas = subject_area.subdisciplinearea_set.filter(**kwargs)
-    cas = subject_area.competencyarea_set.filter(**kwargs)
-    eus = []
-    for ca in cas:
-        for eu in ca.essentialunderstanding_set.filter(**kwargs):
-            eus.append(eu)
-    return (sdas, cas, eus)
 
-def process_form(request, instance, element_type, privacy_changed):
-    """Process a form for a single element."""
+def process_form(request, instance, element_type, changed):
+    """Process a form for a single element.
+    Validating the form updates instance, but nothing is saved. If anything
+      changed, (instance, changed fields) is added to changed.
+    """
     prefix = '%s_form_%d' % (element_type, instance.id)
 
     if element_type == 'sa':
@@ -382,11 +676,8 @@ def process_form(request, instance, element_type, privacy_changed):
     elif element_type == 'eu':
         form = EssentialUnderstandingForm(request.POST, prefix=prefix, instance=instance)
 
-    if form.is_valid():
-        modified_element = form.save()
-        # If privacy setting changed, add to list for processing.
-        if 'public' in form.changed_data:
-            privacy_changed.append(modified_element)
+    if form.is_valid() and form.has_changed():
+        changed.append((instance, form.changed_data))
 
     return form
 
@@ -528,7 +819,7 @@ def new_eu(request, ca_id):
 
 def get_visibility_filter(user, organization):
     # Get filter for visibility, based on logged-in status.
-    if user.is_authenticated() and user in organization.editors.all():
+    if is_editor(user, organization):
         kwargs = {}
     else:
         kwargs = {'{0}'.format('public'): True}
@@ -539,10 +830,21 @@ def has_edit_permission(user, organization):
     """Checks whether given user has permission to edit given object.
     """
     # Returns True if allowed to edit, False if not allowed to edit
-    if user in organization.editors.all():
-        return True
-    else:
+    return is_editor(user, organization)
+
+def is_editor(user, organization):
+    """Checks whether user is one of organization's editors.
+    Asks the db with one indexed existence check per organization, and
+      remembers the answer on the user object for the rest of the request.
+    """
+    if not user.is_authenticated():
         return False
+    editor_of = getattr(user, '_editor_of', None)
+    if editor_of is None:
+        editor_of = user._editor_of = {}
+    if organization.id not in editor_of:
+        editor_of[organization.id] = organization.editors.filter(id=user.id).exists()
+    return editor_of[organization.id]
 
 
 # Methods to deal with ordering issue around order_with_respect_to
@@ -565,8 +867,12 @@ def set_parent_order(child_object, order):
     # DEV: May make ca.get_parent() always return sa?
     if parent_object.__class__.__name__ == 'SubdisciplineArea':
         parent_object = parent_object.subject_area
-    order_method = 'set_' + child_object.__class__.__name__.lower() + '_order'
-    getattr(parent_object, order_method)(order)
+    # Only the elements that are out of place are written; see competencies.ordering.
+    group_field = child_object._meta.order_with_respect_to.name
+    siblings = type(child_object).objects.filter(**{group_field: parent_object})
+    with transaction.atomic():
+        if ordering.apply_order(siblings, order):
+            bump_summary_versions([child_object.get_subject_area_id()])
 
 @login_required
 def new_organization(request):
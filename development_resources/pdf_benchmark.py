@@ -0,0 +1,100 @@
+"""Time sa_summary pdf generation over synthetic subject areas.
+
+Elements are built in memory, so no database is needed. Text comes from
+  lorem_ipsum.txt, with a fixed random seed so every run lays out the same
+  documents.
+
+Each size is timed with every engine in pdf_cache.SUMMARY_ENGINES, unless
+  --engines picks some.
+
+Usage, from the project root:
+    $ python development_resources/pdf_benchmark.py
+    $ python development_resources/pdf_benchmark.py --sizes 10 100 --repeat 5
+    $ python development_resources/pdf_benchmark.py --engines canvas
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'opencompetencies.settings')
+os.environ.setdefault('DJANGO_SECRET_KEY', 'pdf_benchmark')
+
+import django
+django.setup()
+
+from competencies.models import Organization, SubjectArea, SubdisciplineArea
+from competencies.models import CompetencyArea, EssentialUnderstanding
+from competencies.pdf_cache import SUMMARY_ENGINES, get_summary_engine
+from competencies.utils import SubjectAreaTree
+from development_resources import lorem_ipsum
+
+EUS_PER_CA = 4
+CAS_PER_SDA = 10
+
+
+def build_tree(num_cas):
+    """Build an unsaved subject area with num_cas cas, and return its org and tree.
+    A fifth of the cas are general cas; the rest are split into sdas."""
+    org = Organization(id=1, name='Benchmark School')
+    sa = SubjectArea(id=1, organization=org, subject_area='Benchmark Subject Area')
+    num_general_cas = num_cas // 5
+    num_sdas = (num_cas - num_general_cas + CAS_PER_SDA - 1) // CAS_PER_SDA
+    sdas = [SubdisciplineArea(id=sda_num + 1, subject_area=sa,
+                              subdiscipline_area=lorem_ipsum.get_words(3))
+            for sda_num in range(num_sdas)]
+
+    cas, eu_id = [], 1
+    for ca_num in range(num_cas):
+        sda = None
+        if ca_num >= num_general_cas:
+            sda = sdas[(ca_num - num_general_cas) // CAS_PER_SDA]
+        ca = CompetencyArea(id=ca_num + 1, subject_area=sa, subdiscipline_area=sda,
+                            competency_area=lorem_ipsum.get_paragraph(1))
+        ca.eus = []
+        for eu_num in range(EUS_PER_CA):
+            eu = EssentialUnderstanding(id=eu_id, competency_area=ca,
+                                        essential_understanding=lorem_ipsum.get_paragraph(2))
+            eu.lts = []
+            ca.eus.append(eu)
+            eu_id += 1
+        cas.append(ca)
+    return org, sa, SubjectAreaTree(sa, sdas, cas)
+
+def time_summary(engine, org, sa, tree, repeat):
+    """Return the best of repeat timings, and the size of the pdf."""
+    summary_class = get_summary_engine(engine)
+    best = None
+    for run in range(repeat):
+        buffer = BytesIO()
+        start = time.perf_counter()
+        summary_class(buffer).makeSummary(org, sa, tree)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(buffer.getvalue())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Number of cas in each synthetic subject area.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per size; the best time is reported.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', nargs='+', choices=SUMMARY_ENGINES,
+                        default=list(SUMMARY_ENGINES))
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    print('%-10s %8s %8s %12s %12s' % ('engine', 'cas', 'eus', 'seconds', 'pdf bytes'))
+    for num_cas in args.sizes:
+        org, sa, tree = build_tree(num_cas)
+        for engine in args.engines:
+            seconds, num_bytes = time_summary(engine, org, sa, tree, args.repeat)
+            print('%-10s %8d %8d %12.3f %12d' % (engine, num_cas, len(tree.eus), seconds,
+                                                 num_bytes))
+
+if __name__ == '__main__':
+    main()
@@ -68,6 +68,21 @@ MEDIA_URL = ''
 # Example: "/var/www/example.com/static/"
 STATIC_ROOT = os.path.join(PROJECT_PATH, 'staticfiles')
 
+# Generated pdfs are cached here, named by a hash of their content.
+PDF_CACHE_DIR = os.path.join(PROJECT_PATH, 'pdf_cache')
+
+# Days a cached pdf is kept after it's built. Edits leave old pdfs behind.
+PDF_CACHE_MAX_AGE_DAYS = 30
+
+# Worker processes used to lay out organization pdfs. None uses one per cpu.
+PDF_PROCESSES = None
+
+# Rendered subject area summaries kept in each process's in-memory cache.
+SUMMARY_CACHE_SIZE = 500
+
+# Days a deleted element stays in its organization's trash before it's purged.
+TRASH_RETENTION_DAYS = 30
+
 # URL prefix for static files.
 # Example: "http://example.com/static/", "http://static.example.com/"
 STATIC_URL = '/static/'